@@ -4,7 +4,7 @@ from flask import Flask, render_template
 from flask_login import LoginManager
 from flask_wtf import CSRFProtect
 from .config import Config
-from .db import init_db
+from .db import init_db, release_conns
 from .auth import load_user
 
 login_manager = LoginManager()
@@ -24,10 +24,18 @@ def create_app():
     def _load(uid):
         return load_user(uid)
 
+    # Conexões do pool voltam ao final de cada request/contexto
+    app.teardown_appcontext(release_conns)
+
     # DB init (SQLite manual, sem SQLAlchemy)
     with app.app_context():
         init_db()  # <- sem argumentos
 
+    # Escritor único (group commit) — opcional
+    if app.config.get("WRITER_ENABLED"):
+        from .db_writer import init_writer
+        init_writer(app)
+
     # Blueprints
     from .routes.auth_routes import bp as bp_auth
     from .routes.users import bp as bp_users
@@ -35,6 +43,7 @@ def create_app():
     from .routes.categories import bp as bp_categories
     from .routes.suppliers import bp as bp_suppliers
     from .routes import reports
+    from .routes.status import bp as bp_status
 
     app.register_blueprint(bp_auth)
     app.register_blueprint(bp_users)
@@ -43,6 +52,7 @@ def create_app():
     app.register_blueprint(bp_suppliers)
     app.register_blueprint(reports.bp)
     app.register_blueprint(reports.bp_export)
+    app.register_blueprint(bp_status)
 
     # Errors
     @app.errorhandler(404)
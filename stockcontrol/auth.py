@@ -1,14 +1,76 @@
-from flask_login import UserMixin
+import time
+from flask import current_app, session
+from .cache import TTLCache
+from .config import Config
 from .db import get_conn
 
-class User(UserMixin):
+class User:
+    """Usuário da sessão (mesma interface do UserMixin, sem __dict__ por instância)."""
+    __slots__ = ("id", "username", "role")
+    __hash__ = object.__hash__
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
     def __init__(self, row):
         self.id = row["id"]
         self.username = row["username"]
         self.role = row["role"]
 
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.id == other.id
+        return NotImplemented
+
+# id -> User; create/delete em routes/users.py e ensure_admin invalidam,
+# outros workers enxergam a mudança em até USER_CACHE_TTL_S
+_user_cache = TTLCache("users", maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL_S)
+
+# Sessão assinada: [id, username, role, verificado_em] (SESSION_USER_DATA=1)
+_SESSION_KEY = "_user"
+
+def invalidate_user(user_id=None):
+    """Descarta um usuário (ou todos) do cache local."""
+    _user_cache.invalidate(int(user_id) if user_id is not None else None)
+
+def remember_user(user):
+    """Guarda id/usuário/papel na sessão para pular o banco até o próximo TTL."""
+    if current_app.config.get("SESSION_USER_DATA"):
+        session[_SESSION_KEY] = [user.id, user.username, user.role, time.time()]
+
+def forget_user():
+    if _SESSION_KEY in session:
+        session.pop(_SESSION_KEY)
+
+def _from_session(user_id):
+    data = session.get(_SESSION_KEY)
+    if not data or str(data[0]) != str(user_id) or time.time() - data[3] >= Config.USER_CACHE_TTL_S:
+        return None
+    return User({"id": data[0], "username": data[1], "role": data[2]})
+
 def load_user(user_id):
-    conn = get_conn(); c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE id=?", (user_id,))
-    row = c.fetchone(); conn.close()
-    return User(row) if row else None
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    if current_app.config.get("SESSION_USER_DATA"):
+        user = _from_session(uid)
+        if user is not None:
+            return user
+
+    user = _user_cache.get(uid)
+    if user is None:
+        conn = get_conn(); c = conn.cursor()
+        c.execute("SELECT id, username, role FROM users WHERE id=?", (uid,))
+        row = c.fetchone(); conn.close()
+        if not row:
+            forget_user()
+            return None
+        user = User(row)
+        _user_cache.put(uid, user)
+    remember_user(user)
+    return user
@@ -0,0 +1,131 @@
+# stockcontrol/cache.py
+# Caches em memória (por processo) validados por versão.
+# A tabela cache_versions é incrementada por triggers quando os dados mudam,
+# então qualquer worker detecta que seu cache ficou velho com uma leitura por PK.
+import threading
+import time
+from collections import OrderedDict
+
+_registry = {}
+
+def get_version(c, name: str) -> int:
+    """Versão atual de um conjunto de dados (0 se ainda não registrado)."""
+    row = c.execute("SELECT version FROM cache_versions WHERE name=?", (name,)).fetchone()
+    return row[0] if row else 0
+
+class VersionedCache:
+    """
+    LRU limitado; cada entrada guarda a versão com que foi calculada e só é
+    devolvida se a versão informada na leitura for a mesma.
+    """
+    def __init__(self, name: str, maxsize: int = 256):
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        _registry[name] = self
+
+    def get(self, key, version=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if version is not None and entry[0] != version:
+                del self._data[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version=None):
+        with self._lock:
+            self._data[key] = (version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+class TTLCache:
+    """
+    LRU limitado em que cada entrada expira após ttl segundos; para dados sem
+    versão no banco (ex.: usuários), onde um atraso curto entre workers é aceitável.
+    """
+    def __init__(self, name: str, maxsize: int = 256, ttl: float = 60.0):
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = max(0.0, float(ttl))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        _registry[name] = self
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _registry.items()}
@@ -4,3 +4,29 @@ class Config:
     APP_SECRET = os.environ.get("APP_SECRET", "dev-key")
     DB_PATH = os.environ.get("DB_PATH", "estoque.db")
     PER_PAGE = int(os.environ.get("PER_PAGE", "10"))
+    BARCODE_CACHE_SIZE = int(os.environ.get("BARCODE_CACHE_SIZE", "50000"))  # códigos resolvidos em memória (LRU)
+    HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "50"))  # movimentos por página em /produto/<pid>
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))  # conexões ociosas mantidas por processo
+    DB_BACKFILL_ON_START = os.environ.get("DB_BACKFILL_ON_START", "1") == "1"  # 0: backfills só via tools/ (bases grandes)
+    DB_BUSY_RETRIES = int(os.environ.get("DB_BUSY_RETRIES", "5"))        # novas tentativas se o banco estiver ocupado
+    DB_BUSY_BACKOFF_MS = float(os.environ.get("DB_BUSY_BACKOFF_MS", "20"))  # espera base (dobra a cada tentativa)
+    # Escritor único com group commit (opcional): movimentos e barcodes gravados em lotes
+    WRITER_ENABLED = os.environ.get("WRITER_ENABLED", "0") == "1"
+    WRITER_BATCH_SIZE = int(os.environ.get("WRITER_BATCH_SIZE", "200"))          # máx. mutações por COMMIT
+    WRITER_MAX_LATENCY_MS = float(os.environ.get("WRITER_MAX_LATENCY_MS", "5"))  # espera máx. para fechar o lote
+    WRITER_TIMEOUT_S = float(os.environ.get("WRITER_TIMEOUT_S", "30"))           # espera do request pelo commit
+    # Usuários do Flask-Login em memória (TTL) e, opcionalmente, papel na sessão assinada
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+    USER_CACHE_TTL_S = float(os.environ.get("USER_CACHE_TTL_S", "60"))           # também revalida a sessão
+    SESSION_USER_DATA = os.environ.get("SESSION_USER_DATA", "0") == "1"          # id/usuário/papel no cookie
+    EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "1000"))  # linhas por bloco nas exportações CSV
+    PARQUET_ROW_GROUP_SIZE = int(os.environ.get("PARQUET_ROW_GROUP_SIZE", "65536"))  # linhas por row group
+    PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+    VALUATION_PAGE_SIZE = int(os.environ.get("VALUATION_PAGE_SIZE", "100"))  # produtos por página em /relatorios/valorizacao
+    LOW_EVENTS_MAX_WAIT_S = int(os.environ.get("LOW_EVENTS_MAX_WAIT_S", "10"))  # long-poll máx. de /relatorios/baixo-estoque/eventos (0 desliga)
+    ASOF_CHUNK_SIZE = int(os.environ.get("ASOF_CHUNK_SIZE", "50000"))  # movimentos por bloco no replay da posição histórica
+    ANALYTICS_WINDOWS = os.environ.get("ANALYTICS_WINDOWS", "7,30,90")    # janelas (dias) do consumo médio
+    ANALYTICS_COVER_DAYS = int(os.environ.get("ANALYTICS_COVER_DAYS", "30"))  # janela usada na cobertura
+    ANALYTICS_CLASS_DAYS = int(os.environ.get("ANALYTICS_CLASS_DAYS", "364"))  # janela do ABC/XYZ (semanas inteiras)
+    ANALYTICS_ABC_CUTS = os.environ.get("ANALYTICS_ABC_CUTS", "0.8,0.95")   # % acumulado do valor: A, B
+    ANALYTICS_XYZ_CUTS = os.environ.get("ANALYTICS_XYZ_CUTS", "0.5,1.0")    # coef. de variação semanal: X, Y
@@ -1,14 +1,19 @@
+import random
 import sqlite3
-from flask import current_app
+import threading
+import time
+from flask import current_app, g, has_app_context
 from werkzeug.security import generate_password_hash
+from .cache import VersionedCache, get_version
+from .config import Config
 from .utils import now_str
 
 # ==============================
 # Conexão + PRAGMAs recomendados
 # ==============================
-def get_conn():
-    db_path = current_app.config["DB_PATH"]
-    conn = sqlite3.connect(db_path)
+def _connect(db_path: str):
+    """Abre uma conexão física e aplica os PRAGMAs (uma vez por conexão)."""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     # Segurança, concorrência leve e performance
     conn.execute("PRAGMA foreign_keys = ON;")        # respeitar FKs
@@ -18,6 +23,172 @@ def get_conn():
     conn.execute("PRAGMA temp_store = MEMORY;")      # operações temporárias em memória
     return conn
 
+class ConnectionPool:
+    """
+    Pool de conexões SQLite por arquivo de banco.
+    - Conexões ociosas ficam numa pilha (LIFO) e são reutilizadas sem reconectar.
+    - PRAGMAs rodam apenas quando a conexão física é criada.
+    - Ao devolver, transação pendente é desfeita (mesmo efeito do close() antigo).
+    """
+    def __init__(self, db_path: str, size: int = 8):
+        self.db_path = db_path
+        self.size = max(0, int(size))
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.in_use = 0
+
+    def acquire(self):
+        with self._lock:
+            raw = self._idle.pop() if self._idle else None
+            if raw is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.in_use += 1
+        if raw is None:
+            try:
+                raw = _connect(self.db_path)
+            except Exception:
+                with self._lock:
+                    self.in_use -= 1
+                raise
+            with self._lock:
+                self.created += 1
+        return raw
+
+    def release(self, raw):
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+            raw.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            # conexão em estado ruim: descarta
+            with self._lock:
+                self.in_use -= 1
+            raw.close()
+            return
+        with self._lock:
+            self.in_use -= 1
+            if len(self._idle) < self.size:
+                self._idle.append(raw)
+                raw = None
+        if raw is not None:
+            raw.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for raw in idle:
+            raw.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "db_path": self.db_path,
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": self.in_use,
+                "created": self.created,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+class PooledConnection:
+    """
+    Proxy para sqlite3.Connection: close() devolve ao pool em vez de fechar.
+    Mantém a mesma interface usada nas rotas (cursor/execute/commit/close).
+    """
+    def __init__(self, pool: ConnectionPool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(raw, name)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, *exc):
+        return self._raw.__exit__(*exc)
+
+    @property
+    def closed(self) -> bool:
+        return self._raw is None
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.release(raw)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: str = None) -> ConnectionPool:
+    if db_path is None:
+        db_path = current_app.config["DB_PATH"]
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                size = current_app.config.get("DB_POOL_SIZE", 8) if has_app_context() else 8
+                pool = _pools[db_path] = ConnectionPool(db_path, size)
+    return pool
+
+def pool_stats() -> dict:
+    """Estatísticas do pool do banco atual (tamanho, ociosas, hit rate)."""
+    return get_pool().stats()
+
+def get_conn():
+    pool = get_pool()
+    conn = PooledConnection(pool, pool.acquire())
+    # registra no contexto para devolver no teardown caso a rota esqueça o close()
+    if has_app_context():
+        conns = g.setdefault("_db_conns", [])
+        conns[:] = [c for c in conns if not c.closed]
+        conns.append(conn)
+    return conn
+
+def is_busy_error(exc) -> bool:
+    """SQLITE_BUSY / SQLITE_LOCKED chegam como OperationalError com essa mensagem."""
+    msg = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+def with_busy_retry(fn, retries: int = None, backoff_ms: float = None):
+    """
+    Executa fn() repetindo em caso de banco ocupado, com backoff exponencial + jitter.
+    fn deve abrir e fechar a própria transação (idempotente até o commit).
+    """
+    if retries is None or backoff_ms is None:
+        cfg = current_app.config if has_app_context() else {}
+        if retries is None:
+            retries = cfg.get("DB_BUSY_RETRIES", 5)
+        if backoff_ms is None:
+            backoff_ms = cfg.get("DB_BUSY_BACKOFF_MS", 20)
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt >= retries:
+                raise
+            delay = (backoff_ms / 1000.0) * (2 ** attempt)
+            time.sleep(delay * (0.5 + random.random()))
+            attempt += 1
+
+def release_conns(exc=None):
+    """teardown_appcontext: devolve ao pool as conexões ainda abertas no contexto."""
+    for conn in g.pop("_db_conns", ()):
+        conn.close()
+
 # ==============================
 # Helpers de migração simples
 # ==============================
@@ -52,6 +223,10 @@ def _ensure_schema_migrations(c):
         )
     """)
 
+def _has_migration(c, key: str) -> bool:
+    row = c.execute("SELECT 1 FROM schema_migrations WHERE key=? LIMIT 1", (key,)).fetchone()
+    return row is not None
+
 def _mark_migration(c, key: str):
     c.execute("INSERT OR IGNORE INTO schema_migrations(key, applied_at) VALUES(?, ?)",
               (key, now_str()))
@@ -82,6 +257,7 @@ def _create_base_tables(c):
         avg_cost     REAL DEFAULT 0,   -- custo médio (WAC)
         min_qty      REAL DEFAULT 0,
         current_qty  REAL DEFAULT 0,   -- mantido por triggers de movimentos
+        primary_barcode TEXT,          -- código primário (ou o mais antigo); mantido por triggers de barcodes
         created_at   TEXT,
         FOREIGN KEY(category_id) REFERENCES categories(id),
         FOREIGN KEY(supplier_id) REFERENCES suppliers(id)
@@ -96,6 +272,8 @@ def _create_base_tables(c):
         reason     TEXT,
         note       TEXT,
         ts         TEXT,      -- timestamp ISO (use now_str() ao inserir)
+        ts_epoch   INTEGER,   -- ts em segundos (= strftime('%s', ts)); filtros/ordem sargáveis
+        balance_applied INTEGER NOT NULL DEFAULT 0,  -- 1 = saldo/CMP já aplicados pelo serviço (triggers ignoram)
         FOREIGN KEY(product_id) REFERENCES products(id)
     )""")
 
@@ -107,6 +285,109 @@ def _create_base_tables(c):
         created_at TEXT
     )""")
 
+    # Versões de dados para caches em memória (incrementadas por triggers)
+    c.execute("""CREATE TABLE IF NOT EXISTS cache_versions(
+        name    TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )""")
+    c.execute("INSERT OR IGNORE INTO cache_versions(name, version) VALUES('products', 0)")
+    c.execute("INSERT OR IGNORE INTO cache_versions(name, version) VALUES('barcodes', 0)")
+    c.execute("INSERT OR IGNORE INTO cache_versions(name, version) VALUES('categories', 0)")
+    c.execute("INSERT OR IGNORE INTO cache_versions(name, version) VALUES('suppliers', 0)")
+
+    # Totais de valorização por categoria (0 = sem categoria), mantidos por triggers em products
+    c.execute("""CREATE TABLE IF NOT EXISTS valuation_totals(
+        category_id INTEGER PRIMARY KEY,
+        items       INTEGER NOT NULL DEFAULT 0,
+        qty         REAL NOT NULL DEFAULT 0,
+        total_price REAL NOT NULL DEFAULT 0,
+        total_cost  REAL NOT NULL DEFAULT 0
+    )""")
+
+    # Transições de baixo estoque (feed: entrou em LOW / RECOVERED)
+    c.execute("""CREATE TABLE IF NOT EXISTS low_stock_events(
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id  INTEGER NOT NULL,
+        event       TEXT NOT NULL CHECK(event IN ('LOW','RECOVERED')),
+        current_qty REAL,
+        min_qty     REAL,
+        ts          TEXT NOT NULL
+    )""")
+
+    # Movimentos excluídos (feed incremental para o ETL espelhar deletes)
+    c.execute("""CREATE TABLE IF NOT EXISTS stock_movement_tombstones(
+        seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+        movement_id INTEGER NOT NULL,
+        product_id  INTEGER,
+        deleted_at  TEXT NOT NULL
+    )""")
+
+    # Checkpoints da posição histórica: saldo/CMP por produto com os movimentos
+    # de ts < cutoff ('AAAA-MM-DD'). Movimento retroativo apaga os cortes posteriores.
+    c.execute("""CREATE TABLE IF NOT EXISTS stock_checkpoint_runs(
+        cutoff     TEXT PRIMARY KEY,
+        items      INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS stock_checkpoints(
+        cutoff     TEXT NOT NULL REFERENCES stock_checkpoint_runs(cutoff) ON DELETE CASCADE,
+        product_id INTEGER NOT NULL,
+        qty        REAL NOT NULL,
+        avg_cost   REAL NOT NULL,
+        PRIMARY KEY(cutoff, product_id)
+    ) WITHOUT ROWID""")
+
+    # Rollup diário por produto (dashboard), mantido por triggers em stock_movements.
+    # day = 'AAAA-MM-DD' de ts; cost_in soma qtd x custo só das entradas com custo.
+    c.execute("""CREATE TABLE IF NOT EXISTS movement_daily(
+        product_id INTEGER NOT NULL,
+        day        TEXT NOT NULL,
+        qty_in     REAL NOT NULL DEFAULT 0,
+        qty_out    REAL NOT NULL DEFAULT 0,
+        cost_in    REAL NOT NULL DEFAULT 0,
+        count      INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(product_id, day)
+    ) WITHOUT ROWID""")
+    # Mesmo rollup por categoria atual do produto (0 = sem categoria): linhas
+    # categorias x dias, para séries e tendências que não dependem do catálogo
+    c.execute("""CREATE TABLE IF NOT EXISTS category_daily(
+        category_id INTEGER NOT NULL,
+        day         TEXT NOT NULL,
+        qty_in      REAL NOT NULL DEFAULT 0,
+        qty_out     REAL NOT NULL DEFAULT 0,
+        cost_in     REAL NOT NULL DEFAULT 0,
+        count       INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(category_id, day)
+    ) WITHOUT ROWID""")
+
+    # Giro por produto (job em lote services.analytics; substituído a cada rodada)
+    c.execute("""CREATE TABLE IF NOT EXISTS product_analytics(
+        product_id        INTEGER PRIMARY KEY,
+        avg_daily         REAL NOT NULL DEFAULT 0,   -- consumo médio diário (janela ANALYTICS_COVER_DAYS)
+        days_cover        REAL,                      -- current_qty / avg_daily no cálculo (NULL = sem consumo)
+        consumption_value REAL NOT NULL DEFAULT 0,   -- saídas x CMP na janela de classificação
+        cv                REAL,                      -- coef. de variação das saídas semanais
+        abc               TEXT CHECK(abc IN ('A','B','C')),
+        xyz               TEXT CHECK(xyz IN ('X','Y','Z')),
+        computed_at       TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS product_consumption(
+        product_id  INTEGER NOT NULL,
+        window_days INTEGER NOT NULL,
+        avg_daily   REAL NOT NULL,
+        PRIMARY KEY(product_id, window_days)
+    ) WITHOUT ROWID""")
+
+    # Marca d'água da auditoria ledger x products (modo incremental)
+    c.execute("""CREATE TABLE IF NOT EXISTS audit_watermarks(
+        name          TEXT PRIMARY KEY,
+        movement_id   INTEGER NOT NULL DEFAULT 0,   -- maior stock_movements.id já auditado
+        tombstone_seq INTEGER NOT NULL DEFAULT 0,   -- maior stock_movement_tombstones.seq já auditado
+        products      INTEGER,
+        mismatches    INTEGER,
+        updated_at    TEXT
+    )""")
+
     # === Barcodes ============================================================
     c.execute("""
     CREATE TABLE IF NOT EXISTS product_barcodes(
@@ -130,6 +411,12 @@ def _light_migrations(c):
     _ensure_col(c, "products", "category_id INTEGER")
     _ensure_col(c, "products", "supplier_id INTEGER")
     _ensure_col(c, "products", "avg_cost REAL DEFAULT 0")
+    _ensure_col(c, "products", "primary_barcode TEXT")
+    _ensure_col(c, "products", "is_low INTEGER NOT NULL DEFAULT 0")  # current_qty <= min_qty; mantido por triggers
+
+    # Movimentos lançados por services.inventory.post_movement já aplicam saldo/CMP
+    _ensure_col(c, "stock_movements", "balance_applied INTEGER NOT NULL DEFAULT 0")
+    _ensure_col(c, "stock_movements", "ts_epoch INTEGER")
 
     # Garante colunas recentes em product_barcodes
     _ensure_col(c, "product_barcodes", "is_primary INTEGER NOT NULL DEFAULT 0")
@@ -170,8 +457,22 @@ def apply_indexes(c):
     c.execute("CREATE INDEX IF NOT EXISTS idx_products_cat ON products(category_id)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_products_sup ON products(supplier_id)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_products_qty ON products(current_qty)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_movs_prod  ON stock_movements(product_id)")
+    # Ordenações da listagem (keyset): o id (rowid) já entra no fim de todo índice
+    # como desempate, então (coluna) equivale a (coluna, id)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_name   ON products(name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_price  ON products(price)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_margin ON products((price - avg_cost))")
+    # Baixo estoque: índice parcial só com os produtos marcados (lista já em ordem de nome)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_low ON products(name) WHERE is_low = 1")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_low_events_product ON low_stock_events(product_id)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_movs_ts    ON stock_movements(ts)")
+    # histórico por produto: filtro por período + ordem por data saem do mesmo índice
+    # (o prefixo product_id substitui o antigo idx_movs_prod)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movs_prod_ts ON stock_movements(product_id, ts_epoch)")
+    c.execute("DROP INDEX IF EXISTS idx_movs_prod")
+    # Rollup diário: janela por dia cobrindo as somas (product_id vem da PK)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_mdaily_day ON movement_daily(day, qty_in, qty_out, cost_in, count)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cdaily_day ON category_daily(day, qty_in, qty_out, cost_in, count)")
 
     # Barcodes
     c.execute("CREATE INDEX IF NOT EXISTS idx_barcodes_code    ON product_barcodes(code)")
@@ -188,13 +489,16 @@ def apply_indexes(c):
 # Views (relatórios úteis)
 # ==============================
 def apply_views(c):
-    # Low stock
+    # Low stock (usa o flag products.is_low, mesma regra do relatório)
+    if not _has_migration(c, "vw_low_stock_is_low"):
+        c.execute("DROP VIEW IF EXISTS vw_low_stock")
+        _mark_migration(c, "vw_low_stock_is_low")
     c.execute("""
         CREATE VIEW IF NOT EXISTS vw_low_stock AS
         SELECT
             p.id, p.sku, p.name,
             p.current_qty, p.min_qty,
-            (CASE WHEN p.min_qty > 0 AND p.current_qty < p.min_qty THEN 1 ELSE 0 END) AS is_low
+            p.is_low
         FROM products p
     """)
 
@@ -213,12 +517,25 @@ def apply_views(c):
 # Triggers (mantêm current_qty/avg_cost)
 # ==============================
 def apply_triggers(c):
+    # Trigger de UPDATE antigo disparava em qualquer coluna (ex.: backfill de ts_epoch
+    # reaplicava o CMP): recria restrito às colunas que afetam saldo/custo
+    if not _has_migration(c, "trg_mov_after_update_of_cols"):
+        c.execute("DROP TRIGGER IF EXISTS trg_mov_after_update")
+        _mark_migration(c, "trg_mov_after_update_of_cols")
+
+    # Triggers de INSERT antigos não conheciam balance_applied: recria uma vez
+    if not _has_migration(c, "trg_mov_insert_balance_applied"):
+        c.execute("DROP TRIGGER IF EXISTS trg_mov_in_after_insert")
+        c.execute("DROP TRIGGER IF EXISTS trg_mov_out_after_insert")
+        _mark_migration(c, "trg_mov_insert_balance_applied")
+
     # Entradas: soma qty, recalcula avg_cost (WAC) se unit_cost informado
+    # (ignora linhas com balance_applied = 1, já aplicadas pelo serviço)
     if not _has_trigger(c, "trg_mov_in_after_insert"):
         c.executescript("""
         CREATE TRIGGER trg_mov_in_after_insert
         AFTER INSERT ON stock_movements
-        WHEN NEW.type = 'IN'
+        WHEN NEW.type = 'IN' AND NEW.balance_applied = 0
         BEGIN
             -- atualiza qty
             UPDATE products
@@ -246,7 +563,7 @@ def apply_triggers(c):
         c.executescript("""
         CREATE TRIGGER trg_mov_out_after_insert
         AFTER INSERT ON stock_movements
-        WHEN NEW.type = 'OUT'
+        WHEN NEW.type = 'OUT' AND NEW.balance_applied = 0
         BEGIN
             UPDATE products
                SET current_qty = COALESCE(current_qty,0) - COALESCE(NEW.quantity,0)
@@ -272,11 +589,34 @@ def apply_triggers(c):
         """)
         _mark_migration(c, "trg_mov_after_delete")
 
+    # DELETE de movimento: registra tombstone para exportação incremental
+    if not _has_trigger(c, "trg_mov_tombstone"):
+        c.executescript("""
+        CREATE TRIGGER trg_mov_tombstone
+        AFTER DELETE ON stock_movements
+        BEGIN
+            INSERT INTO stock_movement_tombstones(movement_id, product_id, deleted_at)
+            VALUES (OLD.id, OLD.product_id, datetime('now', 'localtime'));
+        END;
+        """)
+        _mark_migration(c, "trg_mov_tombstone")
+
+    # Movimento com ts anterior a um checkpoint o invalida (e os seguintes)
+    for name, event, cond in (
+        ("trg_checkpoint_inv_ins", "AFTER INSERT ON stock_movements", "cutoff > NEW.ts"),
+        ("trg_checkpoint_inv_del", "AFTER DELETE ON stock_movements", "cutoff > OLD.ts"),
+        ("trg_checkpoint_inv_upd", "AFTER UPDATE OF product_id, type, quantity, unit_cost, ts ON stock_movements",
+         "cutoff > OLD.ts OR cutoff > NEW.ts"),
+    ):
+        if not _has_trigger(c, name):
+            c.executescript(f"CREATE TRIGGER {name} {event} BEGIN DELETE FROM stock_checkpoint_runs WHERE {cond}; END;")
+            _mark_migration(c, name)
+
     # UPDATE de movimento: aplica delta
     if not _has_trigger(c, "trg_mov_after_update"):
         c.executescript("""
         CREATE TRIGGER trg_mov_after_update
-        AFTER UPDATE ON stock_movements
+        AFTER UPDATE OF product_id, type, quantity, unit_cost ON stock_movements
         BEGIN
             -- Remove efeito antigo
             UPDATE products
@@ -310,6 +650,372 @@ def apply_triggers(c):
         """)
         _mark_migration(c, "trg_mov_after_update")
 
+    # ts_epoch: o app já grava a coluna; inserções cruas (tools/seed) caem aqui
+    if not _has_trigger(c, "trg_mov_ts_epoch_after_insert"):
+        c.executescript("""
+        CREATE TRIGGER trg_mov_ts_epoch_after_insert
+        AFTER INSERT ON stock_movements
+        WHEN NEW.ts_epoch IS NULL AND NEW.ts IS NOT NULL
+        BEGIN
+            UPDATE stock_movements SET ts_epoch = CAST(strftime('%s', NEW.ts) AS INTEGER)
+             WHERE id = NEW.id;
+        END;
+        """)
+        _mark_migration(c, "trg_mov_ts_epoch_after_insert")
+
+    if not _has_trigger(c, "trg_mov_ts_epoch_after_update"):
+        c.executescript("""
+        CREATE TRIGGER trg_mov_ts_epoch_after_update
+        AFTER UPDATE OF ts ON stock_movements
+        BEGIN
+            UPDATE stock_movements SET ts_epoch = CAST(strftime('%s', NEW.ts) AS INTEGER)
+             WHERE id = NEW.id;
+        END;
+        """)
+        _mark_migration(c, "trg_mov_ts_epoch_after_update")
+
+    # Versão do catálogo (contagens em cache da listagem): só muda com
+    # inserção/remoção ou alteração de campos usados nos filtros
+    for name, event in (("trg_products_version_ins", "AFTER INSERT ON products"),
+                        ("trg_products_version_del", "AFTER DELETE ON products"),
+                        ("trg_products_version_upd",
+                         "AFTER UPDATE OF sku, name, category_id, supplier_id ON products")):
+        if not _has_trigger(c, name):
+            c.executescript(f"""
+            CREATE TRIGGER {name} {event}
+            BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'products';
+            END;
+            """)
+            _mark_migration(c, name)
+
+    # Versão dos códigos (cache de resolve_barcode em todos os workers)
+    for name, event in (("trg_barcodes_version_ins", "AFTER INSERT ON product_barcodes"),
+                        ("trg_barcodes_version_del", "AFTER DELETE ON product_barcodes"),
+                        ("trg_barcodes_version_upd",
+                         "AFTER UPDATE OF code, product_id, pack_qty, symbology ON product_barcodes")):
+        if not _has_trigger(c, name):
+            c.executescript(f"""
+            CREATE TRIGGER {name} {event}
+            BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'barcodes';
+            END;
+            """)
+            _mark_migration(c, name)
+
+    # Versões das listas de categorias/fornecedores (selects de filtro e cadastro)
+    for table in ("categories", "suppliers"):
+        for name, event in ((f"trg_{table}_version_ins", f"AFTER INSERT ON {table}"),
+                            (f"trg_{table}_version_del", f"AFTER DELETE ON {table}"),
+                            (f"trg_{table}_version_upd", f"AFTER UPDATE ON {table}")):
+            if not _has_trigger(c, name):
+                c.executescript(f"""
+                CREATE TRIGGER {name} {event}
+                BEGIN
+                    UPDATE cache_versions SET version = version + 1 WHERE name = '{table}';
+                END;
+                """)
+                _mark_migration(c, name)
+
+    # valuation_totals: soma/subtrai a contribuição do produto (qtd x preço, qtd x CMP)
+    def _valuation_upsert(row, sign):
+        return f"""
+            INSERT INTO valuation_totals(category_id, items, qty, total_price, total_cost)
+            VALUES (COALESCE({row}.category_id, 0), {sign}1,
+                    {sign}COALESCE({row}.current_qty, 0),
+                    {sign}COALESCE({row}.current_qty, 0) * COALESCE({row}.price, 0),
+                    {sign}COALESCE({row}.current_qty, 0) * COALESCE({row}.avg_cost, 0))
+            ON CONFLICT(category_id) DO UPDATE SET
+                items = items + excluded.items, qty = qty + excluded.qty,
+                total_price = total_price + excluded.total_price,
+                total_cost = total_cost + excluded.total_cost;"""
+
+    if not _has_migration(c, "valuation_totals"):
+        for name in ("trg_valuation_ins", "trg_valuation_del", "trg_valuation_upd"):
+            c.execute(f"DROP TRIGGER IF EXISTS {name}")
+        c.executescript(f"""
+        CREATE TRIGGER trg_valuation_ins AFTER INSERT ON products
+        BEGIN {_valuation_upsert("NEW", "+")}
+        END;
+        CREATE TRIGGER trg_valuation_del AFTER DELETE ON products
+        BEGIN {_valuation_upsert("OLD", "-")}
+        END;
+        CREATE TRIGGER trg_valuation_upd
+        AFTER UPDATE OF current_qty, avg_cost, price, category_id ON products
+        WHEN OLD.current_qty IS NOT NEW.current_qty OR OLD.avg_cost IS NOT NEW.avg_cost
+          OR OLD.price IS NOT NEW.price OR OLD.category_id IS NOT NEW.category_id
+        BEGIN {_valuation_upsert("OLD", "-")}
+              {_valuation_upsert("NEW", "+")}
+        END;
+        """)
+        rebuild_valuation_totals(c)
+        _mark_migration(c, "valuation_totals")
+
+    # movement_daily/category_daily: soma/subtrai o movimento no dia do produto e
+    # da categoria atual dele; linha zerada sai
+    daily_cols = "qty_in, qty_out, cost_in, count"
+    daily_add = """
+            ON CONFLICT({key}, day) DO UPDATE SET
+                qty_in = qty_in + excluded.qty_in, qty_out = qty_out + excluded.qty_out,
+                cost_in = cost_in + excluded.cost_in, count = count + excluded.count;"""
+
+    def _daily_upsert(table, key, key_expr, row, sign):
+        return f"""
+            INSERT INTO {table}({key}, day, {daily_cols})
+            SELECT {key_expr}, substr({row}.ts, 1, 10),
+                   {sign}(CASE WHEN {row}.type = 'IN'  THEN COALESCE({row}.quantity, 0) ELSE 0 END),
+                   {sign}(CASE WHEN {row}.type = 'OUT' THEN COALESCE({row}.quantity, 0) ELSE 0 END),
+                   {sign}(CASE WHEN {row}.type = 'IN' AND {row}.unit_cost > 0
+                               THEN COALESCE({row}.quantity, 0) * {row}.unit_cost ELSE 0 END),
+                   {sign}1
+             WHERE {row}.ts IS NOT NULL""" + daily_add.format(key=key)
+
+    def _daily(row, sign):
+        cat = f"COALESCE((SELECT category_id FROM products WHERE id = {row}.product_id), 0)"
+        sql = (_daily_upsert("movement_daily", "product_id", f"{row}.product_id", row, sign)
+               + _daily_upsert("category_daily", "category_id", cat, row, sign))
+        if sign == "-":
+            sql += f"""
+            DELETE FROM movement_daily
+             WHERE product_id = {row}.product_id AND day = substr({row}.ts, 1, 10) AND count <= 0;
+            DELETE FROM category_daily
+             WHERE category_id = {cat} AND day = substr({row}.ts, 1, 10) AND count <= 0;"""
+        return sql
+
+    if not _has_migration(c, "movement_daily"):
+        for name in ("trg_mdaily_ins", "trg_mdaily_del", "trg_mdaily_upd", "trg_cdaily_recat"):
+            c.execute(f"DROP TRIGGER IF EXISTS {name}")
+        c.executescript(f"""
+        CREATE TRIGGER trg_mdaily_ins AFTER INSERT ON stock_movements
+        BEGIN {_daily("NEW", "+")}
+        END;
+        CREATE TRIGGER trg_mdaily_del AFTER DELETE ON stock_movements
+        BEGIN {_daily("OLD", "-")}
+        END;
+        CREATE TRIGGER trg_mdaily_upd
+        AFTER UPDATE OF product_id, type, quantity, unit_cost, ts ON stock_movements
+        BEGIN {_daily("OLD", "-")}
+              {_daily("NEW", "+")}
+        END;
+        -- produto mudou de categoria: leva o histórico diário dele junto
+        CREATE TRIGGER trg_cdaily_recat AFTER UPDATE OF category_id ON products
+        WHEN OLD.category_id IS NOT NEW.category_id
+        BEGIN
+            INSERT INTO category_daily(category_id, day, {daily_cols})
+            SELECT COALESCE(NEW.category_id, 0), day, {daily_cols}
+              FROM movement_daily WHERE product_id = NEW.id {daily_add.format(key="category_id")}
+            INSERT INTO category_daily(category_id, day, {daily_cols})
+            SELECT COALESCE(OLD.category_id, 0), day, -qty_in, -qty_out, -cost_in, -count
+              FROM movement_daily WHERE product_id = OLD.id {daily_add.format(key="category_id")}
+            DELETE FROM category_daily WHERE category_id = COALESCE(OLD.category_id, 0) AND count <= 0;
+        END;
+        """)
+        _mark_migration(c, "movement_daily")
+
+    # products.is_low (current_qty <= min_qty) + feed de transições. O flag é
+    # recalculado só quando muda, e cada mudança gera um evento LOW/RECOVERED.
+    if not _has_migration(c, "low_stock_flag"):
+        for name in ("trg_low_stock_ins", "trg_low_stock_upd"):
+            c.execute(f"DROP TRIGGER IF EXISTS {name}")
+        low = "IFNULL(NEW.current_qty <= NEW.min_qty, 0)"
+        c.executescript(f"""
+        CREATE TRIGGER trg_low_stock_ins AFTER INSERT ON products
+        WHEN {low} = 1
+        BEGIN
+            UPDATE products SET is_low = 1 WHERE id = NEW.id;
+            INSERT INTO low_stock_events(product_id, event, current_qty, min_qty, ts)
+            VALUES (NEW.id, 'LOW', NEW.current_qty, NEW.min_qty, datetime('now', 'localtime'));
+        END;
+        CREATE TRIGGER trg_low_stock_upd AFTER UPDATE OF current_qty, min_qty ON products
+        WHEN {low} <> NEW.is_low
+        BEGIN
+            UPDATE products SET is_low = {low} WHERE id = NEW.id;
+            INSERT INTO low_stock_events(product_id, event, current_qty, min_qty, ts)
+            VALUES (NEW.id, CASE WHEN {low} = 1 THEN 'LOW' ELSE 'RECOVERED' END,
+                    NEW.current_qty, NEW.min_qty, datetime('now', 'localtime'));
+        END;
+        """)
+        c.execute("UPDATE products SET is_low = IFNULL(current_qty <= min_qty, 0)")
+        _mark_migration(c, "low_stock_flag")
+
+    # products.primary_barcode: primário do produto, senão o código mais antigo
+    # (mesma regra da antiga subconsulta da listagem; o índice parcial
+    # ux_barcode_primary_per_product garante no máximo um primário)
+    pick = """UPDATE products SET primary_barcode = (
+                  SELECT code FROM product_barcodes
+                   WHERE product_id = {pid}
+                   ORDER BY is_primary DESC, id ASC LIMIT 1)
+               WHERE id = {pid};"""
+    for name, event, body in (
+        ("trg_primary_barcode_ins", "AFTER INSERT ON product_barcodes", pick.format(pid="NEW.product_id")),
+        ("trg_primary_barcode_del", "AFTER DELETE ON product_barcodes", pick.format(pid="OLD.product_id")),
+        ("trg_primary_barcode_upd", "AFTER UPDATE OF code, is_primary, product_id ON product_barcodes",
+         pick.format(pid="OLD.product_id") + pick.format(pid="NEW.product_id")),
+    ):
+        if not _has_trigger(c, name):
+            c.executescript(f"CREATE TRIGGER {name} {event} BEGIN {body} END;")
+            _mark_migration(c, name)
+
+# ==============================
+# Busca full-text (FTS5) do catálogo
+# ==============================
+_FTS_ROW_SQL = """
+    INSERT INTO products_fts(rowid, name, sku, category, supplier, barcodes)
+    SELECT p.id, p.name, p.sku,
+           COALESCE(cat.name,''), COALESCE(sup.name,''),
+           COALESCE((SELECT group_concat(code, ' ') FROM product_barcodes WHERE product_id = p.id), '')
+      FROM products p
+      LEFT JOIN categories cat ON cat.id = p.category_id
+      LEFT JOIN suppliers  sup ON sup.id = p.supplier_id
+     WHERE {where};
+"""
+
+def _fts_refresh(where: str) -> str:
+    """SQL de trigger que regrava as linhas do índice para os produtos em `where`."""
+    return (f"DELETE FROM products_fts WHERE rowid IN (SELECT p.id FROM products p WHERE {where});"
+            + _FTS_ROW_SQL.format(where=where))
+
+def apply_fts(c) -> bool:
+    """
+    Cria products_fts (name, sku, categoria, fornecedor, barcodes) e os triggers que
+    o mantêm. Retorna False se o SQLite não tiver FTS5 (busca cai no LIKE).
+    """
+    if not _has_table(c, "products_fts"):
+        try:
+            c.execute("""
+                CREATE VIRTUAL TABLE products_fts USING fts5(
+                    name, sku, category, supplier, barcodes,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+        except sqlite3.OperationalError:
+            return False
+        c.execute(_FTS_ROW_SQL.format(where="1"))
+        _mark_migration(c, "products_fts")
+
+    bump = "UPDATE cache_versions SET version = version + 1 WHERE name = 'products';"
+    triggers = {
+        "trg_fts_products_ins": ("AFTER INSERT ON products", _FTS_ROW_SQL.format(where="p.id = NEW.id")),
+        "trg_fts_products_upd": ("AFTER UPDATE OF name, sku, category_id, supplier_id ON products",
+                                 "DELETE FROM products_fts WHERE rowid = OLD.id;"
+                                 + _FTS_ROW_SQL.format(where="p.id = NEW.id")),
+        "trg_fts_products_del": ("AFTER DELETE ON products",
+                                 "DELETE FROM products_fts WHERE rowid = OLD.id;"),
+        "trg_fts_barcodes_ins": ("AFTER INSERT ON product_barcodes",
+                                 _fts_refresh("p.id = NEW.product_id") + bump),
+        "trg_fts_barcodes_upd": ("AFTER UPDATE OF code, product_id ON product_barcodes",
+                                 _fts_refresh("p.id IN (OLD.product_id, NEW.product_id)") + bump),
+        "trg_fts_barcodes_del": ("AFTER DELETE ON product_barcodes",
+                                 _fts_refresh("p.id = OLD.product_id") + bump),
+        "trg_fts_categories_upd": ("AFTER UPDATE OF name ON categories",
+                                   _fts_refresh("p.category_id = NEW.id") + bump),
+        "trg_fts_suppliers_upd": ("AFTER UPDATE OF name ON suppliers",
+                                  _fts_refresh("p.supplier_id = NEW.id") + bump),
+    }
+    for name, (event, body) in triggers.items():
+        if not _has_trigger(c, name):
+            c.executescript(f"CREATE TRIGGER {name} {event} BEGIN {body} END;")
+            _mark_migration(c, name)
+    return True
+
+_fts_available = {}
+
+def fts_available(c) -> bool:
+    """products_fts existe neste banco? (resultado guardado por arquivo)"""
+    db_path = current_app.config["DB_PATH"] if has_app_context() else None
+    if db_path not in _fts_available:
+        _fts_available[db_path] = _has_table(c, "products_fts")
+    return _fts_available[db_path]
+
+# ==============================
+# Backfills em lotes
+# ==============================
+def backfill_ts_epoch(conn, chunk: int = 5000, verbose: bool = False) -> int:
+    """
+    Preenche stock_movements.ts_epoch em faixas de id, com commit por faixa
+    (trava o banco só por instantes). Idempotente; retorna linhas atualizadas.
+    """
+    c = conn.cursor()
+    row = c.execute("SELECT MIN(id), MAX(id) FROM stock_movements WHERE ts_epoch IS NULL").fetchone()
+    lo, hi = row[0], row[1]
+    total = 0
+    if lo is None:
+        return 0
+    start = lo - 1
+    while start < hi:
+        c.execute("""UPDATE stock_movements
+                        SET ts_epoch = CAST(strftime('%s', ts) AS INTEGER)
+                      WHERE id > ? AND id <= ? AND ts_epoch IS NULL""",
+                  (start, start + chunk))
+        total += c.rowcount
+        conn.commit()
+        start += chunk
+        if verbose:
+            print(f"[BACKFILL] ts_epoch até id={min(start, hi)} ({total} linhas)", flush=True)
+    return total
+
+def backfill_movement_daily(conn, chunk: int = 1000, verbose: bool = False) -> int:
+    """
+    Recalcula movement_daily em faixas de product_id: cada faixa apaga e regrava
+    suas linhas na mesma transação, então convive com os triggers e com escritas
+    concorrentes. No fim, category_daily é remontada do rollup por produto (uma
+    transação, custo proporcional ao rollup). Idempotente; retorna linhas gravadas.
+    """
+    c = conn.cursor()
+    lo, hi = c.execute("SELECT MIN(product_id), MAX(product_id) FROM stock_movements").fetchone()
+    total = 0
+    if lo is None:
+        return 0
+    start = lo - 1
+    while start < hi:
+        c.execute("DELETE FROM movement_daily WHERE product_id > ? AND product_id <= ?", (start, start + chunk))
+        c.execute("""INSERT INTO movement_daily(product_id, day, qty_in, qty_out, cost_in, count)
+                     SELECT product_id, substr(ts, 1, 10),
+                            TOTAL(CASE WHEN type = 'IN'  THEN quantity END),
+                            TOTAL(CASE WHEN type = 'OUT' THEN quantity END),
+                            TOTAL(CASE WHEN type = 'IN' AND unit_cost > 0 THEN quantity * unit_cost END),
+                            COUNT(*)
+                       FROM stock_movements
+                      WHERE product_id > ? AND product_id <= ? AND ts IS NOT NULL
+                      GROUP BY product_id, substr(ts, 1, 10)""",
+                  (start, start + chunk))
+        total += c.rowcount
+        conn.commit()
+        start += chunk
+        if verbose:
+            print(f"[BACKFILL] movement_daily até product_id={min(start, hi)} ({total} linhas)", flush=True)
+    c.execute("DELETE FROM category_daily")
+    c.execute("""INSERT INTO category_daily(category_id, day, qty_in, qty_out, cost_in, count)
+                 SELECT COALESCE(p.category_id, 0), m.day,
+                        TOTAL(m.qty_in), TOTAL(m.qty_out), TOTAL(m.cost_in), SUM(m.count)
+                   FROM movement_daily m JOIN products p ON p.id = m.product_id
+                  GROUP BY COALESCE(p.category_id, 0), m.day""")
+    conn.commit()
+    return total
+
+def backfill_primary_barcode(conn, chunk: int = 5000, verbose: bool = False) -> int:
+    """Recalcula products.primary_barcode em faixas de id (commit por faixa)."""
+    c = conn.cursor()
+    lo, hi = c.execute("SELECT MIN(id), MAX(id) FROM products").fetchone()
+    total = 0
+    if lo is None:
+        return 0
+    start = lo - 1
+    while start < hi:
+        c.execute("""UPDATE products
+                        SET primary_barcode = (
+                            SELECT code FROM product_barcodes
+                             WHERE product_id = products.id
+                             ORDER BY is_primary DESC, id ASC LIMIT 1)
+                      WHERE id > ? AND id <= ?""",
+                  (start, start + chunk))
+        total += c.rowcount
+        conn.commit()
+        start += chunk
+        if verbose:
+            print(f"[BACKFILL] primary_barcode até id={min(start, hi)} ({total} produtos)", flush=True)
+    return total
+
 # ==============================
 # Admin helpers
 # ==============================
@@ -328,6 +1034,8 @@ def ensure_admin(username="admin", password="admin123", role="admin"):
                   (username, generate_password_hash(password), role, now_str()))
     conn.commit()
     conn.close()
+    from .auth import invalidate_user
+    invalidate_user(row["id"] if row else None)
 
 def reset_admin(password="admin123"):
     """Força senha do admin padrão."""
@@ -336,34 +1044,105 @@ def reset_admin(password="admin123"):
 # ==============================
 # Barcodes helpers
 # ==============================
-def find_product_by_barcode(code: str):
-    """Retorna row de products pelo código de barras, ou None."""
+# Resolução de código (hot path de /scan, /entrada, /saida):
+# code normalizado -> (product_id, pack_qty, symbology), validado pela versão
+# 'barcodes' (triggers em product_barcodes), então vale entre workers.
+_NOT_FOUND = False
+_barcode_cache = VersionedCache("barcodes", maxsize=Config.BARCODE_CACHE_SIZE)
+
+def resolve_barcode(code: str):
+    """
+    Retorna (product_id, pack_qty, symbology) para um código já normalizado, ou None.
+    Uma leitura por PK (versão) quando o código está em cache.
+    """
     code = (code or "").strip()
     if not code:
         return None
     conn = get_conn()
     c = conn.cursor()
-    row = c.execute("""
-        SELECT p.* FROM product_barcodes b
-        JOIN products p ON p.id = b.product_id
-        WHERE b.code = ?
-        LIMIT 1
-    """, (code,)).fetchone()
+    version = get_version(c, "barcodes")
+    hit = _barcode_cache.get(code, version)
+    if hit is None:
+        row = c.execute("""
+            SELECT product_id, pack_qty, symbology FROM product_barcodes
+            WHERE code = ? LIMIT 1
+        """, (code,)).fetchone()
+        hit = (row["product_id"], max(1, int(row["pack_qty"] or 1)), row["symbology"]) if row else _NOT_FOUND
+        _barcode_cache.put(code, hit, version)
     conn.close()
-    return row
+    return hit or None
+
+def invalidate_barcode_cache(code: str = None):
+    """Descarta o cache local (um código ou tudo); outros workers percebem pela versão."""
+    _barcode_cache.invalidate(code)
+
+# Dados de referência (categorias/fornecedores): lidos em toda tela de produtos,
+# alterados poucas vezes por mês. Validados pela versão da tabela.
+_REFDATA_SQL = {
+    "categories": "SELECT id, name FROM categories ORDER BY name",
+    "suppliers": "SELECT id, name, COALESCE(contact,'') contact FROM suppliers ORDER BY name",
+}
+_refdata_cache = VersionedCache("refdata", maxsize=len(_REFDATA_SQL))
+
+def _refdata(name: str):
+    conn = get_conn()
+    c = conn.cursor()
+    version = get_version(c, name)
+    rows = _refdata_cache.get(name, version)
+    if rows is None:
+        rows = tuple(c.execute(_REFDATA_SQL[name]).fetchall())
+        _refdata_cache.put(name, rows, version)
+    conn.close()
+    return rows
+
+def list_categories():
+    """Categorias (id, name) ordenadas por nome, do cache quando a versão bate."""
+    return _refdata("categories")
+
+def list_suppliers():
+    """Fornecedores (id, name, contact) ordenados por nome, do cache quando a versão bate."""
+    return _refdata("suppliers")
+
+def invalidate_refdata(name: str = None):
+    """Descarta o cache local após criar/remover; outros workers percebem pela versão."""
+    _refdata_cache.invalidate(name)
 
 def add_barcode(product_id: int, code: str, symbology: str = "CODE128",
                 pack_qty: int = 1, label: str = "UN", is_primary: int = 0):
     """Adiciona um código ao produto (code é único)."""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
+    from .db_writer import run_write
+    params = (product_id, (symbology or "CODE128").strip().upper(), (code or "").strip(),
+              int(pack_qty or 1), label, int(is_primary or 0), now_str())
+    run_write(lambda conn: conn.execute("""
       INSERT INTO product_barcodes(product_id, symbology, code, pack_qty, label, is_primary, created_at)
       VALUES (?,?,?,?,?,?,?)
-    """, (product_id, (symbology or "CODE128").strip().upper(), (code or "").strip(),
-          int(pack_qty or 1), label, int(is_primary or 0), now_str()))
+    """, params).lastrowid)
+    invalidate_barcode_cache(params[2])
+
+# Backfills da partida: chave da migração -> função (tools/ rodam os mesmos)
+STARTUP_BACKFILLS = {
+    "backfill_ts_epoch": backfill_ts_epoch,
+    "backfill_movement_daily": backfill_movement_daily,
+    "backfill_primary_barcode": backfill_primary_barcode,
+}
+
+def run_backfill(conn, key: str, **kwargs) -> int:
+    """Roda um backfill de STARTUP_BACKFILLS e marca a migração (init_db não repete)."""
+    n = STARTUP_BACKFILLS[key](conn, **kwargs)
+    _mark_migration(conn.cursor(), key)
     conn.commit()
-    conn.close()
+    return n
+
+def rebuild_valuation_totals(c):
+    """Recalcula valuation_totals do zero (migração e correção de deriva de ponto flutuante)."""
+    c.execute("DELETE FROM valuation_totals")
+    c.execute("""
+        INSERT INTO valuation_totals(category_id, items, qty, total_price, total_cost)
+        SELECT COALESCE(category_id, 0), COUNT(*), COALESCE(SUM(current_qty), 0),
+               COALESCE(SUM(current_qty * price), 0), COALESCE(SUM(current_qty * avg_cost), 0)
+          FROM products
+         GROUP BY COALESCE(category_id, 0)
+    """)
 
 # ==============================
 # INIT DB (idempotente)
@@ -378,8 +1157,18 @@ def init_db():
     apply_indexes(c)
     apply_views(c)
     apply_triggers(c)
+    apply_fts(c)
     conn.commit()
 
+    # Backfills em lotes (uma vez por base); com DB_BACKFILL_ON_START=0 ficam
+    # para os scripts de tools/ e a partida não varre o ledger
+    pending = [key for key in STARTUP_BACKFILLS if not _has_migration(c, key)]
+    if pending and current_app.config.get("DB_BACKFILL_ON_START", True):
+        for key in pending:
+            run_backfill(conn, key)
+    elif pending:
+        print(f"[WARN] Backfills pendentes: {', '.join(pending)} (rode os scripts em tools/)")
+
     # Seed admin inicial (se base vazia)
     count_users = c.execute("SELECT COUNT(*) AS n FROM users").fetchone()["n"]
     if count_users == 0:
@@ -0,0 +1,232 @@
+# stockcontrol/db_writer.py
+# Escritor único opcional (group commit): uma thread dona da conexão de escrita
+# drena uma fila de mutações e as grava em lotes, um COMMIT (fsync) por lote.
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from flask import current_app, has_app_context
+from .db import _connect, get_conn, with_busy_retry
+
+class WriteTimeout(TimeoutError):
+    """O prazo venceu com a mutação ainda na fila: foi cancelada, nada gravado."""
+
+class WriteOutcomeUnknown(TimeoutError):
+    """O prazo venceu com a mutação já no lote em gravação: pode ter sido gravada."""
+
+class GroupCommitWriter:
+    """
+    Cada mutação é uma função fn(conn) executada dentro da transação do lote,
+    isolada por SAVEPOINT: erro em uma não derruba as outras. O Future de cada
+    request só é resolvido depois do COMMIT. fn não deve chamar commit/rollback.
+    """
+    def __init__(self, db_path: str, batch_size: int = 200, max_latency_ms: float = 5.0,
+                 busy_retries: int = 5, busy_backoff_ms: float = 20):
+        self.db_path = db_path
+        self.batch_size = max(1, int(batch_size))
+        self.max_latency = max(0.0, float(max_latency_ms)) / 1000.0
+        self.busy_retries = busy_retries
+        self.busy_backoff_ms = busy_backoff_ms
+        self._q = queue.Queue()
+        self._thread = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.ops = 0
+        self.failed_ops = 0
+        self.max_batch = 0
+
+    # ---------- ciclo de vida ----------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        """Para a thread depois de gravar o que já estava na fila."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._q.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, fn) -> Future:
+        if self._stopping or not self.running:
+            raise RuntimeError("Writer parado.")
+        fut = Future()
+        self._q.put((fn, fut))
+        return fut
+
+    # ---------- loop ----------
+    def _collect(self):
+        item = self._q.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # parada solicitada: grava o lote atual e encerra em seguida
+                self._q.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = _connect(self.db_path)
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    break
+                try:
+                    self._commit_batch(conn, batch)
+                except Exception as e:
+                    # falha inesperada (ex.: conexão): não deixa requests esperando
+                    if conn.in_transaction:
+                        conn.rollback()
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        batch = [(fn, fut) for fn, fut in batch if fut.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            with_busy_retry(lambda: conn.execute("BEGIN IMMEDIATE"),
+                            self.busy_retries, self.busy_backoff_ms)
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        done = []
+        for fn, fut in batch:
+            conn.execute("SAVEPOINT w")
+            try:
+                result = fn(conn)
+                conn.execute("RELEASE w")
+                done.append((fut, result, None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO w")
+                conn.execute("RELEASE w")
+                done.append((fut, None, e))
+
+        try:
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for fut, _, _ in done:
+                fut.set_exception(e)
+            return
+
+        failed = 0
+        for fut, result, err in done:
+            if err is not None:
+                failed += 1
+                fut.set_exception(err)
+            else:
+                fut.set_result(result)
+        with self._lock:
+            self.batches += 1
+            self.ops += len(done)
+            self.failed_ops += failed
+            self.max_batch = max(self.max_batch, len(done))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "queue": self._q.qsize(),
+                "batches": self.batches,
+                "ops": self.ops,
+                "failed_ops": self.failed_ops,
+                "avg_batch": (self.ops / self.batches) if self.batches else 0.0,
+                "max_batch": self.max_batch,
+                "batch_size": self.batch_size,
+                "max_latency_ms": self.max_latency * 1000.0,
+            }
+
+# ==============================
+# Integração com a app
+# ==============================
+def init_writer(app):
+    cfg = app.config
+    writer = GroupCommitWriter(
+        cfg["DB_PATH"],
+        batch_size=cfg.get("WRITER_BATCH_SIZE", 200),
+        max_latency_ms=cfg.get("WRITER_MAX_LATENCY_MS", 5.0),
+        busy_retries=cfg.get("DB_BUSY_RETRIES", 5),
+        busy_backoff_ms=cfg.get("DB_BUSY_BACKOFF_MS", 20),
+    ).start()
+    app.extensions["db_writer"] = writer
+    atexit.register(writer.stop)
+    return writer
+
+def get_writer():
+    if not has_app_context():
+        return None
+    writer = current_app.extensions.get("db_writer")
+    return writer if writer is not None and writer.running else None
+
+def writer_stats():
+    writer = get_writer()
+    return writer.stats() if writer else {"running": False}
+
+def _wait(fut: Future, timeout: float):
+    """
+    Resultado do Future com prazo. Ainda na fila: cancela e lança WriteTimeout.
+    Já no lote em gravação: espera mais um prazo pelo COMMIT (o resultado é
+    certo) e só então lança WriteOutcomeUnknown.
+    """
+    try:
+        return fut.result(timeout=timeout)
+    except FutureTimeout:
+        pass
+    if fut.cancel():
+        raise WriteTimeout("Banco ocupado: a gravação não começou no prazo e foi cancelada.")
+    try:
+        return fut.result(timeout=timeout)
+    except FutureTimeout:
+        raise WriteOutcomeUnknown("Gravação em andamento além do prazo: confira antes de repetir.") from None
+
+def run_write(fn):
+    """
+    Executa fn(conn) numa transação de escrita e devolve o resultado.
+    Com o writer ligado (WRITER_ENABLED), entra no próximo lote do group commit;
+    senão abre uma transação própria (BEGIN IMMEDIATE) com retry de banco ocupado.
+    Prazo do writer: WriteTimeout se nada foi gravado, WriteOutcomeUnknown se talvez.
+    """
+    writer = get_writer()
+    if writer is not None:
+        return _wait(writer.submit(fn), current_app.config.get("WRITER_TIMEOUT_S", 30))
+
+    def _tx():
+        conn = get_conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = fn(conn)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    return with_busy_retry(_tx)
@@ -2,7 +2,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, current_user
 from werkzeug.security import check_password_hash
 from ..db import get_conn
-from ..auth import User
+from ..auth import User, remember_user, forget_user
 
 bp = Blueprint("auth", __name__)
 
@@ -15,7 +15,9 @@ def login():
         c.execute("SELECT * FROM users WHERE username=?", (username,))
         row = c.fetchone(); conn.close()
         if row and check_password_hash(row["passhash"], password):
-            login_user(User(row))
+            user = User(row)
+            login_user(user)
+            remember_user(user)
             flash("Login realizado.", "success")
             return redirect(url_for("products.index"))
         flash("Usuário ou senha inválidos.", "error")
@@ -26,5 +28,6 @@ def logout():
     if not current_user.is_authenticated:
         return redirect(url_for("auth.login"))
     logout_user()
+    forget_user()
     flash("Você saiu da sessão.", "success")
     return redirect(url_for("auth.login"))
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from ..db import get_conn
+from ..db import get_conn, list_categories, invalidate_refdata
 
 bp = Blueprint("categories", __name__, url_prefix="/categorias")
 
@@ -20,13 +20,12 @@ def view():
         else:
             try:
                 c.execute("INSERT INTO categories(name) VALUES(?)", (name,))
-                conn.commit(); flash("Categoria criada.", "success")
+                conn.commit(); invalidate_refdata("categories")
+                flash("Categoria criada.", "success")
             except:
                 flash("Categoria já existe.", "error")
         conn.close()
-    conn = get_conn(); c = conn.cursor()
-    c.execute("SELECT id, name FROM categories ORDER BY name")
-    cats = c.fetchall(); conn.close()
+    cats = list_categories()
     return render_template("categorias.html", cats=cats)
 
 @bp.post("/excluir/<int:cid>")
@@ -38,5 +37,6 @@ def delete(cid):
     conn = get_conn(); c = conn.cursor()
     c.execute("DELETE FROM categories WHERE id=?", (cid,))
     conn.commit(); conn.close()
+    invalidate_refdata("categories")
     flash("Categoria removida.", "success")
     return redirect(url_for("categories.view"))
@@ -1,31 +1,77 @@
 import math
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+import re
+from functools import wraps
+from flask import (
+    Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify, make_response, current_app,
+)
 from flask_login import login_required, current_user
+from .. import csrf
+from ..cache import VersionedCache, get_version
 from ..config import Config
-from ..db import get_conn, find_product_by_barcode, add_barcode
-from ..utils import parse_float, parse_int, now_str
-from ..services.inventory import recalc_avg_cost_on_in, find_product
+from ..db import (
+    get_conn, resolve_barcode, invalidate_barcode_cache, add_barcode, fts_available,
+    list_categories, list_suppliers,
+)
+from ..db_writer import run_write, WriteTimeout, WriteOutcomeUnknown
+from ..utils import parse_float, parse_int, now_str, to_epoch, encode_cursor, decode_cursor
+from ..utils_barcode import normalize_barcode, parse_barcode, gs1_summary, lookup_keys
+from ..services.catalog import import_barcodes_bulk, import_products_bulk, read_table_rows
+from ..services.inventory import (
+    post_movement, post_movements_bulk, find_product, movement_history, InsufficientStock,
+)
 
 bp = Blueprint("products", __name__)
 
 def role_allowed(*roles):
     return current_user.is_authenticated and current_user.role in roles
 
-# --------------------------------------------
-# Helper: normaliza código para lookup
-# - Se for EAN-13 (ou UPC-A 12), remove não dígitos, normaliza e valida DV
-# - Caso contrário, retorna o texto original (para CODE128, etc.)
-# --------------------------------------------
-def _normalize_barcode_for_lookup(code: str) -> str:
-    code = (code or "").strip()
-    if not code:
-        return ""
-    try:
-        from ..utils_barcode import validate_and_normalize_ean13
-        return validate_and_normalize_ean13(code)
-    except Exception:
-        # não é EAN-13 válido -> usa cru (pode ser CODE128, QR, etc.)
-        return code
+def csrf_unless_json(view):
+    """
+    Endpoints de integração: corpo application/json dispensa o token CSRF (o
+    navegador só envia JSON cross-site após preflight CORS, que o app não libera);
+    formulário/arquivo continua exigindo csrf_token no form ou o header X-CSRFToken.
+    A sessão (login_required) e o papel continuam sendo checados pela view.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not request.is_json and current_app.config.get("WTF_CSRF_ENABLED", True):
+            csrf.protect()
+        return view(*args, **kwargs)
+    return csrf.exempt(wrapped)
+
+def _resolve_scan(raw: str):
+    """
+    Lê o código do leitor numa passada -> (hit, gs1) onde hit é o retorno de
+    resolve_barcode e gs1 o resumo dos AIs (lote, validade, quantidade).
+    Tenta as chaves de lookup_keys (canônica, UPC-E ambíguo, texto original).
+    """
+    parsed = parse_barcode(raw)
+    hit = None
+    for key in lookup_keys(raw, parsed):
+        hit = resolve_barcode(key)
+        if hit:
+            break
+    return hit, gs1_summary(parsed.ais)
+
+def _gs1_note(note: str, gs1: dict) -> str:
+    """Acrescenta lote/validade lidos do GS1 à observação do movimento."""
+    extra = [f"{label} {gs1[k]}" for k, label in (("lot", "Lote"), ("expiry", "Val."), ("serial", "Série"))
+             if k in gs1]
+    return " · ".join([note] + extra if note else extra)
+
+# Pesos do bm25 por coluna de products_fts: name, sku, category, supplier, barcodes
+_FTS_WEIGHTS = "10.0, 5.0, 1.0, 1.0, 5.0"
+
+def _fts_match(q: str):
+    """Texto livre -> expressão FTS5: cada termo entre aspas, com prefixo (AND implícito)."""
+    terms = re.findall(r"\w+", q or "")
+    if not terms:
+        return None
+    return " ".join('"' + t.replace('"', '""') + '"*' for t in terms)
+
+# Contagem da listagem por assinatura de filtro; invalidada pela versão
+# 'products' (triggers em db.apply_triggers)
+_count_cache = VersionedCache("product_count", maxsize=256)
 
 @bp.route("/")
 @login_required
@@ -37,8 +83,12 @@ def index():
     per_page = max(1, parse_int(request.args.get("per_page"), Config.PER_PAGE))
     cat = parse_int(request.args.get("cat") or 0, 0)
     sup = parse_int(request.args.get("sup") or 0, 0)
+    # keyset: ?after=<cursor> (próxima) / ?before=<cursor> (anterior); sem cursor cai no OFFSET
+    after = decode_cursor(request.args.get("after") or "") if request.args.get("after") else None
+    before = decode_cursor(request.args.get("before") or "") if request.args.get("before") else None
     offset = (page - 1) * per_page
 
+    # cada chave tem índice próprio (idx_products_*), com id como desempate
     sort_map = {
         "name": "p.name",
         "sku": "p.sku",
@@ -46,12 +96,27 @@ def index():
         "price": "p.price",
         "margin": "(p.price - p.avg_cost)",
     }
+
+    conn = get_conn()
+    c = conn.cursor()
+
+    # busca: FTS5 (prefixo + bm25) quando disponível; senão LIKE
+    match = _fts_match(q) if q and fts_available(c) else None
+    join_sql, join_params = "", []
+    if match and sort == "relevance":
+        join_sql = f"""JOIN (SELECT rowid AS fts_id, bm25(products_fts, {_FTS_WEIGHTS}) AS fts_rank
+                               FROM products_fts WHERE products_fts MATCH ?) fts ON fts.fts_id = p.id"""
+        join_params = [match]
+        sort_map["relevance"] = "fts.fts_rank"
     order_by = sort_map.get(sort, "p.name")
-    dir_sql = "DESC" if direction.lower() == "desc" else "ASC"
+    desc = direction.lower() == "desc"
 
     where = []
     params = []
-    if q:
+    if match:
+        where.append("p.id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+        params.append(match)
+    elif q:
         where.append("(p.name LIKE ? OR p.sku LIKE ?)")
         like = f"%{q}%"
         params += [like, like]
@@ -63,31 +128,40 @@ def index():
         params.append(sup)
     where_sql = "WHERE " + " AND ".join(where) if where else ""
 
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id, name FROM categories ORDER BY name")
-    cats = c.fetchall()
-    c.execute("SELECT id, name FROM suppliers ORDER BY name")
-    sups = c.fetchall()
+    cats, sups = list_categories(), list_suppliers()
 
-    c.execute(f"SELECT COUNT(*) FROM products p {where_sql}", params)
-    total = c.fetchone()[0]
+    count_key = (q, cat, sup)
+    version = get_version(c, "products")
+    total = _count_cache.get(count_key, version)
+    if total is None:
+        c.execute(f"SELECT COUNT(*) FROM products p {where_sql}", params)
+        total = c.fetchone()[0]
+        _count_cache.put(count_key, total, version)
     pages = max(1, math.ceil(total / per_page)) if per_page else 1
 
-    # inclui primary_barcode (join no primário + fallback)
+    # keyset: compara (chave, id) como row value; "before" lê na ordem inversa
+    backwards = before is not None and after is None
+    cursor = before if backwards else after
+    forward_desc = desc != backwards
+    page_where, page_params = list(where), list(params)
+    if cursor is not None:
+        # o limite simples na chave permite SEARCH também no índice de expressão (margem)
+        op = "<" if forward_desc else ">"
+        page_where.append(f"{order_by} {op}= ? AND ({order_by}, p.id) {op} (?, ?)")
+        page_params += [cursor[0], cursor[0], cursor[1]]
+        offset = 0
+    page_where_sql = "WHERE " + " AND ".join(page_where) if page_where else ""
+    dir_sql = "DESC" if forward_desc else "ASC"
+
+    # primary_barcode é coluna desnormalizada (triggers em product_barcodes)
     c.execute(
         f"""
         SELECT
             p.id, p.sku, p.name, p.unit,
+            {order_by} AS sort_key,
             COALESCE(cat.name,'') AS category,
             COALESCE(sup.name,'') AS supplier,
-            COALESCE(
-                pb.code,
-                (SELECT code FROM product_barcodes
-                   WHERE product_id = p.id
-                   ORDER BY is_primary DESC, id ASC
-                   LIMIT 1)
-            ) AS primary_barcode,
+            p.primary_barcode,
             printf('%.2f', p.price) AS price,
             printf('%.2f', p.avg_cost) AS avg_cost,
             printf('%.2f', p.current_qty) AS current_qty,
@@ -95,20 +169,29 @@ def index():
             printf('%.2f', (p.price - p.avg_cost)) AS margin_abs,
             CASE WHEN p.price>0
                  THEN printf('%.2f', 100.0*(p.price - p.avg_cost)/p.price)
-                 ELSE printf('%.2f', 0) END AS margin_pct
+                 ELSE printf('%.2f', 0) END AS margin_pct,
+            pa.abc, pa.xyz,
+            CASE WHEN pa.avg_daily > 0 THEN p.current_qty / pa.avg_daily END AS days_cover
         FROM products p
         LEFT JOIN categories cat ON cat.id = p.category_id
         LEFT JOIN suppliers  sup ON sup.id = p.supplier_id
-        LEFT JOIN product_barcodes pb
-               ON pb.product_id = p.id AND pb.is_primary = 1
-        {where_sql}
-        ORDER BY {order_by} {dir_sql}, p.id ASC
+        LEFT JOIN product_analytics pa ON pa.product_id = p.id
+        {join_sql}
+        {page_where_sql}
+        ORDER BY {order_by} {dir_sql}, p.id {dir_sql}
         LIMIT ? OFFSET ?
         """,
-        (*params, per_page, offset),
+        (*join_params, *page_params, per_page, offset),
     )
     produtos = c.fetchall()
     conn.close()
+    if backwards:
+        produtos.reverse()
+
+    next_cursor = prev_cursor = None
+    if produtos:
+        next_cursor = encode_cursor(produtos[-1]["sort_key"], produtos[-1]["id"])
+        prev_cursor = encode_cursor(produtos[0]["sort_key"], produtos[0]["id"])
 
     return render_template(
         "index.html",
@@ -124,6 +207,8 @@ def index():
         sups=sups,
         cat_sel=cat,
         sup_sel=sup,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
     )
 
 @bp.route("/novo", methods=["GET", "POST"])
@@ -135,10 +220,7 @@ def novo():
 
     conn = get_conn()
     c = conn.cursor()
-    c.execute("SELECT id, name FROM categories ORDER BY name")
-    cats = c.fetchall()
-    c.execute("SELECT id, name FROM suppliers ORDER BY name")
-    sups = c.fetchall()
+    cats, sups = list_categories(), list_suppliers()
 
     if request.method == "POST":
         sku = (request.form.get("sku") or "").strip()
@@ -175,17 +257,9 @@ def novo():
             )
             pid = c.lastrowid
             if start_qty > 0:
-                if start_cost is not None:
-                    c.execute("UPDATE products SET avg_cost=? WHERE id=?", (start_cost, pid))
-                # Apenas insere o movimento; triggers ajustam current_qty
-                c.execute(
-                    """INSERT INTO stock_movements(product_id,type,quantity,unit_cost,reason,note,ts)
-                       VALUES(?,?,?,?,?,?,?)""",
-                    (pid, "IN", start_qty, start_cost, "Estoque inicial", "", now_str()),
-                )
+                # mesmo commit do produto: saldo e CMP aplicados pelo serviço
+                post_movement(pid, "IN", start_qty, start_cost, "Estoque inicial", "", conn=conn)
             conn.commit()
-            if start_qty > 0 and start_cost is not None:
-                recalc_avg_cost_on_in(pid, start_qty, start_cost)
             flash("Produto criado com sucesso.", "success")
             return redirect(url_for("products.index"))
         except:
@@ -212,10 +286,7 @@ def editar(pid):
         conn.close()
         return abort(404)
 
-    c.execute("SELECT id, name FROM categories ORDER BY name")
-    cats = c.fetchall()
-    c.execute("SELECT id, name FROM suppliers ORDER BY name")
-    sups = c.fetchall()
+    cats, sups = list_categories(), list_suppliers()
     # carregar barcodes para o template
     c.execute("SELECT * FROM product_barcodes WHERE product_id=? ORDER BY id DESC", (pid,))
     barcodes = c.fetchall()
@@ -276,6 +347,7 @@ def excluir(pid):
     c.execute("DELETE FROM products WHERE id=?", (pid,))
     conn.commit()
     conn.close()
+    invalidate_barcode_cache()
     flash("Produto e histórico removidos.", "success")
     return redirect(url_for("products.index"))
 
@@ -287,17 +359,25 @@ def excluir(pid):
 @login_required
 def scan():
     raw = (request.form.get("barcode") or "").strip()
-    code = _normalize_barcode_for_lookup(raw)
-    if not code:
+    if not raw:
         flash("Informe um código para buscar.", "warning")
         return redirect(url_for("products.index"))
 
-    row = find_product_by_barcode(code)
-    if not row:
+    hit, _ = _resolve_scan(raw)
+    if not hit:
         flash("Código não encontrado.", "warning")
         return redirect(url_for("products.index"))
 
-    return redirect(url_for("products.produto", pid=row["id"]))
+    return redirect(url_for("products.produto", pid=hit[0]))
+
+def _write_timeout(pid, err):
+    """Prazo do writer: WriteTimeout nada gravou; WriteOutcomeUnknown pode ter gravado."""
+    if isinstance(err, WriteOutcomeUnknown):
+        flash("A gravação demorou além do prazo e pode ter sido concluída: confira o histórico antes de repetir.",
+              "warning")
+    else:
+        flash("Banco ocupado: nada foi gravado, tente novamente.", "error")
+    return redirect(url_for("products.produto", pid=pid))
 
 @bp.post("/entrada/<int:pid>")
 @login_required
@@ -308,29 +388,21 @@ def entrada(pid):
 
     # Se vier um barcode, resolve o produto por ele e ignora o pid da URL
     barcode = (request.form.get("barcode") or "").strip()
-    pack_qty = 1
+    pack_qty, gs1 = 1, {}
     if barcode:
-        norm = _normalize_barcode_for_lookup(barcode)
-        rowp = find_product_by_barcode(norm)
-        if not rowp:
+        # produto + pack do código numa consulta (ou nenhuma, com o cache quente)
+        hit, gs1 = _resolve_scan(barcode)
+        if not hit:
             flash("Código de barras não encontrado.", "warning")
             return redirect(url_for("products.index"))
-        pid = rowp["id"]
-        # Descobre o pack_qty do código usado
-        conn_tmp = get_conn(); c_tmp = conn_tmp.cursor()
-        br = c_tmp.execute("SELECT pack_qty FROM product_barcodes WHERE code=?", (norm,)).fetchone()
-        conn_tmp.close()
-        if br:
-            try:
-                pack_qty = max(1, int(br["pack_qty"] or 1))
-            except Exception:
-                pack_qty = 1
-
-    qty = parse_float(request.form.get("qtd"), 0)
+        pid, pack_qty, _ = hit
+
+    # GS1-128: quantidade do AI (30)/(37) vale quando o campo vier vazio
+    qty = parse_float(request.form.get("qtd"), gs1.get("count", 0))
     unit_cost_raw = request.form.get("unit_cost")
     unit_cost = parse_float(unit_cost_raw, None) if unit_cost_raw not in (None, "") else None
     reason = (request.form.get("reason") or "Compra").strip()
-    note = (request.form.get("note") or "").strip()
+    note = _gs1_note((request.form.get("note") or "").strip(), gs1)
 
     if qty <= 0:
         flash("Quantidade deve ser maior que zero.", "error")
@@ -338,23 +410,13 @@ def entrada(pid):
 
     qty_final = qty * pack_qty
 
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id FROM products WHERE id=?", (pid,))
-    if not c.fetchone():
-        conn.close()
-        return abort(404)
-
-    c.execute(
-        """INSERT INTO stock_movements(product_id,type,quantity,unit_cost,reason,note,ts)
-           VALUES(?,?,?,?,?,?,?)""",
-        (pid, "IN", qty_final, unit_cost, reason, note, now_str()),
-    )
-    # Triggers atualizam current_qty
-    conn.commit()
-    conn.close()
+    # saldo + CMP numa única transação
+    try:
+        if post_movement(pid, "IN", qty_final, unit_cost, reason, note) is None:
+            return abort(404)
+    except (WriteTimeout, WriteOutcomeUnknown) as e:
+        return _write_timeout(pid, e)
 
-    recalc_avg_cost_on_in(pid, qty_final, unit_cost)
     if pack_qty > 1:
         flash(f"Entrada registrada: {qty} x pack({pack_qty}) = {qty_final}.", "success")
     else:
@@ -370,26 +432,19 @@ def saida(pid):
 
     # Se veio barcode, resolve produto + pack
     barcode = (request.form.get("barcode") or "").strip()
-    pack_qty = 1
+    pack_qty, gs1 = 1, {}
     if barcode:
-        norm = _normalize_barcode_for_lookup(barcode)
-        rowp = find_product_by_barcode(norm)
-        if not rowp:
+        # produto + pack do código numa consulta (ou nenhuma, com o cache quente)
+        hit, gs1 = _resolve_scan(barcode)
+        if not hit:
             flash("Código de barras não encontrado.", "warning")
             return redirect(url_for("products.index"))
-        pid = rowp["id"]
-        conn_tmp = get_conn(); c_tmp = conn_tmp.cursor()
-        br = c_tmp.execute("SELECT pack_qty FROM product_barcodes WHERE code=?", (norm,)).fetchone()
-        conn_tmp.close()
-        if br:
-            try:
-                pack_qty = max(1, int(br["pack_qty"] or 1))
-            except Exception:
-                pack_qty = 1
-
-    qty = parse_float(request.form.get("qtd"), 0)
+        pid, pack_qty, _ = hit
+
+    # GS1-128: quantidade do AI (30)/(37) vale quando o campo vier vazio
+    qty = parse_float(request.form.get("qtd"), gs1.get("count", 0))
     reason = (request.form.get("reason") or "Venda").strip()
-    note = (request.form.get("note") or "").strip()
+    note = _gs1_note((request.form.get("note") or "").strip(), gs1)
 
     if qty <= 0:
         flash("Quantidade deve ser maior que zero.", "error")
@@ -397,26 +452,15 @@ def saida(pid):
 
     qty_final = qty * pack_qty
 
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT current_qty FROM products WHERE id=?", (pid,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        return abort(404)
-    if qty_final > float(row["current_qty"] or 0):
-        conn.close()
+    # baixa atômica: o UPDATE condicional impede saldo negativo sob concorrência
+    try:
+        if post_movement(pid, "OUT", qty_final, None, reason, note) is None:
+            return abort(404)
+    except InsufficientStock:
         flash("Estoque insuficiente.", "error")
         return redirect(url_for("products.produto", pid=pid))
-
-    c.execute(
-        """INSERT INTO stock_movements(product_id,type,quantity,unit_cost,reason,note,ts)
-           VALUES(?,?,?,?,?,?,?)""",
-        (pid, "OUT", qty_final, None, reason, note, now_str()),
-    )
-    # Triggers atualizam current_qty
-    conn.commit()
-    conn.close()
+    except (WriteTimeout, WriteOutcomeUnknown) as e:
+        return _write_timeout(pid, e)
 
     if pack_qty > 1:
         flash(f"Saída registrada: {qty} x pack({pack_qty}) = {qty_final}.", "success")
@@ -424,6 +468,114 @@ def saida(pid):
         flash("Saída registrada.", "success")
     return redirect(url_for("products.produto", pid=pid))
 
+# -----------------------------
+# Movimentos em lote (JSON ou CSV)
+# -----------------------------
+
+def _bulk_payload():
+    """
+    Corpo das importações em lote -> (rows, opt). Aceita JSON (lista ou
+    {"rows": [...], flags...}) ou CSV/XLSX no campo `file` (flags no form).
+    opt(nome) lê a opção do JSON/form com fallback na query string.
+    Corpo inválido encerra o request com 400 JSON.
+    """
+    payload = request.get_json(silent=True) if request.is_json else None
+    if isinstance(payload, list):
+        rows, opts = payload, {}
+    elif isinstance(payload, dict):
+        rows, opts = payload.get("rows") or [], payload
+    elif "file" in request.files:
+        f = request.files["file"]
+        try:
+            rows, opts = read_table_rows(f.stream, f.filename or ""), request.form
+        except ValueError as e:
+            abort(make_response(jsonify({"error": str(e)}), 400))
+    else:
+        abort(make_response(jsonify({"error": "Envie JSON ou um arquivo CSV/XLSX no campo 'file'."}), 400))
+
+    def opt(name):
+        return opts.get(name, request.args.get(name))
+    return rows, opt
+
+def _flag(value) -> bool:
+    return str(value).lower() in ("1", "true", "on", "yes", "sim")
+
+def _bulk_timeout(err):
+    """Prazo do writer nas importações: 503 nada gravado; 409 se o lote pode ter sido gravado."""
+    if isinstance(err, WriteOutcomeUnknown):
+        return jsonify({"error": "A gravação demorou além do prazo e pode ter sido concluída: "
+                                 "confira antes de repetir.", "outcome": "unknown"}), 409
+    return jsonify({"error": "Banco ocupado: nada gravado, tente novamente.", "outcome": "none"}), 503
+
+@bp.post("/movimentos/lote")
+@login_required
+@csrf_unless_json
+def movimentos_lote():
+    """
+    Recebe JSON (lista ou {"rows": [...]}) ou CSV (campo `file`) com colunas
+    product_id|sku|barcode, type, quantity, unit_cost, reason, note, ts.
+    Flags (query/form/JSON): dry_run, skip_invalid, allow_negative.
+    """
+    if not role_allowed("admin", "operador"):
+        return jsonify({"error": "Permissão insuficiente."}), 403
+
+    rows, opt = _bulk_payload()
+    try:
+        report = post_movements_bulk(
+            rows,
+            allow_negative=_flag(opt("allow_negative")),
+            skip_invalid=_flag(opt("skip_invalid")),
+            dry_run=_flag(opt("dry_run")),
+        )
+    except (WriteTimeout, WriteOutcomeUnknown) as e:
+        return _bulk_timeout(e)
+    status = 422 if report["errors"] and not report["posted"] else 200
+    return jsonify(report), status
+
+@bp.post("/produtos/importar")
+@login_required
+@csrf_unless_json
+def produtos_importar():
+    """
+    Cadastro em lote (CSV/XLSX no campo `file` ou JSON), upsert por sku, com colunas
+    sku, name, category|category_id, supplier|supplier_id, unit, price, min_qty, qty, unit_cost.
+    Flags: skip_invalid, dry_run.
+    """
+    if not role_allowed("admin", "operador"):
+        return jsonify({"error": "Permissão insuficiente."}), 403
+
+    rows, opt = _bulk_payload()
+    try:
+        report = import_products_bulk(rows, skip_invalid=_flag(opt("skip_invalid")), dry_run=_flag(opt("dry_run")))
+    except (WriteTimeout, WriteOutcomeUnknown) as e:
+        return _bulk_timeout(e)
+    status = 422 if report["errors"] and not (report["created"] or report["updated"]) else 200
+    return jsonify(report), status
+
+@bp.post("/barcodes/importar")
+@login_required
+@csrf_unless_json
+def barcodes_importar():
+    """
+    Importa catálogo de códigos (CSV no campo `file` ou JSON) com colunas
+    product_id|sku, code, symbology, pack_qty, label, is_primary.
+    Flags: on_conflict=error|skip|update, skip_invalid, dry_run.
+    """
+    if not role_allowed("admin", "operador"):
+        return jsonify({"error": "Permissão insuficiente."}), 403
+
+    rows, opt = _bulk_payload()
+    on_conflict = str(opt("on_conflict") or "error").strip().lower()
+    if on_conflict not in ("error", "skip", "update"):
+        return jsonify({"error": "on_conflict deve ser error, skip ou update."}), 400
+    try:
+        report = import_barcodes_bulk(rows, on_conflict=on_conflict,
+                                      skip_invalid=_flag(opt("skip_invalid")), dry_run=_flag(opt("dry_run")))
+    except (WriteTimeout, WriteOutcomeUnknown) as e:
+        return _bulk_timeout(e)
+    status = 422 if report["errors"] and not (report["inserted"] or report["updated"]) else 200
+    return jsonify(report), status
+
 # -----------------------------
 # BARCODE: gerenciar no editar (opcional)
 # -----------------------------
@@ -444,14 +596,12 @@ def add_barcode_route(pid):
         flash("Informe o código.", "warning")
         return redirect(url_for("products.editar", pid=pid))
 
-    # valida EAN-13 com normalização (UPC-A -> EAN-13) e DV
-    if sym == "EAN13":
-        try:
-            from ..utils_barcode import validate_and_normalize_ean13
-            code = validate_and_normalize_ean13(code)  # usa normalizado
-        except Exception as e:
-            flash(f"EAN-13 inválido: {e}", "warning")
-            return redirect(url_for("products.editar", pid=pid))
+    # valida DV da simbologia e grava a mesma chave que o scan gera (UPC -> EAN-13, etc.)
+    try:
+        code = normalize_barcode(code, sym)
+    except ValueError as e:
+        flash(f"{sym} inválido: {e}", "warning")
+        return redirect(url_for("products.editar", pid=pid))
 
     try:
         add_barcode(pid, code, sym, pack, label, 0)
@@ -468,38 +618,45 @@ def remove_barcode(pid, bid):
         flash("Permissão insuficiente.", "error")
         return redirect(url_for("products.index"))
 
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM product_barcodes WHERE id=? AND product_id=?", (bid, pid))
-    conn.commit()
-    conn.close()
+    run_write(lambda conn: conn.execute(
+        "DELETE FROM product_barcodes WHERE id=? AND product_id=?", (bid, pid)))
+    invalidate_barcode_cache()
     flash("Código removido.", "success")
     return redirect(url_for("products.editar", pid=pid))
 
+def _history_args():
+    """Lê start/end/cursor da query; end vira limite exclusivo (início do dia seguinte)."""
+    start = (request.args.get("start") or "").strip()
+    end = (request.args.get("end") or "").strip()
+    start_epoch = to_epoch(start)
+    end_epoch = to_epoch(end)
+    if end_epoch is not None:
+        end_epoch += 86400
+    return start, end, start_epoch, end_epoch, (request.args.get("cursor") or "").strip()
+
 @bp.get("/produto/<int:pid>")
 @login_required
 def produto(pid):
-    start = (request.args.get("start") or "").strip()
-    end = (request.args.get("end") or "").strip()
+    start, end, start_epoch, end_epoch, cursor = _history_args()
     p = find_product(pid)
     if not p:
         return abort(404)
 
-    conn = get_conn()
-    c = conn.cursor()
-    where = "WHERE product_id=?"
-    params = [pid]
-    if start:
-        where += " AND date(ts) >= date(?)"
-        params.append(start)
-    if end:
-        where += " AND date(ts) <= date(?)"
-        params.append(end)
-    c.execute(
-        f"""SELECT id, ts, type, quantity, unit_cost, reason, note
-            FROM stock_movements {where} ORDER BY ts DESC""",
-        params,
-    )
-    movs = c.fetchall()
-    conn.close()
-    return render_template("produto.html", p=p, movs=movs, start=start, end=end)
+    # keyset sobre (ts_epoch, id) usando idx_movs_prod_ts; demais páginas via JSON
+    movs, next_cursor = movement_history(pid, start_epoch, end_epoch, cursor,
+                                         limit=Config.HISTORY_PAGE_SIZE)
+    return render_template("produto.html", p=p, movs=movs, start=start, end=end,
+                           next_cursor=next_cursor)
+
+@bp.get("/produto/<int:pid>/movimentos")
+@login_required
+def produto_movimentos(pid):
+    """'Carregar mais' do histórico: próxima página a partir de ?cursor=."""
+    _, _, start_epoch, end_epoch, cursor = _history_args()
+    per_page = max(1, min(500, parse_int(request.args.get("per_page"), Config.HISTORY_PAGE_SIZE)))
+    movs, next_cursor = movement_history(pid, start_epoch, end_epoch, cursor, limit=per_page)
+    return jsonify({
+        "items": [{k: m[k] for k in ("id", "ts", "type", "quantity", "unit_cost", "reason", "note")}
+                  for m in movs],
+        "next_cursor": next_cursor,
+    })
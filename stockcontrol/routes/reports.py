@@ -1,7 +1,13 @@
-from flask import Blueprint, render_template, send_file
+from flask import Blueprint, Response, abort, current_app, jsonify, render_template, request, send_file, stream_with_context
 from flask_login import login_required
-import csv, io
+import csv, tempfile, time, zlib
+from datetime import datetime, timedelta
 from ..db import get_conn
+from ..services.asof import position_rows
+from ..services.exports import (
+    MOVEMENTS_SQL, PRODUCTS_SQL, movements_schema, products_schema, parquet_available, write_parquet,
+)
+from ..utils import parse_int, parse_ts, to_epoch, encode_cursor, decode_cursor
 
 bp = Blueprint("reports", __name__, url_prefix="/relatorios")
 
@@ -9,62 +15,381 @@ bp = Blueprint("reports", __name__, url_prefix="/relatorios")
 @login_required
 def low_stock():
     conn = get_conn(); c = conn.cursor()
-    c.execute("""SELECT id, sku, name, unit,
-                        printf('%.2f', current_qty) AS current_qty,
-                        printf('%.2f', min_qty) AS min_qty
-                 FROM products
-                 WHERE current_qty <= min_qty
-                 ORDER BY name""")
-    itens = c.fetchall(); conn.close()
-    return render_template("rel_baixo_estoque.html", itens=itens)
+    # is_low mantido por triggers; idx_products_low (parcial) já entrega em ordem de nome.
+    # Giro (services.analytics): consumo médio, cobertura com o saldo atual e classe.
+    c.execute("""SELECT p.id, p.sku, p.name, p.unit,
+                        printf('%.2f', p.current_qty) AS current_qty,
+                        printf('%.2f', p.min_qty) AS min_qty,
+                        pa.avg_daily, pa.abc, pa.xyz,
+                        CASE WHEN pa.avg_daily > 0 THEN p.current_qty / pa.avg_daily END AS days_cover
+                 FROM products p
+                 LEFT JOIN product_analytics pa ON pa.product_id = p.id
+                 WHERE p.is_low = 1
+                 ORDER BY p.name""")
+    itens = c.fetchall()
+    c.execute("""SELECT e.id, e.product_id, e.event, e.current_qty, e.min_qty, e.ts,
+                        COALESCE(p.name, '(excluído)') AS name
+                 FROM low_stock_events e LEFT JOIN products p ON p.id = e.product_id
+                 ORDER BY e.id DESC LIMIT 20""")
+    eventos = c.fetchall(); conn.close()
+    return render_template("rel_baixo_estoque.html", itens=itens, eventos=eventos)
+
+def _last_low_event() -> int:
+    conn = get_conn()
+    try:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM low_stock_events").fetchone()[0]
+    finally:
+        conn.close()
+
+@bp.get("/baixo-estoque/eventos")
+@login_required
+def low_stock_events():
+    """
+    Feed de transições (LOW / RECOVERED) com id > since, em ordem; next_since é o
+    cursor da próxima chamada. wait=N (até LOW_EVENTS_MAX_WAIT_S; 0 desliga)
+    segura a resposta até chegar algo novo (long-poll curto), consultando só
+    MAX(id) pela PK; a conexão volta ao pool entre as consultas. Clientes devem
+    preferir repetir a chamada com since a esperas longas (cada espera ocupa um worker).
+    """
+    since = max(0, parse_int(request.args.get("since"), 0))
+    limit = max(1, min(1000, parse_int(request.args.get("limit"), 200)))
+    max_wait = current_app.config.get("LOW_EVENTS_MAX_WAIT_S", 10)
+    wait = max(0, min(max_wait, parse_int(request.args.get("wait"), 0)))
+    deadline = time.monotonic() + wait
+    while _last_low_event() <= since and time.monotonic() < deadline:
+        time.sleep(0.5)
+    conn = get_conn()
+    try:
+        events = [dict(r) for r in conn.execute(
+            """SELECT id, product_id, event, current_qty, min_qty, ts
+               FROM low_stock_events WHERE id > ? ORDER BY id LIMIT ?""", (since, limit))]
+    finally:
+        conn.close()
+    return jsonify({"events": events, "next_since": events[-1]["id"] if events else since})
 
 @bp.get("/valorizacao")
 @login_required
 def valuation():
+    """
+    Totais e subtotais por categoria vêm de valuation_totals (mantida por triggers);
+    o detalhe é paginado por keyset (name, id) sobre idx_products_name.
+    """
+    cat = parse_int(request.args.get("cat"), None)
+    per_page = max(1, min(500, parse_int(request.args.get("per_page"), current_app.config.get("VALUATION_PAGE_SIZE", 100))))
+    after = decode_cursor(request.args.get("after") or "") if request.args.get("after") else None
+
     conn = get_conn(); c = conn.cursor()
-    c.execute("""SELECT name, sku, unit,
+    c.execute("""SELECT v.category_id, COALESCE(cat.name, 'Sem categoria') AS name, v.items, v.qty,
+                        v.total_price, v.total_cost
+                 FROM valuation_totals v
+                 LEFT JOIN categories cat ON cat.id = v.category_id
+                 WHERE v.items > 0
+                 ORDER BY v.total_cost DESC""")
+    categories = c.fetchall()
+    total_price = sum(r["total_price"] for r in categories)
+    total_cost = sum(r["total_cost"] for r in categories)
+
+    where, params = [], []
+    if cat is not None:
+        where.append("COALESCE(category_id, 0) = ?"); params.append(cat)
+    if after:
+        where.append("(name, id) > (?, ?)"); params += [after[0], after[1]]
+    where_sql = "WHERE " + " AND ".join(where) if where else ""
+    c.execute(f"""SELECT id, name, sku, unit,
                         printf('%.2f', current_qty) AS current_qty,
                         printf('%.2f', price) AS price,
                         printf('%.2f', avg_cost) AS avg_cost,
                         printf('%.2f', (current_qty * price)) AS subtotal,
                         printf('%.2f', (current_qty * avg_cost)) AS custo_total
-                 FROM products ORDER BY name""")
+                 FROM products {where_sql} ORDER BY name, id LIMIT ?""", params + [per_page + 1])
     rows = c.fetchall()
-    c.execute("SELECT SUM(current_qty * price), SUM(current_qty * avg_cost) FROM products")
-    total_price, total_cost = c.fetchone()
-    total_price = total_price or 0.0
-    total_cost = total_cost or 0.0
     conn.close()
-    return render_template("rel_valorizacao.html", rows=rows, total_price=total_price, total_cost=total_cost)
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1]["name"], rows[-1]["id"])
+    return render_template("rel_valorizacao.html", rows=rows, categories=categories, cat=cat,
+                           total_price=total_price, total_cost=total_cost,
+                           next_cursor=next_cursor, per_page=per_page, paged=bool(after))
+
+@bp.get("/posicao")
+@login_required
+def position():
+    """
+    Estoque e valor (a CMP) no fim de uma data, reconstruídos do ledger a partir
+    do checkpoint mensal mais próximo (services.asof). ?formato=csv baixa tudo.
+    """
+    day = _day(request.args.get("data") or datetime.now().strftime("%Y-%m-%d"))
+    cat = parse_int(request.args.get("cat"), None)
+    per_page = max(1, min(500, parse_int(request.args.get("per_page"), current_app.config.get("VALUATION_PAGE_SIZE", 100))))
+    page = max(1, parse_int(request.args.get("page"), 1))
+    pos, rows, categories = position_rows(day, cat, chunk_size=current_app.config.get("ASOF_CHUNK_SIZE", 50000))
+
+    if request.args.get("formato") == "csv":
+        header = ["id", "sku", "name", "unit", "category_id", "qty", "avg_cost", "value"]
+        return _csv_stream(_dict_chunks(rows, header), f"posicao-{day:%Y-%m-%d}.csv")
+
+    total_qty = sum(g["qty"] for g in categories)
+    total_cost = sum(g["total_cost"] for g in categories)
+    pages = max(1, -(-len(rows) // per_page))
+    page = min(page, pages)
+    return render_template("rel_posicao.html", rows=rows[(page - 1) * per_page:page * per_page],
+                           categories=categories, cat=cat, day=day, pos=pos,
+                           total_qty=total_qty, total_cost=total_cost,
+                           page=page, pages=pages, per_page=per_page)
+
+@bp.get("/painel")
+@login_required
+def dashboard():
+    """
+    Painel de movimentação lido só dos rollups diários: série e categorias vêm de
+    category_daily (categorias x dias), maiores saídas de movement_daily pela
+    janela de dias (idx_mdaily_day). Nada depende do tamanho do ledger.
+    ?dias=N (padrão 30); ?formato=json devolve os mesmos dados.
+    """
+    days = max(1, min(365, parse_int(request.args.get("dias"), 30)))
+    today = datetime.now().date()
+    start = (today - timedelta(days=days - 1)).isoformat()
+    prev_start = (today - timedelta(days=2 * days - 1)).isoformat()
+
+    conn = get_conn(); c = conn.cursor()
+    c.execute("""SELECT day, TOTAL(qty_in) AS qty_in, TOTAL(qty_out) AS qty_out,
+                        TOTAL(cost_in) AS cost_in, SUM(count) AS count
+                 FROM category_daily WHERE day >= ?
+                 GROUP BY day ORDER BY day""", (start,))
+    by_day = {r["day"]: dict(r) for r in c.fetchall()}
+    # sem INDEXED BY o planner prefere varrer a PK (product_id, day) inteira
+    c.execute("""SELECT p.id, p.sku, p.name, p.unit, m.qty_out, m.qty_in, m.count
+                 FROM (SELECT product_id, TOTAL(qty_out) AS qty_out, TOTAL(qty_in) AS qty_in, SUM(count) AS count
+                         FROM movement_daily INDEXED BY idx_mdaily_day WHERE day >= ?
+                        GROUP BY product_id ORDER BY qty_out DESC LIMIT 10) m
+                 JOIN products p ON p.id = m.product_id
+                 ORDER BY m.qty_out DESC""", (start,))
+    movers = [dict(r) for r in c.fetchall()]
+    # tendência por categoria (atual do cadastro): janela atual x janela anterior
+    c.execute("""SELECT d.category_id, COALESCE(cat.name, 'Sem categoria') AS name,
+                        TOTAL(CASE WHEN d.day >= ? THEN d.qty_in END) AS qty_in,
+                        TOTAL(CASE WHEN d.day >= ? THEN d.qty_out END) AS qty_out,
+                        TOTAL(CASE WHEN d.day <  ? THEN d.qty_out END) AS prev_out
+                 FROM category_daily d
+                 LEFT JOIN categories cat ON cat.id = d.category_id
+                 WHERE d.day >= ?
+                 GROUP BY d.category_id ORDER BY qty_out DESC""", (start, start, start, prev_start))
+    categories = [dict(r) for r in c.fetchall()]
+    conn.close()
+
+    zero = {"qty_in": 0.0, "qty_out": 0.0, "cost_in": 0.0, "count": 0}
+    series = [{**zero, **by_day.get(d, {}), "day": d} for d in
+              ((today - timedelta(days=i)).isoformat() for i in range(days - 1, -1, -1))]
+    totals = {k: sum(r[k] for r in series) for k in zero}
+    for g in categories:
+        g["change"] = (g["qty_out"] - g["prev_out"]) / g["prev_out"] if g["prev_out"] else None
+
+    if request.args.get("formato") == "json":
+        return jsonify({"days": days, "start": start, "totals": totals, "series": series,
+                        "top_movers": movers, "categories": categories})
+    peak = max([max(r["qty_in"], r["qty_out"]) for r in series] + [1.0])
+    return render_template("rel_painel.html", days=days, start=start, totals=totals, series=series,
+                           movers=movers, categories=categories, peak=peak)
 
 # Exportações (fora de /relatorios para manter urls curtas)
+# Streaming: o cursor é lido em blocos (fetchmany) e cada bloco vira um pedaço
+# da resposta, então a memória não depende do tamanho da tabela.
 from flask import Blueprint as _BP2
 bp_export = _BP2("export", __name__, url_prefix="/export")
 
+class _Echo:
+    """Pseudo-arquivo: csv.writer devolve a linha formatada em vez de gravá-la."""
+    def write(self, value):
+        return value
+
+def _csv_chunks(sql, params, header):
+    conn = get_conn()
+    try:
+        c = conn.cursor()
+        c.execute(sql, params)
+        w = csv.writer(_Echo())
+        yield w.writerow(header)
+        size = current_app.config.get("EXPORT_FETCH_SIZE", 1000)
+        while True:
+            rows = c.fetchmany(size)
+            if not rows:
+                break
+            yield "".join(w.writerow(tuple(r)) for r in rows)
+    finally:
+        conn.close()
+
+def _dict_chunks(rows, header):
+    """Como _csv_chunks, para linhas (dicts) já em memória."""
+    w = csv.writer(_Echo())
+    yield w.writerow(header)
+    size = current_app.config.get("EXPORT_FETCH_SIZE", 1000)
+    for i in range(0, len(rows), size):
+        yield "".join(w.writerow([r[k] for k in header]) for r in rows[i:i + size])
+
+def _gzip_chunks(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> formato .gz
+    for chunk in chunks:
+        data = z.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield z.flush()
+
+def _csv_response(sql, params, header, filename, headers=None):
+    """CSV em streaming; ?gzip=1 comprime on-the-fly e entrega <arquivo>.csv.gz."""
+    return _csv_stream(_csv_chunks(sql, params, header), filename, headers)
+
+def _csv_stream(chunks, filename, headers=None):
+    if (request.args.get("gzip") or "").lower() in ("1", "true", "on", "sim"):
+        body, mimetype, filename = _gzip_chunks(chunks), "application/gzip", filename + ".gz"
+    else:
+        body, mimetype = (chunk.encode("utf-8") for chunk in chunks), "text/csv; charset=utf-8"
+    resp = Response(stream_with_context(body), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    resp.headers["X-Accel-Buffering"] = "no"  # proxy não acumula a resposta inteira
+    resp.headers.update(headers or {})
+    return resp
+
 @bp_export.get("/produtos.csv")
 @login_required
 def export_products():
-    conn = get_conn(); c = conn.cursor()
-    c.execute("""SELECT id, sku, name, unit, price, avg_cost, min_qty, current_qty, created_at, category_id, supplier_id
-                 FROM products ORDER BY id""")
-    rows = c.fetchall(); conn.close()
-    output = io.StringIO(); w = csv.writer(output)
-    w.writerow(["id","sku","name","unit","price","avg_cost","min_qty","current_qty","created_at","category_id","supplier_id"])
-    for r in rows:
-        w.writerow([r["id"], r["sku"], r["name"], r["unit"], r["price"], r["avg_cost"], r["min_qty"], r["current_qty"], r["created_at"], r["category_id"], r["supplier_id"]])
-    mem = io.BytesIO(output.getvalue().encode("utf-8"))
-    return send_file(mem, mimetype="text/csv", as_attachment=True, download_name="produtos.csv")
+    return _csv_response(
+        """SELECT id, sku, name, unit, price, avg_cost, min_qty, current_qty, created_at, category_id, supplier_id
+           FROM products ORDER BY id""", (),
+        ["id","sku","name","unit","price","avg_cost","min_qty","current_qty","created_at","category_id","supplier_id"],
+        "produtos.csv")
+
+def _day(s):
+    try:
+        return datetime.strptime(s, "%Y-%m-%d")
+    except ValueError:
+        abort(400, description=f"Data inválida: {s} (use AAAA-MM-DD).")
+
+def _moves_filter():
+    """
+    Lê os filtros de exportação de movimentos da query -> (where_sql, params, order, headers).
+    start/end (AAAA-MM-DD, end inclusivo), product_id ou sku; modo incremental com
+    since_id/since_ts (+ limit só para since_id puro) e cursor em X-Next-Since-Id.
+    A ordenação segue o índice usado pelo filtro, sem ordenar em memória.
+    """
+    start = (request.args.get("start") or "").strip()
+    end = (request.args.get("end") or "").strip()
+    pid = parse_int(request.args.get("product_id"), None)
+    sku = (request.args.get("sku") or "").strip()
+    since_id = parse_int(request.args.get("since_id"), None)
+    since_raw = (request.args.get("since_ts") or "").strip()
+    limit = parse_int(request.args.get("limit"), 0)
+    # mesmo formato de stock_movements.ts nos dois caminhos (texto e ts_epoch)
+    since_ts = parse_ts(since_raw) if since_raw else None
+    if since_raw and since_ts is None:
+        abort(400, description=f"since_ts inválido: {since_raw} (use AAAA-MM-DD HH:MM:SS).")
+    conn = get_conn()
+    if sku:
+        row = conn.execute("SELECT id FROM products WHERE sku=?", (sku,)).fetchone()
+        pid = row["id"] if row else -1
+    start_dt = _day(start) if start else None
+    end_dt = _day(end) + timedelta(days=1) if end else None
+
+    where, params, headers = [], [], {}
+    if pid is not None:
+        # idx_movs_prod_ts (product_id, ts_epoch)
+        where.append("product_id = ?"); params.append(pid)
+        if start_dt:
+            where.append("ts_epoch >= ?"); params.append(to_epoch(start_dt.isoformat()))
+        if end_dt:
+            where.append("ts_epoch < ?"); params.append(to_epoch(end_dt.isoformat()))
+        if since_ts:
+            where.append("ts_epoch >= ?"); params.append(to_epoch(since_ts))
+        order = "ts_epoch, id"
+    elif start_dt or end_dt or since_ts:
+        # idx_movs_ts (ts texto 'AAAA-MM-DD HH:MM:SS')
+        if start_dt:
+            where.append("ts >= ?"); params.append(start_dt.strftime("%Y-%m-%d"))
+        if end_dt:
+            where.append("ts < ?"); params.append(end_dt.strftime("%Y-%m-%d"))
+        if since_ts:
+            where.append("ts >= ?"); params.append(since_ts)
+        order = "ts, id"
+    else:
+        order = "id"
+
+    if since_id is not None or since_ts:
+        # fotografia: limite superior fixo, vira o cursor da próxima chamada
+        if order == "id" and limit > 0:
+            row = conn.execute("""SELECT id FROM stock_movements WHERE id > ?
+                                  ORDER BY id LIMIT 1 OFFSET ?""", (since_id or 0, limit - 1)).fetchone()
+        else:
+            row = None
+        upper = row["id"] if row else conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements").fetchone()[0]
+        upper = max(upper, since_id or 0)
+        if since_id is not None:
+            where.append("id > ?"); params.append(since_id)
+        where.append("id <= ?"); params.append(upper)
+        headers["X-Next-Since-Id"] = str(upper)
+    conn.close()
+    return ("WHERE " + " AND ".join(where) if where else ""), params, order, headers
 
 @bp_export.get("/movimentos.csv")
 @login_required
 def export_moves():
-    conn = get_conn(); c = conn.cursor()
-    c.execute("""SELECT id, product_id, type, quantity, unit_cost, reason, note, ts
-                 FROM stock_movements ORDER BY id""")
-    rows = c.fetchall(); conn.close()
-    output = io.StringIO(); w = csv.writer(output)
-    w.writerow(["id","product_id","type","quantity","unit_cost","reason","note","ts"])
-    for r in rows:
-        w.writerow([r["id"], r["product_id"], r["type"], r["quantity"], r["unit_cost"], r["reason"], r["note"], r["ts"]])
-    mem = io.BytesIO(output.getvalue().encode("utf-8"))
-    return send_file(mem, mimetype="text/csv", as_attachment=True, download_name="movimentos.csv")
+    """Filtros em _moves_filter; ?gzip=1. Exclusões vêm de /export/movimentos-excluidos.csv."""
+    where_sql, params, order, headers = _moves_filter()
+    return _csv_response(
+        f"""SELECT id, product_id, type, quantity, unit_cost, reason, note, ts
+            FROM stock_movements {where_sql} ORDER BY {order}""", params,
+        ["id","product_id","type","quantity","unit_cost","reason","note","ts"],
+        "movimentos.csv", headers)
+
+def _parquet_response(sql, params, schema_fn, filename, headers=None):
+    """
+    Parquet tipado gravado por row groups direto do cursor. O rodapé do Parquet
+    só existe no fim, então o arquivo passa por um temporário (memória -> disco).
+    """
+    if not parquet_available():
+        abort(501, description="Exportação Parquet indisponível: instale pyarrow.")
+    tmp = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    conn = get_conn()
+    try:
+        c = conn.cursor()
+        c.execute(sql, params)
+        write_parquet(c, schema_fn(), tmp,
+                      row_group_size=current_app.config.get("PARQUET_ROW_GROUP_SIZE", 65536),
+                      compression=current_app.config.get("PARQUET_COMPRESSION", "zstd"))
+    except Exception:
+        tmp.close()
+        raise
+    finally:
+        conn.close()
+    tmp.seek(0)
+    resp = send_file(tmp, mimetype="application/vnd.apache.parquet", as_attachment=True,
+                     download_name=filename)
+    resp.headers.update(headers or {})
+    return resp
+
+@bp_export.get("/movimentos.parquet")
+@login_required
+def export_moves_parquet():
+    """Mesmos filtros de /export/movimentos.csv; quantity/unit_cost float64, ts timestamp."""
+    where_sql, params, order, headers = _moves_filter()
+    return _parquet_response(MOVEMENTS_SQL.format(where=where_sql, order=order), params,
+                             movements_schema, "movimentos.parquet", headers)
+
+@bp_export.get("/produtos.parquet")
+@login_required
+def export_products_parquet():
+    return _parquet_response(PRODUCTS_SQL, (), products_schema, "produtos.parquet")
+
+@bp_export.get("/movimentos-excluidos.csv")
+@login_required
+def export_moves_deleted():
+    """Tombstones de movimentos excluídos com seq > since; X-Next-Since traz o próximo cursor."""
+    since = parse_int(request.args.get("since"), 0)
+    conn = get_conn()
+    upper = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM stock_movement_tombstones").fetchone()[0]
+    conn.close()
+    upper = max(upper, since)
+    return _csv_response(
+        """SELECT seq, movement_id, product_id, deleted_at FROM stock_movement_tombstones
+           WHERE seq > ? AND seq <= ? ORDER BY seq""", (since, upper),
+        ["seq","movement_id","product_id","deleted_at"],
+        "movimentos_excluidos.csv", {"X-Next-Since": str(upper)})
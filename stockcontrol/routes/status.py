@@ -0,0 +1,18 @@
+from flask import Blueprint, jsonify, abort
+from flask_login import login_required, current_user
+from ..cache import cache_stats
+from ..db import pool_stats
+from ..db_writer import writer_stats
+
+bp = Blueprint("status", __name__, url_prefix="/status")
+
+@bp.get("/")
+@login_required
+def view():
+    if current_user.role != "admin":
+        return abort(403)
+    return jsonify({
+        "db_pool": pool_stats(),
+        "writer": writer_stats(),
+        "caches": cache_stats(),
+    })
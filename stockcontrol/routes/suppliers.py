@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from ..db import get_conn
+from ..db import get_conn, list_suppliers, invalidate_refdata
 
 bp = Blueprint("suppliers", __name__, url_prefix="/fornecedores")
 
@@ -21,16 +21,18 @@ def view():
             else:
                 try:
                     c.execute("INSERT INTO suppliers(name,contact) VALUES(?,?)", (name, contact))
-                    conn.commit(); flash("Fornecedor criado.", "success")
+                    conn.commit(); invalidate_refdata("suppliers")
+                    flash("Fornecedor criado.", "success")
                 except:
                     flash("Fornecedor já existe.", "error")
     q = (request.args.get("q") or "").strip()
     if q:
         like = f"%{q}%"
         c.execute("SELECT id,name,COALESCE(contact,'') contact FROM suppliers WHERE name LIKE ? OR contact LIKE ? ORDER BY name", (like, like))
+        sups = c.fetchall()
     else:
-        c.execute("SELECT id,name,COALESCE(contact,'') contact FROM suppliers ORDER BY name")
-    sups = c.fetchall(); conn.close()
+        sups = list_suppliers()
+    conn.close()
     return render_template("fornecedores.html", sups=sups, q=q)
 
 @bp.post("/excluir/<int:sid>")
@@ -42,5 +44,6 @@ def delete(sid):
     conn = get_conn(); c = conn.cursor()
     c.execute("DELETE FROM suppliers WHERE id=?", (sid,))
     conn.commit(); conn.close()
+    invalidate_refdata("suppliers")
     flash("Fornecedor removido.", "success")
     return redirect(url_for("suppliers.view"))
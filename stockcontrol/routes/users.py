@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
+from ..auth import invalidate_user
 from ..db import get_conn
 
 bp = Blueprint("users", __name__, url_prefix="/usuarios")
@@ -26,7 +27,9 @@ def manage():
             try:
                 c.execute("INSERT INTO users(username, passhash, role, created_at) VALUES(?,?,?,datetime('now'))",
                           (username, generate_password_hash(password), role))
-                conn.commit(); flash("Usuário criado.", "success")
+                uid = c.lastrowid
+                conn.commit(); invalidate_user(uid)
+                flash("Usuário criado.", "success")
             except:
                 flash("Usuário já existe.", "error")
     c.execute("SELECT id, username, role, created_at FROM users ORDER BY username")
@@ -46,5 +49,6 @@ def delete(uid):
     conn = get_conn(); c = conn.cursor()
     c.execute("DELETE FROM users WHERE id=?", (uid,))
     conn.commit(); conn.close()
+    invalidate_user(uid)
     flash("Usuário removido.", "success")
     return redirect(url_for("users.manage"))
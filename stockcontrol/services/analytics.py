@@ -0,0 +1,174 @@
+# stockcontrol/services/analytics.py
+# Giro por produto em lote: consumo médio diário por janela, dias de cobertura
+# e classes ABC (valor consumido) / XYZ (variabilidade semanal). Lê as saídas já
+# agregadas por dia em movement_daily, dia a dia, numa única passada.
+import math
+from itertools import chain
+from datetime import date, timedelta
+from ..db import get_conn
+from ..db_writer import run_write
+from ..utils import now_str
+
+try:  # opcional: acumulação vetorizada por produto
+    import numpy as np
+except ImportError:  # pragma: no cover - sem numpy cai no laço puro
+    np = None
+
+PERIOD_DAYS = 7  # período do XYZ (semana)
+
+def _parse_list(s, cast=float):
+    return [cast(x) for x in str(s).replace(";", ",").split(",") if x.strip()]
+
+def _accumulate(c, ids, today, windows, class_periods):
+    """
+    Uma passada pelos dias (do mais recente para trás; uma busca por dia em
+    idx_mdaily_day) somando qty_out por produto: total por janela (idade < w
+    dias) e, nas semanas da janela de classificação, soma e soma dos quadrados
+    das semanas (XYZ). Retorna (totais {w: seq}, s1, s2), alinhadas a ids.
+    """
+    n = len(ids)
+    span = -(-max(max(windows), class_periods * PERIOD_DAYS) // PERIOD_DAYS) * PERIOD_DAYS
+    if np is not None:
+        ids_arr = np.asarray(ids, dtype=np.int64)
+        totals = {w: np.zeros(n) for w in windows}
+        s1, s2, week = np.zeros(n), np.zeros(n), np.zeros(n)
+    else:
+        pos = {pid: i for i, pid in enumerate(ids)}
+        totals = {w: [0.0] * n for w in windows}
+        s1, s2, week = [0.0] * n, [0.0] * n, {}
+
+    for age in range(span):
+        day = (today - timedelta(days=age)).isoformat()
+        # sem INDEXED BY o planner prefere varrer a PK (product_id, day) inteira
+        rows = c.execute("""SELECT product_id, qty_out FROM movement_daily INDEXED BY idx_mdaily_day
+                            WHERE day = ? AND qty_out > 0""", (day,)).fetchall()
+        in_windows = [w for w in windows if age < w]
+        if rows and np is not None:
+            flat = np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=2 * len(rows))
+            pid, qty = flat[0::2].astype(np.int64), flat[1::2]
+            ix = np.searchsorted(ids_arr, pid)
+            ok = (ix < n) & (ids_arr[np.minimum(ix, n - 1)] == pid)  # ignora produtos excluídos
+            day_sum = np.bincount(ix[ok], weights=qty[ok], minlength=n)
+            for w in in_windows:
+                totals[w] += day_sum
+            week += day_sum
+        elif rows:
+            for pid, qty in rows:
+                i = pos.get(pid)
+                if i is None:
+                    continue
+                for w in in_windows:
+                    totals[w][i] += qty
+                week[i] = week.get(i, 0.0) + qty
+        if age % PERIOD_DAYS == PERIOD_DAYS - 1:
+            # fim da semana: entra no XYZ se estiver na janela de classificação
+            if age // PERIOD_DAYS < class_periods:
+                if np is not None:
+                    s1 += week
+                    s2 += week * week
+                else:
+                    for i, q in week.items():
+                        s1[i] += q
+                        s2[i] += q * q
+            if np is not None:
+                week[:] = 0.0
+            else:
+                week = {}
+
+    if np is not None:
+        return {w: t.tolist() for w, t in totals.items()}, s1.tolist(), s2.tolist()
+    return totals, s1, s2
+
+def _abc(values, cuts):
+    """Curva ABC: ordena por valor; A até cuts[0] do total acumulado, B até cuts[1]."""
+    total = sum(values)
+    classes = ["C"] * len(values)
+    if total <= 0:
+        return classes
+    acc = 0.0
+    for i in sorted(range(len(values)), key=lambda i: -values[i]):
+        if values[i] <= 0:
+            break
+        classes[i] = "A" if acc < cuts[0] * total else "B" if acc < cuts[1] * total else "C"
+        acc += values[i]
+    return classes
+
+def compute_analytics(windows=(7, 30, 90), cover_days: int = 30, class_days: int = 364,
+                      abc_cuts=(0.8, 0.95), xyz_cuts=(0.5, 1.0), today: date = None) -> dict:
+    """
+    Calcula para todos os produtos (sem gravar):
+    - consumo médio diário em cada janela (saídas / dias);
+    - dias de cobertura = current_qty / consumo da janela cover_days;
+    - ABC pelo valor consumido na janela de classificação (qtd x CMP atual);
+    - XYZ pelo coeficiente de variação das saídas semanais (sem consumo: NULL).
+    """
+    today = today or date.today()
+    windows = sorted({int(w) for w in windows} | {int(cover_days)})
+    class_periods = max(1, -(-int(class_days) // PERIOD_DAYS))
+
+    conn = get_conn(); c = conn.cursor()
+    c.row_factory = None  # tuplas simples: milhões de linhas sem criar sqlite3.Row
+    try:
+        c.execute("BEGIN")
+        products = c.execute("SELECT id, current_qty, avg_cost FROM products ORDER BY id").fetchall()
+        ids = [r[0] for r in products]
+        totals, s1, s2 = _accumulate(c, ids, today, windows, class_periods)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    values = [s1[i] * max(products[i][2] or 0.0, 0.0) for i in range(len(ids))]
+    abc = _abc(values, abc_cuts)
+    rows = []
+    for i, (pid, qty, _) in enumerate(products):
+        avg_daily = totals[cover_days][i] / cover_days
+        mean = s1[i] / class_periods
+        if mean > 0:
+            cv = math.sqrt(max(s2[i] / class_periods - mean * mean, 0.0)) / mean
+            xyz = "X" if cv <= xyz_cuts[0] else "Y" if cv <= xyz_cuts[1] else "Z"
+        else:
+            cv = xyz = None
+        rows.append({
+            "product_id": pid,
+            "avg_daily": avg_daily,
+            "days_cover": max(qty or 0.0, 0.0) / avg_daily if avg_daily > 0 else None,
+            "consumption_value": values[i],
+            "cv": cv,
+            "abc": abc[i],
+            "xyz": xyz,
+            "windows": {w: totals[w][i] / w for w in windows},
+        })
+    return {"today": today.isoformat(), "windows": windows, "cover_days": cover_days,
+            "class_days": class_periods * PERIOD_DAYS, "rows": rows}
+
+def save_analytics(result: dict) -> int:
+    """Substitui product_analytics/product_consumption numa transação de escrita."""
+    ts = now_str()
+
+    def _save(conn):
+        conn.execute("DELETE FROM product_consumption")
+        conn.execute("DELETE FROM product_analytics")
+        conn.executemany(
+            """INSERT INTO product_analytics(product_id, avg_daily, days_cover, consumption_value,
+                                             cv, abc, xyz, computed_at)
+               VALUES(?,?,?,?,?,?,?,?)""",
+            [(r["product_id"], r["avg_daily"], r["days_cover"], r["consumption_value"],
+              r["cv"], r["abc"], r["xyz"], ts) for r in result["rows"]])
+        conn.executemany(
+            "INSERT INTO product_consumption(product_id, window_days, avg_daily) VALUES(?,?,?)",
+            [(r["product_id"], w, v) for r in result["rows"] for w, v in r["windows"].items() if v])
+        return len(result["rows"])
+
+    return run_write(_save)
+
+def run_analytics(cfg) -> dict:
+    """Calcula com os parâmetros ANALYTICS_* da config e grava."""
+    result = compute_analytics(
+        windows=_parse_list(cfg.get("ANALYTICS_WINDOWS", "7,30,90"), int),
+        cover_days=int(cfg.get("ANALYTICS_COVER_DAYS", 30)),
+        class_days=int(cfg.get("ANALYTICS_CLASS_DAYS", 364)),
+        abc_cuts=_parse_list(cfg.get("ANALYTICS_ABC_CUTS", "0.8,0.95")),
+        xyz_cuts=_parse_list(cfg.get("ANALYTICS_XYZ_CUTS", "0.5,1.0")),
+    )
+    save_analytics(result)
+    return result
@@ -0,0 +1,302 @@
+# stockcontrol/services/asof.py
+# Posição do estoque em uma data (qtd e CMP por produto) reconstruída do ledger.
+# Checkpoints mensais guardam o saldo no início de cada mês, então qualquer data
+# só reprocessa os movimentos desde o checkpoint anterior.
+from array import array
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from ..db import get_conn
+from ..db_writer import run_write
+from ..utils import now_str
+from .inventory import _new_avg_cost
+
+try:  # opcional: soma acumulada vetorizada no replay
+    import numpy as np
+except ImportError:  # pragma: no cover - sem numpy cai no laço puro
+    np = None
+
+CHUNK_SIZE = 50000
+
+# cutoff = 'AAAA-MM-DD' exclusivo: saldo com os movimentos de ts < cutoff
+# (comparação de texto com ts 'AAAA-MM-DD HH:MM:SS', usa idx_movs_ts)
+Position = namedtuple("Position", "cutoff checkpoint movements ledger")
+
+def _cutoff(day) -> str:
+    """Data inclusiva (date/datetime/'AAAA-MM-DD') -> corte exclusivo do dia seguinte."""
+    if isinstance(day, str):
+        day = datetime.strptime(day, "%Y-%m-%d")
+    if isinstance(day, datetime):
+        day = day.date()
+    return (day + timedelta(days=1)).isoformat()
+
+def _month_starts(first: str, until: date):
+    """1º dia de cada mês após o mês de `first` ('AAAA-MM-DD') até `until` (inclusive)."""
+    y, m = int(first[:4]), int(first[5:7])
+    out = []
+    while True:
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        d = date(y, m, 1)
+        if d > until:
+            return out
+        out.append(d.isoformat())
+
+# ==============================
+# Replay
+# ==============================
+def movement_chunks(c, size):
+    """
+    Cursor já executado com (product_id, type, quantity, unit_cost) -> blocos de
+    arrays tipados (ids, delta de qtd com sinal, custo de entrada ou 0).
+    """
+    while True:
+        rows = c.fetchmany(size)
+        if not rows:
+            return
+        pids, deltas, costs = array("q"), array("d"), array("d")
+        for pid, typ, qty, cost in rows:
+            qty = float(qty or 0)
+            pids.append(pid)
+            if typ == "IN":
+                deltas.append(qty)
+                costs.append(float(cost) if cost and cost > 0 else 0.0)
+            else:
+                deltas.append(-qty)
+                costs.append(0.0)
+        yield pids, deltas, costs
+
+class Ledger:
+    """
+    Saldo e CMP por produto durante o replay. Com numpy: arrays densos indexados
+    pelo id do produto; sem numpy: dict {id: [qtd, cmp]}.
+    """
+    def __init__(self):
+        if np is not None:
+            self.qty = np.zeros(1024)
+            self.avg = np.zeros(1024)
+        else:
+            self.bal = {}
+
+    @classmethod
+    def from_checkpoint(cls, c, cutoff):
+        led = cls()
+        if cutoff:
+            rows = c.execute("SELECT product_id, qty, avg_cost FROM stock_checkpoints WHERE cutoff=?",
+                             (cutoff,)).fetchall()
+            if np is not None and rows:
+                ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+                led._grow(int(ids.max()))
+                led.qty[ids] = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+                led.avg[ids] = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+            elif np is None:
+                led.bal = {r[0]: [r[1], r[2]] for r in rows}
+        return led
+
+    def _grow(self, max_id):
+        if max_id >= len(self.qty):
+            size = max(max_id + 1, 2 * len(self.qty))
+            for name in ("qty", "avg"):
+                arr = np.zeros(size)
+                arr[:len(getattr(self, name))] = getattr(self, name)
+                setattr(self, name, arr)
+
+    def feed(self, pids, deltas, costs):
+        if np is None:
+            bal = self.bal
+            for pid, d, k in zip(pids, deltas, costs):
+                b = bal.get(pid)
+                if b is None:
+                    b = bal[pid] = [0.0, 0.0]
+                if k > 0:
+                    b[1] = _new_avg_cost(b[0], b[1], d, k)
+                b[0] += d
+            return
+        pid = np.frombuffer(pids, dtype=np.int64)
+        self._grow(int(pid.max()))
+        # agrupa por produto mantendo a ordem cronológica dentro de cada um
+        order = np.argsort(pid, kind="stable")
+        p = pid[order]
+        d = np.frombuffer(deltas)[order]
+        k = np.frombuffer(costs)[order]
+        run = np.cumsum(d)
+        starts = np.flatnonzero(np.r_[True, p[1:] != p[:-1]])
+        ends = np.r_[starts[1:], len(p)]
+        after = self.qty[p] + run - np.repeat((run - d)[starts], ends - starts)
+        # CMP depende do anterior (não é soma acumulada): percorre só as entradas
+        # com custo, com o saldo antes de cada uma já vindo da soma acumulada
+        sel = np.flatnonzero(k > 0)
+        if len(sel):
+            avg = {}
+            for i, a, q, cost in zip(p[sel].tolist(), after[sel].tolist(), d[sel].tolist(), k[sel].tolist()):
+                prev = avg.get(i)
+                avg[i] = _new_avg_cost(a - q, float(self.avg[i]) if prev is None else prev, q, cost)
+            self.avg[list(avg)] = list(avg.values())
+        self.qty[p[ends - 1]] = after[ends - 1]
+
+    def items(self):
+        """(product_id, qtd, cmp) dos produtos com saldo ou CMP diferente de zero."""
+        if np is None:
+            return [(pid, b[0], b[1]) for pid, b in sorted(self.bal.items()) if b[0] or b[1]]
+        ids = np.flatnonzero((self.qty != 0) | (self.avg != 0))
+        return list(zip(ids.tolist(), self.qty[ids].tolist(), self.avg[ids].tolist()))
+
+    def get(self, pid):
+        if np is None:
+            b = self.bal.get(pid)
+            return (b[0], b[1]) if b else (0.0, 0.0)
+        if pid >= len(self.qty):
+            return 0.0, 0.0
+        return float(self.qty[pid]), float(self.avg[pid])
+
+def _replay(c, led, start, end, chunk_size):
+    """Aplica ao ledger os movimentos com start <= ts < end, em ordem (ts, id)."""
+    where, params = ["ts < ?"], [end]
+    if start:
+        where.append("ts >= ?"); params.append(start)
+    c.execute(f"""SELECT product_id, type, quantity, unit_cost FROM stock_movements
+                  WHERE {' AND '.join(where)} ORDER BY ts, id""", params)
+    n = 0
+    for chunk in movement_chunks(c, chunk_size):
+        led.feed(*chunk)
+        n += len(chunk[0])
+    return n
+
+def _latest_checkpoint(c, cutoff):
+    row = c.execute("""SELECT cutoff FROM stock_checkpoint_runs WHERE cutoff <= ?
+                       ORDER BY cutoff DESC LIMIT 1""", (cutoff,)).fetchone()
+    return row[0] if row else None
+
+def position_as_of(c, day, use_checkpoints: bool = True, chunk_size: int = CHUNK_SIZE) -> Position:
+    """
+    Saldo/CMP de cada produto no fim de `day` (inclusivo), em ordem cronológica
+    (ts, id). Parte do checkpoint mais próximo anterior e reprocessa o resto.
+    c é um cursor; a leitura roda numa única transação (fotografia consistente).
+    """
+    cutoff = _cutoff(day)
+    own_tx = not c.connection.in_transaction
+    if own_tx:
+        c.execute("BEGIN")
+    try:
+        base = _latest_checkpoint(c, cutoff) if use_checkpoints else None
+        led = Ledger.from_checkpoint(c, base)
+        n = _replay(c, led, base, cutoff, chunk_size)
+    finally:
+        if own_tx:
+            c.connection.rollback()
+    return Position(cutoff, base, n, led)
+
+def position_rows(day, cat=None, use_checkpoints: bool = True, chunk_size: int = CHUNK_SIZE):
+    """
+    -> (Position, linhas em ordem de nome, subtotais por categoria).
+    Linhas: dicts com os dados atuais do produto + qty/avg_cost/value na data;
+    só produtos com saldo na data. A categoria é a atual do cadastro.
+    """
+    conn = get_conn(); c = conn.cursor()
+    try:
+        pos = position_as_of(c, day, use_checkpoints, chunk_size)
+        c.execute("""SELECT p.id, p.sku, p.name, p.unit, COALESCE(p.category_id, 0) AS category_id,
+                            COALESCE(cat.name, 'Sem categoria') AS category
+                     FROM products p LEFT JOIN categories cat ON cat.id = p.category_id
+                     ORDER BY p.name, p.id""")
+        rows, groups = [], {}
+        for r in c:
+            qty, avg = pos.ledger.get(r["id"])
+            if abs(qty) < 1e-9:
+                continue
+            value = qty * avg
+            g = groups.setdefault(r["category_id"], {"category_id": r["category_id"], "name": r["category"],
+                                                     "items": 0, "qty": 0.0, "total_cost": 0.0})
+            g["items"] += 1; g["qty"] += qty; g["total_cost"] += value
+            if cat is None or r["category_id"] == cat:
+                rows.append({"id": r["id"], "sku": r["sku"], "name": r["name"], "unit": r["unit"],
+                             "category_id": r["category_id"], "qty": qty, "avg_cost": avg, "value": value})
+    finally:
+        conn.close()
+    return pos, rows, sorted(groups.values(), key=lambda g: -g["total_cost"])
+
+# ==============================
+# Checkpoints
+# ==============================
+class _StaleCheckpoint(Exception):
+    """Checkpoint base foi invalidado (movimento retroativo) durante a geração."""
+
+def _save_checkpoint(c, cutoff, led):
+    c.execute("DELETE FROM stock_checkpoints WHERE cutoff=?", (cutoff,))
+    c.execute("DELETE FROM stock_checkpoint_runs WHERE cutoff=?", (cutoff,))
+    items = led.items()
+    c.execute("INSERT INTO stock_checkpoint_runs(cutoff, items, created_at) VALUES(?,?,?)",
+              (cutoff, len(items), now_str()))
+    c.executemany("INSERT INTO stock_checkpoints(cutoff, product_id, qty, avg_cost) VALUES(?,?,?,?)",
+                  [(cutoff, pid, q, a) for pid, q, a in items])
+
+def _ledger_marks(c):
+    """(maior id de movimento, maior seq de tombstone): detecta escrita depois da leitura."""
+    return (c.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements").fetchone()[0],
+            c.execute("SELECT COALESCE(MAX(seq), 0) FROM stock_movement_tombstones").fetchone()[0])
+
+def _check_fresh(c, base, cutoff, marks):
+    """Levanta _StaleCheckpoint se o ledger mudou antes de `cutoff` desde a leitura."""
+    if base and c.execute("SELECT 1 FROM stock_checkpoint_runs WHERE cutoff=?", (base,)).fetchone() is None:
+        raise _StaleCheckpoint(base)
+    if c.execute("SELECT 1 FROM stock_movements WHERE id > ? AND ts < ? LIMIT 1",
+                 (marks[0], cutoff)).fetchone() is not None:
+        raise _StaleCheckpoint(cutoff)
+    # tombstone não guarda o ts: qualquer exclusão nova invalida (é rara)
+    if c.execute("SELECT 1 FROM stock_movement_tombstones WHERE seq > ? LIMIT 1",
+                 (marks[1],)).fetchone() is not None:
+        raise _StaleCheckpoint(cutoff)
+
+def build_checkpoints(until=None, chunk_size: int = CHUNK_SIZE, retries: int = 3, verbose: bool = False) -> list:
+    """
+    Grava os checkpoints mensais que faltam (saldo no dia 1 de cada mês até `until`).
+    Cada mês é reprocessado a partir do anterior numa transação de leitura, fora
+    do writer; o writer só confere que nada mudou antes do corte desde a leitura
+    e grava. Se mudou (movimento retroativo), recomeça. Retorna os cortes gravados.
+    """
+    until = until or date.today()
+    saved = []
+    for _ in range(retries + 1):
+        conn = get_conn()
+        first = conn.execute("SELECT MIN(ts) FROM stock_movements WHERE ts IS NOT NULL").fetchone()[0]
+        existing = {r[0] for r in conn.execute("SELECT cutoff FROM stock_checkpoint_runs")}
+        conn.close()
+        if not first:
+            return saved
+        targets = _month_starts(first[:10], until)
+        missing = [t for t in targets if t not in existing]
+        if not missing:
+            return saved
+        led = base = None
+        try:
+            for cutoff in targets[targets.index(missing[0]):]:
+                conn = get_conn(); c = conn.cursor()
+                try:
+                    c.execute("BEGIN")
+                    if led is None:
+                        base = _latest_checkpoint(c, cutoff)
+                        led = Ledger.from_checkpoint(c, base)
+                    marks = _ledger_marks(c)
+                    _check_fresh(c, base, cutoff, marks)
+                    n = _replay(c, led, base, cutoff, chunk_size)
+                finally:
+                    conn.rollback(); conn.close()
+
+                def _save(wconn, base=base, cutoff=cutoff, marks=marks):
+                    wc = wconn.cursor()
+                    _check_fresh(wc, base, cutoff, marks)
+                    _save_checkpoint(wc, cutoff, led)
+
+                run_write(_save)
+                base = cutoff
+                saved.append(cutoff)
+                if verbose:
+                    print(f"[checkpoint] {cutoff}: {n} movimentos")
+            return saved
+        except _StaleCheckpoint:
+            continue
+    raise RuntimeError("Checkpoints invalidados repetidamente por movimentos retroativos; tente de novo.")
+
+def list_checkpoints():
+    conn = get_conn()
+    rows = conn.execute("SELECT cutoff, items, created_at FROM stock_checkpoint_runs ORDER BY cutoff").fetchall()
+    conn.close()
+    return rows
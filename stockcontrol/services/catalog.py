@@ -0,0 +1,333 @@
+import csv
+import io
+import zipfile
+
+from ..db import invalidate_barcode_cache, invalidate_refdata
+from ..db_writer import run_write
+from ..utils import now_str, to_epoch
+from ..utils_barcode import (
+    _NUM_SEPARATORS, _is_digits, normalize_barcode, parse_barcode, validate_ean13_bulk,
+)
+from .inventory import _chunks, _lookup_map, _to_float
+
+try:  # opcional: planilhas .xlsx
+    import openpyxl
+except ImportError:  # pragma: no cover - sem openpyxl só CSV
+    openpyxl = None
+
+SYMBOLOGIES = ("EAN13", "EAN8", "UPC", "CODE128", "ITF14", "QR")
+
+# ==============================
+# Importação de códigos de barras em lote
+# ==============================
+def _prepare_barcode_rows(c, rows):
+    """Normaliza e valida a planilha inteira; EAN-13/UPC-A validados por coluna, demais por linha."""
+    skus = {str(r.get("sku") or "").strip() for r in rows} - {""}
+    ids = {int(r["product_id"]) for r in rows if _is_digits(str(r.get("product_id") or "").strip())}
+    by_sku = _lookup_map(c, "SELECT sku, id FROM products WHERE sku IN ({marks})", skus)
+    known_ids = _lookup_map(c, "SELECT id FROM products WHERE id IN ({marks})", ids)
+
+    prepared, errors = [], []
+    ean_pos, ean_codes = [], []
+    for line, r in enumerate(rows, start=1):
+        code = str(r.get("code") or r.get("barcode") or "").strip()
+        sym = str(r.get("symbology") or "").strip().upper()
+        if not sym and code:
+            sym = parse_barcode(code).symbology
+        sku = str(r.get("sku") or "").strip()
+        raw_pid = str(r.get("product_id") or "").strip()
+        pid = None
+        if sku:
+            hit = by_sku.get(sku)
+            pid = hit["id"] if hit else None
+        elif _is_digits(raw_pid) and int(raw_pid) in known_ids:
+            pid = int(raw_pid)
+        try:
+            pack = int(str(r.get("pack_qty") or 1).strip())
+        except ValueError:
+            pack = 0
+        primary = str(r.get("is_primary") or "").strip().lower() in ("1", "true", "sim", "yes", "x")
+
+        if not code:
+            errors.append({"line": line, "error": "Código vazio."})
+        elif pid is None:
+            errors.append({"line": line, "error": "Produto não encontrado (product_id/sku)."})
+        elif sym not in SYMBOLOGIES:
+            errors.append({"line": line, "error": f"Simbologia inválida: {sym}."})
+        elif pack < 1:
+            errors.append({"line": line, "error": "pack_qty deve ser inteiro >= 1."})
+        else:
+            item = {"line": line, "product_id": pid, "code": code, "symbology": sym, "pack_qty": pack,
+                    "label": str(r.get("label") or "").strip() or "UN", "is_primary": int(primary)}
+            # só ASCII 0-9 e separadores vão para o lote (o resto cai no erro de normalize_barcode)
+            digits = _NUM_SEPARATORS.sub("", code)
+            if sym in ("EAN13", "UPC") and _is_digits(digits) and len(digits) in (12, 13):
+                ean_pos.append(len(prepared))
+                ean_codes.append(code)
+            else:
+                # EAN-8, UPC-E, ITF-14, GS1-128...: mesma chave que o scan gera
+                try:
+                    item["code"] = normalize_barcode(code, sym)
+                except ValueError as e:
+                    errors.append({"line": line, "error": f"{sym} inválido: {e}"})
+                    continue
+            prepared.append(item)
+
+    # DV de toda a coluna EAN-13/UPC de uma vez (normaliza UPC-A -> EAN-13)
+    norm, ean_errors = validate_ean13_bulk(ean_codes)
+    bad = set()
+    for k, msg in ean_errors:
+        item = prepared[ean_pos[k]]
+        errors.append({"line": item["line"], "error": f"EAN-13 inválido: {msg}"})
+        bad.add(ean_pos[k])
+    for k, code in enumerate(norm):
+        if code is not None:
+            prepared[ean_pos[k]]["code"] = code
+    prepared = [item for k, item in enumerate(prepared) if k not in bad]
+    return prepared, errors
+
+def import_barcodes_bulk(rows, on_conflict: str = "error", skip_invalid: bool = False, dry_run: bool = False):
+    """
+    Importa muitos códigos numa única transação.
+    rows: dicts com product_id | sku, code, symbology, pack_qty, label, is_primary.
+    on_conflict para códigos já cadastrados: "error" (linha com erro), "skip" ou "update".
+    Com erros e skip_invalid=False nada é gravado. dry_run valida sem gravar.
+    Retorna {"received", "inserted", "updated", "skipped", "errors", "dry_run"}.
+    """
+    if on_conflict not in ("error", "skip", "update"):
+        raise ValueError("on_conflict deve ser error, skip ou update.")
+    rows = list(rows)
+
+    def _work(conn):
+        c = conn.cursor()
+        prepared, errors = _prepare_barcode_rows(c, rows)
+
+        existing = _lookup_map(c, "SELECT code, id, product_id FROM product_barcodes WHERE code IN ({marks})",
+                               {item["code"] for item in prepared})
+        seen, primaries = set(), set()
+        inserts, updates, skipped = [], [], 0
+        for item in prepared:
+            code = item["code"]
+            if code in seen:
+                errors.append({"line": item["line"], "error": f"Código {code} repetido no arquivo."})
+                continue
+            seen.add(code)
+            if item["is_primary"]:
+                if item["product_id"] in primaries:
+                    errors.append({"line": item["line"], "error": "Mais de um código primário para o produto."})
+                    continue
+                primaries.add(item["product_id"])
+            if code in existing:
+                if on_conflict == "skip":
+                    skipped += 1
+                    continue
+                if on_conflict == "error":
+                    errors.append({"line": item["line"], "error": f"Código {code} já cadastrado."})
+                    continue
+                updates.append(item)
+            else:
+                inserts.append(item)
+
+        errors.sort(key=lambda e: e["line"])
+        if errors and not skip_invalid:
+            return 0, 0, skipped, errors
+        if dry_run:
+            return len(inserts), len(updates), skipped, errors
+
+        # índice parcial ux_barcode_primary_per_product: rebaixa primários antigos antes
+        for chunk in _chunks(primaries):
+            c.execute(f"""UPDATE product_barcodes SET is_primary = 0
+                          WHERE is_primary = 1 AND product_id IN ({",".join("?" * len(chunk))})""", chunk)
+        c.executemany(
+            """UPDATE product_barcodes SET product_id=?, symbology=?, pack_qty=?, label=?, is_primary=?
+               WHERE code=?""",
+            [(i["product_id"], i["symbology"], i["pack_qty"], i["label"], i["is_primary"], i["code"]) for i in updates],
+        )
+        ts = now_str()
+        c.executemany(
+            """INSERT INTO product_barcodes(product_id, symbology, code, pack_qty, label, is_primary, created_at)
+               VALUES (?,?,?,?,?,?,?)""",
+            [(i["product_id"], i["symbology"], i["code"], i["pack_qty"], i["label"], i["is_primary"], ts)
+             for i in inserts],
+        )
+        return len(inserts), len(updates), skipped, errors
+
+    inserted, updated, skipped, errors = run_write(_work)
+    if (inserted or updated) and not dry_run:
+        invalidate_barcode_cache()
+    return {"received": len(rows), "inserted": inserted, "updated": updated, "skipped": skipped,
+            "errors": errors, "dry_run": bool(dry_run)}
+
+# ==============================
+# Leitura de planilhas (CSV / XLSX)
+# ==============================
+def read_table_rows(stream, filename: str = ""):
+    """
+    Arquivo enviado -> lista de dicts pelo cabeçalho. CSV (UTF-8) com separador
+    detectado ou XLSX (1ª aba). Arquivo ilegível vira ValueError.
+    """
+    if filename.lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise ValueError("Planilhas .xlsx requerem openpyxl (pip install openpyxl); envie CSV.")
+        try:
+            wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        except (zipfile.BadZipFile, KeyError, OSError) as e:
+            raise ValueError(f"Planilha .xlsx inválida: {e}") from e
+        try:
+            it = wb.worksheets[0].iter_rows(values_only=True)
+            header = [str(h or "").strip() for h in next(it, ())]
+            return [dict(zip(header, row)) for row in it if any(v not in (None, "") for v in row)]
+        finally:
+            wb.close()
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        return list(csv.DictReader(text, dialect=dialect))
+    except UnicodeDecodeError as e:
+        raise ValueError("CSV deve estar em UTF-8 (salve como 'CSV UTF-8').") from e
+
+# ==============================
+# Importação de produtos em lote
+# ==============================
+def _text(v):
+    """Célula -> texto; números inteiros vindos do XLSX (12345.0) viram '12345'."""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
+
+def _resolve_names(c, table: str, names):
+    """
+    Nome -> id com um mapa por importação; nomes novos criados num executemany.
+    Retorna (mapa, criados).
+    """
+    sql = f"SELECT name, id FROM {table} WHERE name IN ({{marks}})"
+    found = {name: row["id"] for name, row in _lookup_map(c, sql, names).items()}
+    missing = sorted(set(names) - set(found))
+    if missing:
+        c.executemany(f"INSERT INTO {table}(name) VALUES (?)", [(n,) for n in missing])
+        found.update({name: row["id"] for name, row in _lookup_map(c, sql, missing).items()})
+    return found, len(missing)
+
+def import_products_bulk(rows, skip_invalid: bool = False, dry_run: bool = False):
+    """
+    Cadastra/atualiza muitos produtos numa única transação (upsert por sku).
+    rows: dicts com sku, name, category | category_id, supplier | supplier_id,
+          unit, price, min_qty, qty (saldo inicial), unit_cost.
+    - categorias/fornecedores resolvidos por nome com um mapa por importação
+      (os que faltam são criados);
+    - produtos novos entram num executemany já com saldo/CMP do estoque inicial,
+      e o ledger recebe os IN de abertura de uma vez (balance_applied=1);
+    - produtos existentes têm os campos informados atualizados; qty é ignorado
+      para eles (saldo só muda por movimento).
+    Com erros e skip_invalid=False nada é gravado. dry_run valida sem gravar.
+    Retorna {"received", "created", "updated", "opening", "categories_created",
+             "suppliers_created", "errors", "dry_run"}.
+    """
+    rows = list(rows)
+
+    def _work(conn):
+        c = conn.cursor()
+        errors, items, seen = [], [], set()
+        for line, r in enumerate(rows, start=1):
+            sku, name = _text(r.get("sku")), _text(r.get("name"))
+            price, min_qty = _to_float(r.get("price")), _to_float(r.get("min_qty"))
+            qty, cost = _to_float(r.get("qty") or r.get("quantity")), _to_float(r.get("unit_cost"))
+            nums = (price, min_qty, qty, cost)
+            raw_nums = (r.get("price"), r.get("min_qty"), r.get("qty") or r.get("quantity"), r.get("unit_cost"))
+            if not sku:
+                errors.append({"line": line, "error": "SKU é obrigatório."})
+            elif sku in seen:
+                errors.append({"line": line, "error": f"SKU {sku} repetido no arquivo."})
+            elif any(n is None and _text(raw) for n, raw in zip(nums, raw_nums)):
+                errors.append({"line": line, "error": "Valor numérico inválido."})
+            elif any(n is not None and n < 0 for n in nums):
+                errors.append({"line": line, "error": "Valores não podem ser negativos."})
+            else:
+                seen.add(sku)
+                items.append({
+                    "line": line, "sku": sku, "name": name,
+                    "category": _text(r.get("category")), "category_id": _text(r.get("category_id")),
+                    "supplier": _text(r.get("supplier")), "supplier_id": _text(r.get("supplier_id")),
+                    "unit": _text(r.get("unit")), "price": price, "min_qty": min_qty,
+                    "qty": qty or 0.0, "unit_cost": cost,
+                })
+
+        existing = _lookup_map(c, "SELECT sku, id FROM products WHERE sku IN ({marks})", {i["sku"] for i in items})
+        known = {
+            key: _lookup_map(c, f"SELECT id FROM {table} WHERE id IN ({{marks}})",
+                             {int(i[key]) for i in items if _is_digits(i[key])})
+            for key, table in (("category_id", "categories"), ("supplier_id", "suppliers"))
+        }
+        ok = []
+        for i in items:
+            bad_ref = next((key for key in known if i[key] and not (_is_digits(i[key]) and int(i[key]) in known[key])),
+                           None)
+            if i["sku"] not in existing and not i["name"]:
+                errors.append({"line": i["line"], "error": "Nome é obrigatório para produto novo."})
+            elif bad_ref:
+                errors.append({"line": i["line"], "error": f"{bad_ref} não encontrado."})
+            else:
+                ok.append(i)
+        errors.sort(key=lambda e: e["line"])
+        if errors and not skip_invalid:
+            return None, errors
+
+        if dry_run:
+            c.execute("SAVEPOINT products_dry")
+        cat_ids, cats_new = _resolve_names(c, "categories", {i["category"] for i in ok} - {""})
+        sup_ids, sups_new = _resolve_names(c, "suppliers", {i["supplier"] for i in ok} - {""})
+
+        def ref(i, key, ids):
+            if i[key]:
+                return ids[i[key]]
+            raw = i[key + "_id"]
+            return int(raw) if _is_digits(raw) else None
+
+        ts = now_str()
+        new = [i for i in ok if i["sku"] not in existing]
+        upd = [i for i in ok if i["sku"] in existing]
+        c.executemany(
+            """INSERT INTO products(sku,name,category_id,supplier_id,unit,price,avg_cost,min_qty,current_qty,created_at)
+               VALUES(?,?,?,?,?,?,?,?,?,?)""",
+            [(i["sku"], i["name"], ref(i, "category", cat_ids), ref(i, "supplier", sup_ids),
+              i["unit"] or "un", i["price"] or 0.0, (i["unit_cost"] or 0.0) if i["qty"] > 0 else 0.0,
+              i["min_qty"] or 0.0, i["qty"], ts) for i in new],
+        )
+        # campos em branco mantêm o valor atual
+        c.executemany(
+            """UPDATE products SET name=COALESCE(?,name), category_id=COALESCE(?,category_id),
+                      supplier_id=COALESCE(?,supplier_id), unit=COALESCE(?,unit),
+                      price=COALESCE(?,price), min_qty=COALESCE(?,min_qty)
+               WHERE sku=?""",
+            [(i["name"] or None, ref(i, "category", cat_ids), ref(i, "supplier", sup_ids), i["unit"] or None,
+              i["price"], i["min_qty"], i["sku"]) for i in upd],
+        )
+
+        # estoque inicial: saldo/CMP já gravados no produto, ledger só registra o IN
+        opening = [i for i in new if i["qty"] > 0]
+        new_ids = _lookup_map(c, "SELECT sku, id FROM products WHERE sku IN ({marks})", {i["sku"] for i in opening})
+        epoch = to_epoch(ts)
+        c.executemany(
+            """INSERT INTO stock_movements(product_id,type,quantity,unit_cost,reason,note,ts,ts_epoch,balance_applied)
+               VALUES(?,'IN',?,?,'Estoque inicial','Importação',?,?,1)""",
+            [(new_ids[i["sku"]]["id"], i["qty"], i["unit_cost"], ts, epoch) for i in opening],
+        )
+        if dry_run:
+            c.execute("ROLLBACK TO products_dry")
+            c.execute("RELEASE products_dry")
+        return (len(new), len(upd), len(opening), cats_new, sups_new), errors
+
+    counts, errors = run_write(_work)
+    created, updated, opening, cats_new, sups_new = counts or (0, 0, 0, 0, 0)
+    if not dry_run and (cats_new or sups_new):
+        invalidate_refdata()
+    return {"received": len(rows), "created": created, "updated": updated, "opening": opening,
+            "categories_created": cats_new, "suppliers_created": sups_new,
+            "errors": errors, "dry_run": bool(dry_run)}
@@ -0,0 +1,119 @@
+import os
+import time
+
+try:  # opcional: exportação colunar (Parquet/Arrow)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - sem pyarrow só há CSV
+    pa = pq = None
+
+ROW_GROUP_SIZE = 65536
+
+# ts/created_at já vêm como epoch do SQLite (hora local gravada como UTC),
+# então o timestamp sem fuso do Parquet mostra a mesma hora do CSV
+MOVEMENTS_SQL = """SELECT id, product_id, type, quantity, unit_cost, reason, note, ts_epoch
+                   FROM stock_movements {where} ORDER BY {order}"""
+PRODUCTS_SQL = """SELECT id, sku, name, unit, price, avg_cost, min_qty, current_qty,
+                         CAST(strftime('%s', created_at) AS INTEGER) AS created_at,
+                         category_id, supplier_id
+                  FROM products ORDER BY id"""
+
+def parquet_available() -> bool:
+    return pa is not None
+
+def _require():
+    if pa is None:
+        raise RuntimeError("Exportação Parquet requer pyarrow (pip install pyarrow).")
+
+def movements_schema():
+    _require()
+    return pa.schema([
+        ("id", pa.int64()), ("product_id", pa.int64()), ("type", pa.string()),
+        ("quantity", pa.float64()), ("unit_cost", pa.float64()),
+        ("reason", pa.string()), ("note", pa.string()), ("ts", pa.timestamp("s")),
+    ])
+
+def products_schema():
+    _require()
+    return pa.schema([
+        ("id", pa.int64()), ("sku", pa.string()), ("name", pa.string()), ("unit", pa.string()),
+        ("price", pa.float64()), ("avg_cost", pa.float64()), ("min_qty", pa.float64()),
+        ("current_qty", pa.float64()), ("created_at", pa.timestamp("s")),
+        ("category_id", pa.int64()), ("supplier_id", pa.int64()),
+    ])
+
+def _batch(rows, schema):
+    """Linhas do cursor -> RecordBatch tipado (colunas montadas direto das tuplas)."""
+    cols = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(col, type=field.type) for col, field in zip(cols, schema)], schema=schema)
+
+def write_parquet(c, schema, sink, row_group_size: int = ROW_GROUP_SIZE, compression: str = "zstd") -> int:
+    """
+    Lê o cursor já executado em blocos de row_group_size e grava cada bloco como
+    um row group; só um bloco fica em memória. Retorna o número de linhas.
+    """
+    _require()
+    total = 0
+    with pq.ParquetWriter(sink, schema, compression=compression) as writer:
+        while True:
+            rows = c.fetchmany(row_group_size)
+            if not rows:
+                break
+            writer.write_batch(_batch(rows, schema))
+            total += len(rows)
+    return total
+
+def write_parquet_partitioned(c, schema, out_dir: str, key_index: int, by: str = "day",
+                              row_group_size: int = ROW_GROUP_SIZE, compression: str = "zstd") -> dict:
+    """
+    Grava um dataset particionado estilo Hive (out_dir/date=AAAA-MM-DD/part-N.parquet).
+    O cursor deve vir ordenado pela coluna de data (key_index, epoch): cada partição
+    fica aberta só enquanto suas linhas chegam. Retorna {partição: linhas}.
+    """
+    _require()
+    if by not in ("day", "month"):
+        raise ValueError("Partição deve ser day ou month.")
+    fmt = "%Y-%m-%d" if by == "day" else "%Y-%m"
+    labels = {}  # dia (epoch // 86400) -> rótulo da partição
+
+    def label(epoch):
+        if epoch is None:
+            return "null"
+        day = epoch // 86400
+        name = labels.get(day)
+        if name is None:
+            name = labels[day] = time.strftime(fmt, time.gmtime(day * 86400))
+        return name
+
+    counts, parts = {}, {}
+    writer, current = None, None
+    try:
+        while True:
+            rows = c.fetchmany(row_group_size)
+            if not rows:
+                break
+            # cursor ordenado: o bloco se divide em trechos contíguos por partição
+            start = 0
+            keys = [label(r[key_index]) for r in rows]
+            for i in range(1, len(rows) + 1):
+                if i < len(rows) and keys[i] == keys[start]:
+                    continue
+                key = keys[start]
+                if key != current:
+                    if writer is not None:
+                        writer.close()
+                    n = parts.get(key, 0)
+                    parts[key] = n + 1
+                    path = os.path.join(out_dir, f"date={key}")
+                    os.makedirs(path, exist_ok=True)
+                    writer = pq.ParquetWriter(os.path.join(path, f"part-{n:03d}.parquet"),
+                                              schema, compression=compression)
+                    current = key
+                writer.write_batch(_batch(rows[start:i], schema))
+                counts[key] = counts.get(key, 0) + (i - start)
+                start = i
+    finally:
+        if writer is not None:
+            writer.close()
+    return counts
@@ -1,5 +1,7 @@
 from ..db import get_conn
-from ..utils import now_str
+from ..db_writer import run_write
+from ..utils import now_str, parse_float, parse_ts, to_epoch
+from ..utils_barcode import _is_digits, lookup_keys
 
 def find_product(pid: int):
     conn = get_conn()
@@ -17,18 +19,295 @@ def find_product(pid: int):
     conn.close()
     return row
 
-def recalc_avg_cost_on_in(product_id: int, qty_in: float, unit_cost):
-    if unit_cost is None:
-        return
+def _parse_cursor(cursor):
+    """Cursor de histórico 'ts_epoch:id' (ou 'null:id', linhas sem ts_epoch) -> (ts_epoch, id) ou None."""
+    try:
+        ts_epoch, mid = str(cursor).split(":", 1)
+        return (None if ts_epoch == "null" else int(ts_epoch)), int(mid)
+    except (TypeError, ValueError):
+        return None
+
+_HISTORY_SQL = """SELECT id, ts, ts_epoch, type, quantity, unit_cost, reason, note
+                  FROM stock_movements {where}
+                  ORDER BY ts_epoch DESC, id DESC
+                  LIMIT ?"""
+
+def movement_history(pid: int, start_epoch=None, end_epoch=None, cursor=None, limit: int = 50):
+    """
+    Página do histórico de um produto, mais recente primeiro, por keyset sobre
+    (ts_epoch, id): custo constante por página, independente da idade do produto.
+    end_epoch é exclusivo. Retorna (linhas, próximo cursor ou None).
+    Linhas legadas sem ts_epoch (ts inválido) vêm por último, paginadas só por id.
+    """
+    where = "WHERE product_id=?"
+    params = [pid]
+    if start_epoch is not None:
+        where += " AND ts_epoch >= ?"
+        params.append(start_epoch)
+    if end_epoch is not None:
+        where += " AND ts_epoch < ?"
+        params.append(end_epoch)
+    after = _parse_cursor(cursor) if cursor else None
+    if after and after[0] is None:
+        where += " AND ts_epoch IS NULL AND id < ?"
+        params.append(after[1])
+    elif after:
+        where += " AND (ts_epoch < ? OR (ts_epoch = ? AND id < ?))"
+        params += [after[0], after[0], after[1]]
+
     conn = get_conn()
     c = conn.cursor()
-    c.execute("SELECT current_qty, avg_cost FROM products WHERE id=?", (product_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close(); return
-    current_qty = float(row["current_qty"] or 0)
-    avg_cost = float(row["avg_cost"] or 0)
-    new_qty = current_qty + qty_in
-    new_avg = unit_cost if new_qty <= 0 else ((current_qty * avg_cost) + (qty_in * unit_cost)) / new_qty
-    c.execute("UPDATE products SET avg_cost=? WHERE id=?", (new_avg, product_id))
-    conn.commit(); conn.close()
\ No newline at end of file
+    rows = c.execute(_HISTORY_SQL.format(where=where), (*params, limit + 1)).fetchall()
+    if (after and after[0] is not None and len(rows) <= limit
+            and start_epoch is None and end_epoch is None):
+        # o keyset por data não alcança os NULLs: emenda o começo deles
+        rows += c.execute(_HISTORY_SQL.format(where="WHERE product_id=? AND ts_epoch IS NULL"),
+                          (pid, limit + 1 - len(rows))).fetchall()
+    conn.close()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        key = "null" if last["ts_epoch"] is None else last["ts_epoch"]
+        next_cursor = f"{key}:{last['id']}"
+    return rows, next_cursor
+
+def _new_avg_cost(qty: float, avg: float, qty_in: float, unit_cost):
+    """CMP (WAC) após uma entrada; sem custo informado, mantém o atual."""
+    if unit_cost is None or unit_cost <= 0:
+        return avg
+    new_qty = qty + qty_in
+    if new_qty <= 0:
+        return unit_cost
+    return ((qty * avg) + (qty_in * unit_cost)) / new_qty
+
+class InsufficientStock(ValueError):
+    """Saída maior que o saldo disponível (nada foi gravado)."""
+    def __init__(self, product_id: int, requested: float, available: float):
+        super().__init__(f"Estoque insuficiente (disponível {available:.2f}, solicitado {requested:.2f}).")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+def _apply_movement(c, product_id, mtype, quantity, unit_cost, reason, note, ts, allow_negative):
+    if mtype == "IN":
+        row = c.execute("SELECT current_qty, avg_cost FROM products WHERE id=?",
+                        (product_id,)).fetchone()
+        if not row:
+            return None
+        qty = float(row["current_qty"] or 0)
+        avg = float(row["avg_cost"] or 0)
+        new_qty = qty + quantity
+        new_avg = _new_avg_cost(qty, avg, quantity, unit_cost)
+        c.execute("UPDATE products SET current_qty=?, avg_cost=? WHERE id=?",
+                  (new_qty, new_avg, product_id))
+    else:
+        # baixa condicional: o próprio UPDATE garante que o saldo não fica negativo
+        guard = "" if allow_negative else " AND COALESCE(current_qty,0) >= ?"
+        params = (quantity, product_id) if allow_negative else (quantity, product_id, quantity)
+        c.execute(f"""UPDATE products SET current_qty = COALESCE(current_qty,0) - ?
+                      WHERE id=?{guard}""", params)
+        updated = c.rowcount
+        row = c.execute("SELECT current_qty, avg_cost FROM products WHERE id=?",
+                        (product_id,)).fetchone()
+        if not row:
+            return None
+        if updated == 0:
+            raise InsufficientStock(product_id, quantity, float(row["current_qty"] or 0))
+        new_qty = float(row["current_qty"] or 0)
+        new_avg = float(row["avg_cost"] or 0)
+
+    ts = ts or now_str()
+    c.execute(
+        """INSERT INTO stock_movements(product_id,type,quantity,unit_cost,reason,note,ts,ts_epoch,balance_applied)
+           VALUES(?,?,?,?,?,?,?,?,1)""",
+        (product_id, mtype, quantity, unit_cost, reason, note, ts, to_epoch(ts)),
+    )
+    return {"id": c.lastrowid, "product_id": product_id, "current_qty": new_qty, "avg_cost": new_avg}
+
+def post_movement(product_id: int, mtype: str, quantity: float, unit_cost=None,
+                  reason=None, note=None, ts=None, conn=None, allow_negative=False):
+    """
+    Lança um movimento IN/OUT numa única transação (BEGIN IMMEDIATE):
+      - IN: lê saldo/CMP, atualiza current_qty e avg_cost num único UPDATE;
+      - OUT: baixa condicional (current_qty >= qty), sem checagem em Python;
+      - insere a linha no ledger (balance_applied=1, triggers de INSERT ignoram).
+    Banco ocupado (SQLITE_BUSY) é repetido com backoff (DB_BUSY_RETRIES/DB_BUSY_BACKOFF_MS);
+    com WRITER_ENABLED o lançamento entra no group commit do writer (ver db_writer).
+    Se `conn` for informado, roda dentro da transação do chamador (sem commit/retry).
+    Retorna dict com id do movimento e novo saldo/CMP, ou None se o produto não existir.
+    Lança InsufficientStock se a saída deixaria o saldo negativo (salvo allow_negative).
+    """
+    mtype = (mtype or "").strip().upper()
+    if mtype not in ("IN", "OUT"):
+        raise ValueError("Tipo de movimento deve ser IN ou OUT.")
+    quantity = float(quantity)
+    if ts is not None:
+        # ts/ts_epoch alimentam histórico, rollups e posição em data: só no formato do ledger
+        norm = parse_ts(ts)
+        if norm is None:
+            raise ValueError("Data/hora do movimento inválida.")
+        ts = norm
+    args = (product_id, mtype, quantity, unit_cost, reason, note, ts, allow_negative)
+
+    if conn is not None:
+        return _apply_movement(conn.cursor(), *args)
+    # transação própria ou lote do group commit (WRITER_ENABLED)
+    return run_write(lambda conn: _apply_movement(conn.cursor(), *args))
+
+# ==============================
+# Lançamento em lote (importações ERP)
+# ==============================
+BULK_CHUNK = 500  # limite seguro de parâmetros por IN (...) no SQLite
+
+def _chunks(seq, n=BULK_CHUNK):
+    seq = list(seq)
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+def _to_float(v, default=None):
+    """Números passam direto; textos aceitam '1.5' e o formato BR '1.234,50'."""
+    if v is None or (isinstance(v, str) and not v.strip()):
+        return default
+    if isinstance(v, (int, float)):
+        return float(v)
+    s = str(v).strip()
+    if "," in s:
+        return parse_float(s, default)
+    try:
+        return float(s)
+    except ValueError:
+        return default
+
+def _lookup_map(c, sql, keys):
+    out = {}
+    for chunk in _chunks(keys):
+        marks = ",".join("?" * len(chunk))
+        for row in c.execute(sql.format(marks=marks), chunk):
+            out[row[0]] = row
+    return out
+
+def _validate_bulk_rows(c, rows):
+    """Resolve produto (product_id, sku ou barcode) e valida cada linha."""
+    # mesmas chaves candidatas do scan (canônica, UPC-E ambíguo, texto original)
+    keys = [lookup_keys(str(r.get("barcode") or "")) for r in rows]
+    barcodes = {k for ks in keys for k in ks}
+    skus = {str(r.get("sku") or "").strip() for r in rows} - {""}
+    ids = {int(r["product_id"]) for r in rows if _is_digits(str(r.get("product_id") or "").strip())}
+
+    by_code = _lookup_map(c, "SELECT code, product_id, pack_qty FROM product_barcodes WHERE code IN ({marks})", barcodes)
+    by_sku = _lookup_map(c, "SELECT sku, id FROM products WHERE sku IN ({marks})", skus)
+    known_ids = _lookup_map(c, "SELECT id FROM products WHERE id IN ({marks})", ids)
+
+    valid, errors = [], []
+    for line, r in enumerate(rows, start=1):
+        mtype = str(r.get("type") or "").strip().upper()
+        qty = _to_float(r.get("quantity"))
+        unit_cost = _to_float(r.get("unit_cost"))
+        pack = 1
+        pid = None
+        code = keys[line - 1]
+        sku = str(r.get("sku") or "").strip()
+        raw_pid = str(r.get("product_id") or "").strip()
+        raw_ts = r.get("ts")
+        ts = parse_ts(raw_ts)
+        if code:
+            hit = next((by_code[k] for k in code if k in by_code), None)
+            if hit:
+                pid, pack = hit["product_id"], max(1, int(hit["pack_qty"] or 1))
+        elif sku:
+            hit = by_sku.get(sku)
+            pid = hit["id"] if hit else None
+        elif _is_digits(raw_pid) and int(raw_pid) in known_ids:
+            pid = int(raw_pid)
+
+        if pid is None:
+            errors.append({"line": line, "error": "Produto não encontrado (product_id/sku/barcode)."})
+        elif mtype not in ("IN", "OUT"):
+            errors.append({"line": line, "error": "Tipo deve ser IN ou OUT."})
+        elif qty is None or qty <= 0:
+            errors.append({"line": line, "error": "Quantidade deve ser maior que zero."})
+        elif unit_cost is not None and unit_cost < 0:
+            errors.append({"line": line, "error": "Custo unitário inválido."})
+        elif ts is None and str(raw_ts or "").strip():
+            errors.append({"line": line, "error": "Data/hora inválida (use AAAA-MM-DD HH:MM:SS ou DD/MM/AAAA HH:MM)."})
+        else:
+            valid.append({
+                "line": line, "product_id": pid, "type": mtype, "quantity": qty * pack,
+                "unit_cost": unit_cost if mtype == "IN" else None,
+                "reason": (str(r.get("reason") or "").strip() or "Importação"),
+                "note": str(r.get("note") or "").strip(),
+                "ts": ts,
+            })
+    return valid, errors
+
+def _apply_bulk(c, valid, allow_negative, skip_invalid):
+    """
+    Replay em memória por produto a partir do saldo atual (ordem do arquivo),
+    depois: executemany no ledger + um UPDATE por produto com saldo/CMP finais.
+    """
+    balances = {
+        row["id"]: [float(row["current_qty"] or 0), float(row["avg_cost"] or 0)]
+        for row in _lookup_map(c, "SELECT id, current_qty, avg_cost FROM products WHERE id IN ({marks})",
+                               {v["product_id"] for v in valid}).values()
+    }
+    to_insert, errors = [], []
+    ts_default = now_str()
+    for v in valid:
+        bal = balances[v["product_id"]]
+        if v["type"] == "IN":
+            bal[1] = _new_avg_cost(bal[0], bal[1], v["quantity"], v["unit_cost"])
+            bal[0] += v["quantity"]
+        else:
+            if not allow_negative and v["quantity"] > bal[0]:
+                errors.append({"line": v["line"], "error": f"Estoque insuficiente (disponível {bal[0]:.2f})."})
+                continue
+            bal[0] -= v["quantity"]
+        ts = v["ts"] or ts_default
+        to_insert.append((v["product_id"], v["type"], v["quantity"], v["unit_cost"],
+                          v["reason"], v["note"], ts, to_epoch(ts)))
+
+    if errors and not skip_invalid:
+        return 0, set(), errors
+
+    c.executemany(
+        """INSERT INTO stock_movements(product_id,type,quantity,unit_cost,reason,note,ts,ts_epoch,balance_applied)
+           VALUES(?,?,?,?,?,?,?,?,1)""",
+        to_insert,
+    )
+    touched = {row[0] for row in to_insert}
+    c.executemany("UPDATE products SET current_qty=?, avg_cost=? WHERE id=?",
+                  [(balances[pid][0], balances[pid][1], pid) for pid in touched])
+    return len(to_insert), touched, errors
+
+def post_movements_bulk(rows, allow_negative=False, skip_invalid=False, dry_run=False):
+    """
+    Lança muitos movimentos numa única transação.
+    rows: dicts com product_id | sku | barcode, type, quantity, unit_cost, reason, note, ts.
+    - ts vazio usa o horário da importação; ISO ou DD/MM/AAAA é gravado como
+      'AAAA-MM-DD HH:MM:SS' (outros formatos viram erro da linha);
+    - valida tudo antes de gravar (erros por linha, numeradas a partir de 1);
+    - insere o ledger com executemany (balance_applied=1: triggers por linha não disparam);
+    - aplica saldo/CMP agregados com um UPDATE por produto.
+    Com erros e skip_invalid=False nada é gravado. dry_run valida sem gravar.
+    Retorna {"received", "posted", "products", "errors"}.
+    """
+    rows = list(rows)
+
+    def _work(conn):
+        c = conn.cursor()
+        valid, errors = _validate_bulk_rows(c, rows)
+        if errors and not skip_invalid:
+            return 0, set(), errors
+        if dry_run:
+            c.execute("SAVEPOINT bulk_dry")
+        posted, products, replay_errors = _apply_bulk(c, valid, allow_negative, skip_invalid)
+        if dry_run:
+            c.execute("ROLLBACK TO bulk_dry")
+            c.execute("RELEASE bulk_dry")
+        errors = sorted(errors + replay_errors, key=lambda e: e["line"])
+        return posted, products, errors
+
+    posted, products, errors = run_write(_work)
+    return {"received": len(rows), "posted": posted, "products": len(products),
+            "errors": errors, "dry_run": bool(dry_run)}
@@ -1,7 +1,48 @@
-from datetime import datetime
+import base64
+import calendar
+import json
+from datetime import date, datetime
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+# formatos BR aceitos além do ISO em importações
+_BR_TS_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y")
 
 def now_str():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.now().strftime(TS_FORMAT)
+
+def parse_ts(v):
+    """
+    Data/hora de importação -> 'YYYY-MM-DD HH:MM:SS' (formato de stock_movements.ts).
+    Aceita datetime/date (células XLSX), ISO ('2024-03-15', '2024-03-15T10:00')
+    e BR ('15/03/2024[ 10:00[:00]]'). Retorna None se não reconhecer (ou se vier com fuso).
+    """
+    if isinstance(v, datetime):
+        dt = v
+    elif isinstance(v, date):
+        dt = datetime(v.year, v.month, v.day)
+    else:
+        s = str(v or "").strip()
+        if not s:
+            return None
+        try:
+            dt = datetime.fromisoformat(s)
+        except ValueError:
+            dt = None
+            for fmt in _BR_TS_FORMATS:
+                try:
+                    dt = datetime.strptime(s, fmt)
+                    break
+                except ValueError:
+                    pass
+    if dt is None or dt.tzinfo is not None:
+        return None
+    return dt.strftime(TS_FORMAT)
+
+def to_epoch(s):
+    """'YYYY-MM-DD[ HH:MM:SS]' -> segundos, na mesma escala de strftime('%s', ts) do SQLite."""
+    if not s: return None
+    try: return calendar.timegm(datetime.fromisoformat(str(s).strip()).timetuple())
+    except ValueError: return None
 
 def parse_float(s, default=0.0):
     if s is None: return default
@@ -13,3 +54,16 @@ def parse_int(s, default=0):
     if s is None: return default
     try: return int(s)
     except: return default
+
+def encode_cursor(value, rid) -> str:
+    """(chave de ordenação, id) -> token opaco para keyset na query string."""
+    raw = json.dumps([value, rid], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(token: str):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        value, rid = json.loads(raw)
+        return value, int(rid)
+    except (ValueError, TypeError):
+        return None
@@ -1,8 +1,23 @@
 # stockcontrol/utils_barcode.py
+import calendar
 import re
+from collections import namedtuple
+from datetime import date
+
+try:  # opcional: validação em lote vetorizada
+    import numpy as np
+except ImportError:  # pragma: no cover - sem numpy cai no laço puro
+    np = None
+
+# só 0-9: \d e str.isdigit() aceitam dígitos Unicode ('١٢٣'), que não são código de barras
+_NON_DIGITS = re.compile(r"[^0-9]+")
+_DIGITS = re.compile(r"[0-9]+")
 
 def _only_digits(s: str) -> str:
-    return re.sub(r"\D+", "", s or "")
+    return _NON_DIGITS.sub("", s or "")
+
+def _is_digits(s: str) -> bool:
+    return _DIGITS.fullmatch(s or "") is not None
 
 def normalize_ean13(code: str) -> str:
     """
@@ -21,7 +36,7 @@ def calc_ean13_check(d12: str) -> str:
     """
     Calcula o dígito verificador do EAN-13 a partir dos 12 primeiros dígitos.
     """
-    if len(d12) != 12 or not d12.isdigit():
+    if len(d12) != 12 or not _is_digits(d12):
         raise ValueError("Para calcular o DV, informe exatamente 12 dígitos.")
     soma = 0
     # posições 1..12 (1-based): ímpares *1, pares *3
@@ -42,3 +57,300 @@ def validate_and_normalize_ean13(code: str) -> str:
     if got != expected:
         raise ValueError(f"Dígito verificador inválido (esperado {expected}, recebido {got}).")
     return norm
+
+# ==============================
+# Motor de simbologias (detecção + DV + GS1)
+# ==============================
+ParsedBarcode = namedtuple("ParsedBarcode", "symbology code ais valid")
+
+# Identificadores AIM (]Cm, ]Em...) que alguns leitores prefixam ao código
+_AIM_PREFIX = re.compile(r"^\][A-Za-z][0-9A-Za-z]")
+_AIM_GS1 = {"]C1", "]e0", "]d2", "]Q3", "]J1"}
+_AIM_UPCE = {"]E0"}
+_NUM_SEPARATORS = re.compile(r"[\s.\-/]+")
+_GS = "\x1d"
+
+def calc_gs1_check(body: str) -> int:
+    """DV módulo 10 do GS1 (EAN-8/13, UPC-A, GTIN-14, SSCC): pesos 3,1 a partir da direita."""
+    soma = 0
+    for i, ch in enumerate(reversed(body)):
+        soma += (ord(ch) - 48) * (3 if i % 2 == 0 else 1)
+    return (10 - soma % 10) % 10
+
+def _check_ok(d: str) -> bool:
+    return calc_gs1_check(d[:-1]) == ord(d[-1]) - 48
+
+def expand_upce(code: str) -> str:
+    """UPC-E (8 dígitos: sistema + 6 + DV) -> UPC-A (12 dígitos). Lança ValueError se inválido."""
+    d = _only_digits(code)
+    if len(d) != 8 or d[0] not in "01":
+        raise ValueError("UPC-E deve ter 8 dígitos começando com 0 ou 1.")
+    ns, m, last = d[0], d[1:7], d[6]
+    if last in "012":
+        body = ns + m[0:2] + last + "0000" + m[2:5]
+    elif last == "3":
+        body = ns + m[0:3] + "00000" + m[3:5]
+    elif last == "4":
+        body = ns + m[0:4] + "00000" + m[4]
+    else:
+        body = ns + m[0:5] + "0000" + last
+    if calc_gs1_check(body) != ord(d[7]) - 48:
+        raise ValueError("Dígito verificador do UPC-E inválido.")
+    return body + d[7]
+
+def canonical_gtin(d: str) -> str:
+    """GTIN-14 com zeros à esquerda -> forma curta usada como chave (EAN-13 ou EAN-8)."""
+    if len(d) == 14:
+        if d.startswith("000000"):
+            return d[6:]
+        if d[0] == "0":
+            return d[1:]
+    return d
+
+# GS1: tamanho do AI pelos 2 primeiros dígitos e tamanho fixo dos dados (tabela
+# "predefined length" da especificação); os demais são variáveis até o <GS>.
+_AI_LEN = {}
+for _p in range(100):
+    _k = f"{_p:02d}"
+    _AI_LEN[_k] = (3 if 23 <= _p <= 29 or 40 <= _p <= 42 or _p == 71
+                   else 4 if 31 <= _p <= 36 or _p in (39, 43, 70, 72, 80, 81, 82)
+                   else 2)
+_AI_FIXED = {"00": 18, "01": 14, "02": 14, "03": 14, "04": 16, "20": 2, "41": 13,
+             **{f"{_p}": 6 for _p in range(11, 20)},
+             **{f"{_p}": 6 for _p in range(31, 37)}}
+_AI_MAX = {"10": 20, "21": 20, "22": 20, "30": 8, "37": 8}
+# variáveis só numéricas: contagens (30, 37) e medidas/valores (39nn)
+_AI_NUMERIC = ("30", "37", "39")
+# AIs mais usados no recebimento -> nomes amigáveis
+GS1_NAMES = {"00": "sscc", "01": "gtin", "02": "content", "10": "lot", "11": "prod_date",
+             "13": "pack_date", "15": "best_before", "17": "expiry", "21": "serial",
+             "30": "count", "37": "count"}
+
+def parse_gs1(data: str) -> dict:
+    """
+    Separa a cadeia GS1 (GS1-128/DataMatrix) em {AI: valor} numa única passada.
+    Aceita o formato cru (com <GS> como FNC1) e o legível "(01)...(17)...".
+    Lança ValueError se a cadeia não for GS1 válida.
+    """
+    s = data
+    if s.startswith("("):
+        s = re.sub(r"\((\d{2,4})\)\s*", lambda m: _GS + m.group(1), s)
+    ais = {}
+    i, n = 0, len(s)
+    while i < n:
+        if s[i] == _GS:
+            i += 1
+            continue
+        head = s[i:i + 2]
+        if len(head) < 2 or not _is_digits(head):
+            raise ValueError(f"AI inválido na posição {i}.")
+        ai = s[i:i + _AI_LEN[head]]
+        if len(ai) != _AI_LEN[head] or not _is_digits(ai):
+            raise ValueError(f"AI incompleto na posição {i}.")
+        i += len(ai)
+        fixed = _AI_FIXED.get(head)
+        if fixed is not None:
+            value = s[i:i + fixed]
+            if len(value) != fixed or not _is_digits(value):
+                raise ValueError(f"AI ({ai}) deve ter {fixed} dígitos.")
+            i += fixed
+        else:
+            end = s.find(_GS, i)
+            end = n if end < 0 else end
+            value = s[i:end]
+            limit = _AI_MAX.get(ai, 90)
+            if not value or len(value) > limit:
+                raise ValueError(f"AI ({ai}) com tamanho inválido.")
+            if head in _AI_NUMERIC and not _is_digits(value):
+                raise ValueError(f"AI ({ai}) deve ter só dígitos.")
+            i = end
+        ais[ai] = value
+    if not ais:
+        raise ValueError("Cadeia GS1 vazia.")
+    for ai in ("00", "01", "02"):
+        if ai in ais and not _check_ok(ais[ai]):
+            raise ValueError(f"Dígito verificador inválido no AI ({ai}).")
+    return ais
+
+def gs1_date(yymmdd: str):
+    """Data GS1 (AAMMDD) -> 'AAAA-MM-DD'; dia 00 = último dia do mês. None se inválida."""
+    if not yymmdd or len(yymmdd) != 6 or not _is_digits(yymmdd):
+        return None
+    yy, mm, dd = int(yymmdd[:2]), int(yymmdd[2:4]), int(yymmdd[4:])
+    # janela da especificação: -49/+50 anos em relação ao ano corrente
+    now = date.today().year
+    year = now - now % 100 + yy
+    if year - now > 50:
+        year -= 100
+    elif now - year >= 50:
+        year += 100
+    try:
+        if dd == 0:
+            dd = calendar.monthrange(year, mm)[1]
+        return date(year, mm, dd).isoformat()
+    except ValueError:
+        return None
+
+def gs1_summary(ais: dict) -> dict:
+    """{AI: valor} -> {gtin, lot, expiry, count...} com datas em ISO."""
+    out = {}
+    for ai, value in (ais or {}).items():
+        name = GS1_NAMES.get(ai)
+        if name is None:
+            continue
+        if name == "gtin":
+            value = canonical_gtin(value)
+        elif name in ("prod_date", "pack_date", "best_before", "expiry"):
+            value = gs1_date(value) or value
+        elif name == "count":
+            value = int(value)
+        out[name] = value
+    return out
+
+def _looks_gs1(s: str) -> bool:
+    if _GS in s or (s.startswith("(") and _is_digits(s[1:3])):
+        return True
+    # cadeia crua sem identificador: começa com o AI (00), (01) ou (02)
+    return len(s) >= 16 and s[:2] in ("00", "01", "02") and _is_digits(s[2:16])
+
+def _parse_numeric(d: str, hint: str = None):
+    """Dígitos puros -> (simbologia, código canônico) ou None se nenhum DV bate."""
+    n = len(d)
+    if n == 8:
+        if hint != "UPC" and _check_ok(d):
+            return "EAN8", d
+        if hint == "EAN8":
+            return None
+        try:
+            return "UPC", "0" + expand_upce(d)
+        except ValueError:
+            return None
+    if n == 12:
+        return ("UPC", "0" + d) if _check_ok(d) else None
+    if n == 13:
+        return ("EAN13", d) if _check_ok(d) else None
+    if n == 14:
+        return ("ITF14", canonical_gtin(d)) if _check_ok(d) else None
+    return None
+
+def parse_barcode(raw: str, symbology: str = None) -> ParsedBarcode:
+    """
+    Detecta a simbologia, valida o DV e devolve ParsedBarcode(symbology, code, ais, valid).
+    code é a chave de lookup; ais traz os AIs GS1 quando houver. Nunca lança:
+    código que não valida volta compactado (dígitos) ou como veio, com valid=False.
+    """
+    s = (raw or "").strip()
+    if not s:
+        return ParsedBarcode(None, "", {}, False)
+    hint = (symbology or "").strip().upper() or None
+    aim = _AIM_PREFIX.match(s)
+    if aim:
+        prefix, s = aim.group(0), s[3:]
+        if prefix in _AIM_GS1:
+            hint = hint or "GS1"
+        elif prefix in _AIM_UPCE:
+            hint = hint or "UPC"
+
+    if hint == "GS1" or (hint in (None, "CODE128", "QR") and _looks_gs1(s)):
+        try:
+            ais = parse_gs1(s)
+        except ValueError:
+            ais = None
+        if ais:
+            gtin = ais.get("01") or ais.get("02")
+            sym = "CODE128" if hint in (None, "GS1") else hint
+            return ParsedBarcode(sym, canonical_gtin(gtin) if gtin else s, ais, True)
+
+    compact = _NUM_SEPARATORS.sub("", s)
+    if _is_digits(compact):
+        hit = _parse_numeric(compact, hint)
+        if hit:
+            return ParsedBarcode(hit[0], hit[1], {}, True)
+        return ParsedBarcode(hint or "CODE128", compact, {}, len(compact) not in (8, 12, 13, 14))
+    return ParsedBarcode(hint or "CODE128", s, {}, True)
+
+def lookup_keys(raw: str, parsed: ParsedBarcode = None) -> list:
+    """
+    Chaves candidatas para achar um código lido, em ordem de preferência:
+      - a chave canônica de parse_barcode;
+      - 8 dígitos válidos como EAN-8 e como UPC-E: também o GTIN do UPC-E
+        expandido (é a chave gravada para UPC-E cadastrado como UPC);
+      - o texto original sem espaços nas pontas (códigos gravados antes da normalização).
+    """
+    parsed = parsed or parse_barcode(raw)
+    keys = [parsed.code]
+    if parsed.symbology == "EAN8":
+        try:
+            keys.append("0" + expand_upce(parsed.code))
+        except ValueError:
+            pass
+    keys.append((raw or "").strip())
+    return list(dict.fromkeys(k for k in keys if k))
+
+_SYMBOLOGY_LENGTHS = {"EAN13": (12, 13), "EAN8": (8,), "UPC": (8, 12), "ITF14": (14,)}
+
+def normalize_barcode(code: str, symbology: str) -> str:
+    """
+    Valida o código contra a simbologia declarada e devolve a chave a gravar
+    (a mesma que parse_barcode gera na leitura). Lança ValueError.
+    """
+    sym = (symbology or "CODE128").strip().upper()
+    lengths = _SYMBOLOGY_LENGTHS.get(sym)
+    if lengths is None:
+        return parse_barcode(code, sym).code
+    d = _NUM_SEPARATORS.sub("", (code or "").strip())
+    if not _is_digits(d) or len(d) not in lengths:
+        raise ValueError(f"{sym} deve ter {' ou '.join(map(str, lengths))} dígitos.")
+    if sym == "EAN13":
+        return validate_and_normalize_ean13(d)
+    hit = _parse_numeric(d, sym)
+    if hit is None:
+        raise ValueError(f"Dígito verificador inválido para {sym}.")
+    return hit[1]
+
+# ==============================
+# Validação em lote (colunas inteiras)
+# ==============================
+_EAN13_WEIGHTS = (1, 3) * 6
+
+def _ean13_checks_py(bodies):
+    out = []
+    for d12 in bodies:
+        soma = sum((ord(ch) - 48) * w for ch, w in zip(d12, _EAN13_WEIGHTS))
+        out.append((10 - soma % 10) % 10)
+    return out
+
+def _ean13_checks_np(bodies):
+    digits = np.frombuffer("".join(bodies).encode("ascii"), dtype=np.uint8).reshape(-1, 12) - 48
+    soma = digits.astype(np.int64) @ np.array(_EAN13_WEIGHTS, dtype=np.int64)
+    return ((10 - soma % 10) % 10).tolist()
+
+def validate_ean13_bulk(codes):
+    """
+    Versão em lote de validate_and_normalize_ean13 para uma coluna inteira.
+    Retorna (normalizados, erros): normalizados[i] é o EAN-13 ou None;
+    erros é lista de (índice, mensagem). Usa numpy se disponível.
+    """
+    norm = [None] * len(codes)
+    errors = []
+    idx, bodies, checks = [], [], []
+    for i, code in enumerate(codes):
+        d = _only_digits(code)
+        if len(d) == 12:
+            d = "0" + d  # UPC-A -> EAN-13
+        if len(d) != 13:
+            errors.append((i, "EAN-13 deve ter 13 dígitos (aceita UPC-A de 12; será normalizado com zero à esquerda)."))
+            continue
+        idx.append(i)
+        bodies.append(d[:12])
+        checks.append(ord(d[12]) - 48)
+
+    if bodies:
+        expected = _ean13_checks_np(bodies) if np is not None else _ean13_checks_py(bodies)
+        for i, body, got, exp in zip(idx, bodies, checks, expected):
+            if got != exp:
+                errors.append((i, f"Dígito verificador inválido (esperado {exp}, recebido {got})."))
+            else:
+                norm[i] = body + str(got)
+    errors.sort()
+    return norm, errors
@@ -0,0 +1,49 @@
+# tools/audit_ledger.py
+# Confere products.current_qty/avg_cost contra o replay do ledger (stock_movements)
+# em vários processos; com --fix grava os valores esperados em lotes.
+#
+# Uso:
+#   python tools/audit_ledger.py                       # auditoria completa, só relatório
+#   python tools/audit_ledger.py --fix                 # corrige divergências
+#   python tools/audit_ledger.py --incremental --fix   # só produtos com movimentos desde a última auditoria
+#   opções: --workers=N (padrão: nº de CPUs) --batch=500 --tol=1e-6 --limit=20 (linhas no relatório)
+import os, sys, time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import create_app
+from stockcontrol.services.audit import audit_ledger
+
+def main():
+    flags = dict((a[2:].split("=", 1) + [""])[:2] for a in sys.argv[1:] if a.startswith("--"))
+    workers = int(flags.get("workers") or os.cpu_count() or 1)
+    limit = int(flags.get("limit") or 20)
+
+    def progress(done, total, res):
+        print(f"\r[audit] {done}/{total} partes, {res['checked']} produtos, "
+              f"{res['movements']} movimentos, {len(res['mismatches'])} divergências", end="", flush=True)
+
+    app = create_app()
+    with app.app_context():
+        t0 = time.perf_counter()
+        res = audit_ledger(app.config["DB_PATH"], workers=workers, incremental="incremental" in flags,
+                           fix="fix" in flags, tol=float(flags.get("tol") or 1e-6),
+                           chunk_size=app.config.get("ASOF_CHUNK_SIZE", 50000),
+                           batch=int(flags.get("batch") or 500), progress=progress)
+        dt = time.perf_counter() - t0
+    print()
+
+    for pid, qty, avg, exp_qty, exp_avg in res["mismatches"][:limit]:
+        print(f"  produto {pid}: qtd {qty} -> {exp_qty:.4f}, CMP {avg} -> {exp_avg:.4f}")
+    if len(res["mismatches"]) > limit:
+        print(f"  ... (+{len(res['mismatches']) - limit})")
+    print(f"[OK] auditoria {res['mode']} ({workers} workers): {res['checked']} produtos, "
+          f"{res['movements']} movimentos, {len(res['mismatches'])} divergências, "
+          f"{res['fixed']} corrigidas ({dt:.2f}s)")
+    if res["mismatches"] and "fix" not in flags:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# tools/backfill_movement_daily.py
+# Recalcula o rollup diário movement_daily a partir de stock_movements, em lotes
+# de produtos. (Os triggers mantêm a tabela; use após importações feitas com
+# triggers desligados, para conferir uma base antiga ou, em bases grandes,
+# no lugar do backfill da partida com DB_BACKFILL_ON_START=0.)
+#
+# Uso:
+#   python tools/backfill_movement_daily.py [PRODUTOS_POR_LOTE]
+import os, sys, time
+
+print(">>> backfill_movement_daily: start", flush=True)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# o backfill é este script: a partida do app (inclusive o import de app.py)
+# só cria/migra o schema, sem o GROUP BY do ledger inteiro
+os.environ["DB_BACKFILL_ON_START"] = "0"
+
+from app import create_app
+from stockcontrol.db import get_conn, run_backfill
+
+chunk = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+app = create_app()
+with app.app_context():
+    conn = get_conn()
+    t0 = time.perf_counter()
+    n = run_backfill(conn, "backfill_movement_daily", chunk=chunk, verbose=True)
+    print(f"[OK] {n} linhas de rollup gravadas em {time.perf_counter() - t0:.1f}s", flush=True)
+    conn.close()
+print(">>> backfill_movement_daily: done", flush=True)
@@ -0,0 +1,32 @@
+# tools/backfill_primary_barcode.py
+# Recalcula products.primary_barcode a partir de product_barcodes, em lotes.
+# (Os triggers mantêm a coluna; use após importações feitas com triggers
+#  desligados ou para conferir uma base antiga.)
+#
+# Uso:
+#   python tools/backfill_primary_barcode.py [TAMANHO_DO_LOTE]
+import os, sys, time
+
+print(">>> backfill_primary_barcode: start", flush=True)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# o backfill é este script: a partida do app (inclusive o import de app.py)
+# só cria/migra o schema
+os.environ["DB_BACKFILL_ON_START"] = "0"
+
+from app import create_app
+from stockcontrol.db import get_conn, run_backfill
+
+chunk = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+app = create_app()
+with app.app_context():
+    conn = get_conn()
+    t0 = time.perf_counter()
+    n = run_backfill(conn, "backfill_primary_barcode", chunk=chunk, verbose=True)
+    print(f"[OK] {n} produtos recalculados em {time.perf_counter() - t0:.1f}s", flush=True)
+    conn.close()
+print(">>> backfill_primary_barcode: done", flush=True)
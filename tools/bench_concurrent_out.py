@@ -0,0 +1,123 @@
+# tools/bench_concurrent_out.py
+# Dispara N saídas (OUT) em paralelo contra um único produto e verifica
+# que o saldo nunca fica negativo e bate com o ledger.
+#
+# Uso:
+#   python tools/bench_concurrent_out.py                 -> 200 OUTs, 16 threads, estoque 50
+#   python tools/bench_concurrent_out.py N THREADS STOCK
+#   python tools/bench_concurrent_out.py --db=/tmp/bench.db ...  -> usa (e altera) essa base
+# Sem --db roda numa cópia temporária da base configurada (DB_PATH), apagada no fim.
+import os, shutil, sqlite3, sys, tempfile, time, threading
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+def _bench_db(argv):
+    """Tira --db=PATH de argv e define DB_PATH antes do import do app. -> pasta temporária ou None."""
+    for a in list(argv):
+        if a.startswith("--db="):
+            argv.remove(a)
+            os.environ["DB_PATH"] = a[len("--db="):]
+            return None
+    tmp = tempfile.mkdtemp(prefix="bench-out-")
+    dst = os.path.join(tmp, "bench.db")
+    src = os.environ.get("DB_PATH", "estoque.db")
+    if os.path.exists(src):
+        # backup do SQLite: cópia consistente mesmo com o app rodando (WAL)
+        s, d = sqlite3.connect(src), sqlite3.connect(dst)
+        s.backup(d)
+        d.close(); s.close()
+    os.environ["DB_PATH"] = dst
+    return tmp
+
+# antes de `from app import ...`: app.py já cria o app (e abre a base) no import
+TMP_DIR = _bench_db(sys.argv)
+
+from app import create_app
+from stockcontrol.db import get_conn
+from stockcontrol.utils import now_str
+from stockcontrol.services.inventory import post_movement, InsufficientStock
+
+SKU = "BENCH-OUT"
+
+def setup_product(stock):
+    conn = get_conn(); c = conn.cursor()
+    old = c.execute("SELECT id FROM products WHERE sku=?", (SKU,)).fetchone()
+    if old:
+        c.execute("DELETE FROM stock_movements WHERE product_id=?", (old["id"],))
+        c.execute("DELETE FROM products WHERE id=?", (old["id"],))
+    c.execute("""INSERT INTO products(sku, name, unit, price, avg_cost, min_qty, current_qty, created_at)
+                 VALUES(?,?,?,?,?,?,?,?)""", (SKU, "Bench concorrência", "un", 1.0, 0.0, 0.0, 0.0, now_str()))
+    pid = c.lastrowid
+    post_movement(pid, "IN", stock, 1.0, "Bench", "", conn=conn)
+    conn.commit(); conn.close()
+    return pid
+
+def cleanup(pid):
+    conn = get_conn(); c = conn.cursor()
+    c.execute("DELETE FROM stock_movements WHERE product_id=?", (pid,))
+    c.execute("DELETE FROM products WHERE id=?", (pid,))
+    conn.commit(); conn.close()
+
+def main():
+    n       = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    stock   = float(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    app = create_app()
+    with app.app_context():
+        pid = setup_product(stock)
+
+    lat = []
+    lat_lock = threading.Lock()
+    counts = {"ok": 0, "insufficient": 0, "error": 0}
+
+    def one(_):
+        with app.app_context():
+            t0 = time.perf_counter()
+            try:
+                post_movement(pid, "OUT", 1, None, "Bench", "")
+                key = "ok"
+            except InsufficientStock:
+                key = "insufficient"
+            except Exception as e:
+                print(f"!!! {e}", flush=True)
+                key = "error"
+            dt = time.perf_counter() - t0
+        with lat_lock:
+            counts[key] += 1
+            lat.append(dt)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(one, range(n)))
+    elapsed = time.perf_counter() - t0
+
+    with app.app_context():
+        conn = get_conn(); c = conn.cursor()
+        qty = float(c.execute("SELECT current_qty FROM products WHERE id=?", (pid,)).fetchone()["current_qty"])
+        ledger = c.execute("""SELECT COALESCE(SUM(CASE WHEN type='IN' THEN quantity ELSE -quantity END),0)
+                              FROM stock_movements WHERE product_id=?""", (pid,)).fetchone()[0]
+        conn.close()
+        cleanup(pid)
+
+    lat.sort()
+    p = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+    print(f"OUTs={n} threads={threads} estoque_inicial={stock}")
+    print(f"ok={counts['ok']} insuficiente={counts['insufficient']} erro={counts['error']}")
+    print(f"tempo={elapsed:.2f}s  vazão={n / elapsed:.0f}/s  p50={p(0.50):.1f}ms  p95={p(0.95):.1f}ms  p99={p(0.99):.1f}ms")
+    print(f"saldo final={qty}  saldo pelo ledger={ledger}")
+
+    assert qty >= 0, "Saldo ficou negativo!"
+    assert abs(qty - ledger) < 1e-9, "Saldo diverge do ledger!"
+    assert counts["ok"] == min(n, int(stock)), "Número de saídas aceitas inesperado"
+    print(">>> bench_concurrent_out: OK ✅", flush=True)
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        if TMP_DIR:
+            shutil.rmtree(TMP_DIR, ignore_errors=True)
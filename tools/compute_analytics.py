@@ -0,0 +1,30 @@
+# tools/compute_analytics.py
+# Recalcula o giro de todos os produtos (consumo médio, cobertura, ABC/XYZ) e
+# grava em product_analytics/product_consumption. Rode diariamente (cron).
+# Janelas e cortes vêm de ANALYTICS_* (config/variáveis de ambiente).
+#
+# Uso:
+#   python tools/compute_analytics.py
+import os, sys, time
+from collections import Counter
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import create_app
+from stockcontrol.services.analytics import run_analytics
+
+app = create_app()
+with app.app_context():
+    t0 = time.perf_counter()
+    res = run_analytics(app.config)
+    dt = time.perf_counter() - t0
+
+rows = res["rows"]
+abc = Counter(r["abc"] for r in rows)
+xyz = Counter(r["xyz"] or "-" for r in rows)
+print(f"[OK] {len(rows)} produtos em {dt:.2f}s (janelas {res['windows']} dias, cobertura {res['cover_days']}d, "
+      f"classes em {res['class_days']}d até {res['today']})")
+print("     ABC: " + "  ".join(f"{k}={abc[k]}" for k in "ABC")
+      + "   XYZ: " + "  ".join(f"{k}={xyz[k]}" for k in ("X", "Y", "Z", "-")))
@@ -0,0 +1,77 @@
+# tools/export_parquet.py
+# Exporta o ledger (movimentos) ou o catálogo (produtos) em Parquet tipado e
+# comprimido, lendo o SQLite em blocos (um row group por bloco). Requer pyarrow.
+#
+# Uso:
+#   python tools/export_parquet.py movimentos saida.parquet [--start=AAAA-MM-DD] [--end=AAAA-MM-DD]
+#   python tools/export_parquet.py movimentos pasta/ --partition=day|month   -> pasta/date=.../part-000.parquet
+#   python tools/export_parquet.py produtos produtos.parquet
+import os, sys, time
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import create_app
+from stockcontrol.db import get_conn
+from stockcontrol.services.exports import (
+    MOVEMENTS_SQL, PRODUCTS_SQL, movements_schema, products_schema, parquet_available,
+    write_parquet, write_parquet_partitioned,
+)
+
+USAGE = ("uso: python tools/export_parquet.py movimentos|produtos destino "
+         "[--start=AAAA-MM-DD] [--end=AAAA-MM-DD] [--partition=day|month] [--compression=zstd]")
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    flags = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+    if len(args) != 2 or args[0] not in ("movimentos", "produtos"):
+        print(USAGE)
+        sys.exit(2)
+    if not parquet_available():
+        print("[ERRO] pyarrow não instalado (pip install pyarrow).")
+        sys.exit(1)
+    kind, dest = args
+    partition = flags.get("partition")
+    if partition and kind != "movimentos":
+        print("[ERRO] --partition só vale para movimentos.")
+        sys.exit(2)
+
+    app = create_app()
+    with app.app_context():
+        cfg = app.config
+        opts = {"row_group_size": cfg.get("PARQUET_ROW_GROUP_SIZE", 65536),
+                "compression": flags.get("compression", cfg.get("PARQUET_COMPRESSION", "zstd"))}
+        conn = get_conn(); c = conn.cursor()
+        t0 = time.perf_counter()
+        if kind == "produtos":
+            c.execute(PRODUCTS_SQL)
+            result = write_parquet(c, products_schema(), dest, **opts)
+        else:
+            # idx_movs_ts: ordem por data (necessária para particionar) sem sort em memória
+            where, params = [], []
+            if flags.get("start"):
+                start = datetime.strptime(flags["start"], "%Y-%m-%d")
+                where.append("ts >= ?"); params.append(start.strftime("%Y-%m-%d"))
+            if flags.get("end"):
+                end = datetime.strptime(flags["end"], "%Y-%m-%d") + timedelta(days=1)
+                where.append("ts < ?"); params.append(end.strftime("%Y-%m-%d"))
+            where_sql = "WHERE " + " AND ".join(where) if where else ""
+            order = "ts, id" if (partition or where) else "id"
+            c.execute(MOVEMENTS_SQL.format(where=where_sql, order=order), params)
+            if partition:
+                result = write_parquet_partitioned(c, movements_schema(), dest, key_index=7, by=partition, **opts)
+            else:
+                result = write_parquet(c, movements_schema(), dest, **opts)
+        conn.close()
+        dt = time.perf_counter() - t0
+
+    if isinstance(result, dict):
+        print(f"[OK] {sum(result.values())} linhas em {len(result)} partições -> {dest} ({dt:.2f}s)")
+    else:
+        size = os.path.getsize(dest) / 1024 / 1024
+        print(f"[OK] {result} linhas -> {dest} ({size:.1f} MB, {dt:.2f}s)")
+
+if __name__ == "__main__":
+    main()
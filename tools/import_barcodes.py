@@ -0,0 +1,53 @@
+# tools/import_barcodes.py
+# Importa um catálogo de códigos de barras (ex.: GTINs do fornecedor) numa única transação.
+#
+# Uso:
+#   python tools/import_barcodes.py arquivo.csv|arquivo.xlsx [--dry-run] [--skip-invalid] [--on-conflict=error|skip|update]
+#
+# Colunas: product_id|sku, code, symbology, pack_qty, label, is_primary
+import os, sys, time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import create_app
+from stockcontrol.services.catalog import import_barcodes_bulk, read_table_rows
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    flags = {a.split("=", 1)[0]: (a.split("=", 1)[1] if "=" in a else "1")
+             for a in sys.argv[1:] if a.startswith("--")}
+    if not args:
+        print("uso: python tools/import_barcodes.py arquivo.csv|arquivo.xlsx [--dry-run] [--skip-invalid] [--on-conflict=error|skip|update]")
+        sys.exit(2)
+
+    try:
+        with open(args[0], "rb") as f:
+            rows = read_table_rows(f, args[0])
+    except ValueError as e:
+        print(f"[ERRO] {e}")
+        sys.exit(2)
+
+    app = create_app()
+    with app.app_context():
+        t0 = time.perf_counter()
+        report = import_barcodes_bulk(
+            rows,
+            on_conflict=flags.get("--on-conflict", "error"),
+            skip_invalid="--skip-invalid" in flags,
+            dry_run="--dry-run" in flags,
+        )
+        dt = time.perf_counter() - t0
+
+    for e in report["errors"][:50]:
+        print(f"[ERRO] linha {e['line']}: {e['error']}")
+    if len(report["errors"]) > 50:
+        print(f"... +{len(report['errors']) - 50} erros")
+    print(f"[{'DRY-RUN' if report['dry_run'] else 'OK'}] recebidas={report['received']} "
+          f"inseridos={report['inserted']} atualizados={report['updated']} ignorados={report['skipped']} "
+          f"erros={len(report['errors'])} tempo={dt:.2f}s")
+    sys.exit(1 if report["errors"] and not (report["inserted"] or report["updated"]) else 0)
+
+if __name__ == "__main__":
+    main()
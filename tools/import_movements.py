@@ -0,0 +1,53 @@
+# tools/import_movements.py
+# Importa movimentos de um CSV ou XLSX (ex.: exportação noturna do ERP) numa única transação.
+#
+# Uso:
+#   python tools/import_movements.py arquivo.csv|arquivo.xlsx [--dry-run] [--skip-invalid] [--allow-negative]
+#
+# Colunas: product_id|sku|barcode, type (IN/OUT), quantity, unit_cost, reason, note, ts
+import os, sys, time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import create_app
+from stockcontrol.services.catalog import read_table_rows
+from stockcontrol.services.inventory import post_movements_bulk
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    flags = {a for a in sys.argv[1:] if a.startswith("--")}
+    if not args:
+        print("uso: python tools/import_movements.py arquivo.csv|arquivo.xlsx [--dry-run] [--skip-invalid] [--allow-negative]")
+        sys.exit(2)
+
+    try:
+        with open(args[0], "rb") as f:
+            rows = read_table_rows(f, args[0])
+    except ValueError as e:
+        print(f"[ERRO] {e}")
+        sys.exit(2)
+
+    app = create_app()
+    with app.app_context():
+        t0 = time.perf_counter()
+        report = post_movements_bulk(
+            rows,
+            allow_negative="--allow-negative" in flags,
+            skip_invalid="--skip-invalid" in flags,
+            dry_run="--dry-run" in flags,
+        )
+        dt = time.perf_counter() - t0
+
+    for e in report["errors"][:50]:
+        print(f"[ERRO] linha {e['line']}: {e['error']}")
+    if len(report["errors"]) > 50:
+        print(f"... +{len(report['errors']) - 50} erros")
+    print(f"[{'DRY-RUN' if report['dry_run'] else 'OK'}] recebidas={report['received']} "
+          f"lançadas={report['posted']} produtos={report['products']} "
+          f"erros={len(report['errors'])} tempo={dt:.2f}s")
+    sys.exit(1 if report["errors"] and not report["posted"] else 0)
+
+if __name__ == "__main__":
+    main()
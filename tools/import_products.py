@@ -0,0 +1,49 @@
+# tools/import_products.py
+# Cadastro em lote de produtos (CSV ou XLSX) numa única transação, upsert por sku.
+# Categorias/fornecedores são resolvidos por nome (e criados se faltarem).
+#
+# Uso:
+#   python tools/import_products.py arquivo.csv|arquivo.xlsx [--dry-run] [--skip-invalid]
+#
+# Colunas: sku, name, category|category_id, supplier|supplier_id, unit, price, min_qty, qty, unit_cost
+import os, sys, time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import create_app
+from stockcontrol.services.catalog import import_products_bulk, read_table_rows
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    flags = {a for a in sys.argv[1:] if a.startswith("--")}
+    if not args:
+        print("uso: python tools/import_products.py arquivo.csv|arquivo.xlsx [--dry-run] [--skip-invalid]")
+        sys.exit(2)
+
+    try:
+        with open(args[0], "rb") as f:
+            rows = read_table_rows(f, args[0])
+    except ValueError as e:
+        print(f"[ERRO] {e}")
+        sys.exit(2)
+
+    app = create_app()
+    with app.app_context():
+        t0 = time.perf_counter()
+        report = import_products_bulk(rows, skip_invalid="--skip-invalid" in flags, dry_run="--dry-run" in flags)
+        dt = time.perf_counter() - t0
+
+    for e in report["errors"][:50]:
+        print(f"[ERRO] linha {e['line']}: {e['error']}")
+    if len(report["errors"]) > 50:
+        print(f"... +{len(report['errors']) - 50} erros")
+    print(f"[{'DRY-RUN' if report['dry_run'] else 'OK'}] recebidas={report['received']} "
+          f"criados={report['created']} atualizados={report['updated']} saldo_inicial={report['opening']} "
+          f"categorias_novas={report['categories_created']} fornecedores_novos={report['suppliers_created']} "
+          f"erros={len(report['errors'])} tempo={dt:.2f}s")
+    sys.exit(1 if report["errors"] and not (report["created"] or report["updated"]) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# tools/migrate_ts_epoch.py
+# Preenche stock_movements.ts_epoch em lotes (rodar antes de subir a versão
+# nova em bases grandes, com DB_BACKFILL_ON_START=0, para a partida não fazer o backfill).
+#
+# Uso:
+#   python tools/migrate_ts_epoch.py [TAMANHO_DO_LOTE]
+import os, sys, time
+
+print(">>> migrate_ts_epoch: start", flush=True)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# o backfill é este script: a partida do app (inclusive o import de app.py)
+# só cria/migra o schema
+os.environ["DB_BACKFILL_ON_START"] = "0"
+
+from app import create_app
+from stockcontrol.db import get_conn, run_backfill
+
+chunk = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+app = create_app()
+with app.app_context():
+    conn = get_conn()
+    t0 = time.perf_counter()
+    n = run_backfill(conn, "backfill_ts_epoch", chunk=chunk, verbose=True)
+    print(f"[OK] {n} linhas preenchidas em {time.perf_counter() - t0:.1f}s", flush=True)
+    row = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM stock_movements "
+                       "WHERE product_id=? AND ts_epoch >= ? ORDER BY ts_epoch DESC", (1, 0)).fetchall()
+    for r in row:
+        print(f"[PLAN] {r['detail']}", flush=True)
+    conn.close()
+print(">>> migrate_ts_epoch: done", flush=True)
@@ -11,12 +11,15 @@ if PROJECT_ROOT not in sys.path:
 
 from app import create_app
 
+FAILED = []
+
 def hit(client, method, path, expect=(200, 302), **kwargs):
     m = getattr(client, method.lower())
     r = m(path, **kwargs)
     ok = r.status_code in (expect if isinstance(expect, (list, tuple, set)) else (expect,))
     print(f"{method:6} {path:35} -> {r.status_code}{' OK' if ok else ' !!'}", flush=True)
     if not ok:
+        FAILED.append(f"{method} {path} -> {r.status_code}")
         # ajuda a debugar rapidamente
         try:
             txt = r.get_data(as_text=True)
@@ -45,12 +48,42 @@ with app.app_context():
             "/", "/novo",
             "/categorias/", "/fornecedores/", "/usuarios/",
             "/relatorios/baixo-estoque", "/relatorios/valorizacao",
+            "/relatorios/posicao", "/relatorios/posicao?formato=csv", "/relatorios/posicao?formato=csv&gzip=1",
+            "/relatorios/painel", "/relatorios/painel?formato=json",
             "/export/produtos.csv", "/export/movimentos.csv",
-            "/produto/1", "/editar/1",
+            "/produto/1", "/editar/1", "/status/",
         ]:
             hit(client, "GET", path, expect=(200, 404))  # /produto/1 pode não existir -> 404 aceitável
 
+        # opção com tipo errado no JSON: 400, não 500
+        r = hit(client, "POST", "/barcodes/importar", json={"rows": [], "on_conflict": 1}, expect=400)
+        assert r.status_code == 400, f"on_conflict numérico -> {r.status_code}"
+
+        # Importações em lote com o writer estourando o prazo: 503 (nada gravado) /
+        # 409 (pode ter gravado), nunca 500
+        from stockcontrol.db_writer import WriteTimeout, WriteOutcomeUnknown
+        from stockcontrol.services import catalog, inventory
+        bulk = [
+            ("/movimentos/lote", [{"sku": "SMOKE-1", "type": "IN", "quantity": 1, "unit_cost": 1}]),
+            ("/produtos/importar", [{"sku": "SMOKE-1", "name": "Smoke"}]),
+            ("/barcodes/importar", [{"sku": "SMOKE-1", "code": "7891234567895"}]),
+        ]
+        saved = catalog.run_write, inventory.run_write
+        try:
+            for exc, status in ((WriteTimeout, 503), (WriteOutcomeUnknown, 409)):
+                def _late(fn, exc=exc):
+                    raise exc("prazo do writer (smoke)")
+                catalog.run_write = inventory.run_write = _late
+                for path, rows in bulk:
+                    r = hit(client, "POST", path, json=rows, expect=status)
+                    assert r.status_code == status, f"{path} com {exc.__name__} -> {r.status_code}"
+        finally:
+            catalog.run_write, inventory.run_write = saved
+
         # Logout
         hit(client, "POST", "/logout", follow_redirects=True, expect=(200, 302))
 
 print(">>> smoke_test finalizado", flush=True)
+if FAILED:
+    print(f">>> {len(FAILED)} falha(s): " + "; ".join(FAILED), flush=True)
+    sys.exit(1)
@@ -0,0 +1,70 @@
+# tools/stock_asof.py
+# Posição do estoque (qtd e valor a CMP) no fim de uma data, reconstruída do
+# ledger a partir do checkpoint mensal mais próximo.
+#
+# Uso:
+#   python tools/stock_asof.py 2024-12-31 [--csv=posicao.csv] [--sem-checkpoint]
+#   python tools/stock_asof.py --build-checkpoints [--ate=AAAA-MM-DD]   (ex.: cron diário/mensal)
+#   python tools/stock_asof.py --listar-checkpoints
+import csv, os, sys, time
+from datetime import datetime
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from app import create_app
+from stockcontrol.services.asof import build_checkpoints, list_checkpoints, position_rows
+
+USAGE = ("uso: python tools/stock_asof.py AAAA-MM-DD [--csv=arquivo] [--sem-checkpoint]\n"
+         "     python tools/stock_asof.py --build-checkpoints [--ate=AAAA-MM-DD]\n"
+         "     python tools/stock_asof.py --listar-checkpoints")
+
+def _date(s):
+    try:
+        return datetime.strptime(s, "%Y-%m-%d").date()
+    except ValueError:
+        print(f"[ERRO] Data inválida: {s} (use AAAA-MM-DD).")
+        sys.exit(2)
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    flags = dict((a[2:].split("=", 1) + [""])[:2] for a in sys.argv[1:] if a.startswith("--"))
+
+    app = create_app()
+    with app.app_context():
+        chunk = app.config.get("ASOF_CHUNK_SIZE", 50000)
+        t0 = time.perf_counter()
+        if "build-checkpoints" in flags:
+            until = _date(flags["ate"]) if flags.get("ate") else None
+            saved = build_checkpoints(until, chunk_size=chunk, verbose=True)
+            print(f"[OK] {len(saved)} checkpoints gravados ({time.perf_counter() - t0:.2f}s)")
+            return
+        if "listar-checkpoints" in flags:
+            for r in list_checkpoints():
+                print(f"{r['cutoff']}  {r['items']:>8} produtos  (gerado em {r['created_at']})")
+            return
+        if len(args) != 1:
+            print(USAGE)
+            sys.exit(2)
+
+        day = _date(args[0])
+        pos, rows, categories = position_rows(day, use_checkpoints="sem-checkpoint" not in flags,
+                                              chunk_size=chunk)
+        dt = time.perf_counter() - t0
+
+    if flags.get("csv"):
+        header = ["id", "sku", "name", "unit", "category_id", "qty", "avg_cost", "value"]
+        with open(flags["csv"], "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            w.writerows([r[k] for k in header] for r in rows)
+    for g in categories:
+        print(f"{g['name'][:30]:<30} {g['items']:>7} itens  qtd {g['qty']:>14.2f}  R$ {g['total_cost']:>16.2f}")
+    base = f"checkpoint {pos.checkpoint}" if pos.checkpoint else "sem checkpoint"
+    print(f"[OK] posição em {day}: {len(rows)} produtos, qtd {sum(g['qty'] for g in categories):.2f}, "
+          f"R$ {sum(g['total_cost'] for g in categories):.2f} "
+          f"({base} + {pos.movements} movimentos, {dt:.2f}s)")
+
+if __name__ == "__main__":
+    main()
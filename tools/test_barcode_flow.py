@@ -92,4 +92,32 @@ if __name__ == "__main__":
             print(f"qty após saída: {qty2} (antes {qty1})")
             assert qty2 == qty1 - 2, "Quantidade não diminuiu corretamente após SAÍDA por barcode"
 
+            # GS1 com AI numérico malformado ((30) com letras): não é GS1, nunca 500
+            bad = f"(01)0{BARCODE}(30)AB"
+            for path, data in (("/scan", {"barcode": bad}),
+                               (f"/entrada/{pid}", {"barcode": bad, "qtd": "1", "unit_cost": "1.00"}),
+                               (f"/saida/{pid}", {"barcode": bad, "qtd": "1"})):
+                r = client.post(path, data=data, follow_redirects=False)
+                print(f"POST {path} (GS1 malformado) -> {r.status_code}")
+                assert r.status_code < 500, f"{path} quebrou com GS1 malformado"
+            assert get_qty(pid) == qty2, "GS1 malformado não deveria movimentar estoque"
+            # o mesmo com (30) válido resolve pelo GTIN do AI (01)
+            r = client.post("/scan", data={"barcode": f"(01)0{BARCODE}(30)5"}, follow_redirects=False)
+            print(f"POST /scan (GS1 (30)5) -> {r.status_code}")
+            assert f"/produto/{pid}" in r.headers.get("Location", ""), "GS1 válido não achou o produto"
+
+            # export incremental: since_ts ISO com 'T' == com espaço, com e sem product_id
+            today = now_str()[:10]
+            counts = {}
+            for since in (f"{today} 00:00:00", f"{today}T00:00"):
+                for extra in ("", f"&product_id={pid}"):
+                    r = client.get(f"/export/movimentos.csv?since_ts={since}{extra}")
+                    assert r.status_code == 200, f"export since_ts={since}{extra} -> {r.status_code}"
+                    counts[(since, extra)] = len(r.get_data(as_text=True).splitlines()) - 1
+            print(f"GET /export/movimentos.csv since_ts -> {sorted(set(counts.values()))} linhas")
+            assert len(set(counts.values())) == 1 and min(counts.values()) >= 2, \
+                f"since_ts filtra diferente conforme o formato/product_id: {counts}"
+            r = client.get("/export/movimentos.csv?since_ts=ontem")
+            assert r.status_code == 400, "since_ts inválido deveria dar 400"
+
             print(">>> teste de fluxo por barcode: OK ✅", flush=True)